@@ -1,11 +1,18 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 # from starlette.middleware.sessions import SessionMiddleware
 from blueprint.order import order
 from blueprint.orderSocket import audioWS
-from blueprint.token import token
+from blueprint.token import token, TokenInvalid
 from blueprint.payment import payment
+from blueprint.metrics import metrics
+from blueprint.health import health
+from store.redis_pool import close_redis, redis_client
+from store.token_cache import start_revocation_listener, stop_revocation_listener
+from warmup import start_warmup, stop_warmup
+import logging
 import os
 
 # 初始化 FastAPI 應用
@@ -35,11 +42,45 @@ app.add_middleware(
 # )
 
 
+@app.exception_handler(TokenInvalid)
+async def token_invalid_handler(request: Request, exc: TokenInvalid):
+    logging.getLogger(__name__).info(f"Token verification failed: {exc.detail}")
+    return JSONResponse(
+        content={"error": "Invalid or expired token"},
+        status_code=401
+    )
+
+
+@app.on_event("startup")
+async def startup():
+    # 每個 worker 在自己的行程裡背景預熱嵌入模型、向量庫、菜單、LLM 等資源，啟動不等待；進度看 /readyz
+    start_warmup()
+    # 訂閱 token 撤銷通知，訂閱成功後才啟用 token 驗證快取
+    start_revocation_listener(redis_client())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_warmup()
+    await stop_revocation_listener()
+    # 關閉共用的 Redis 連線池
+    await close_redis()
+
+
 # 包含路由
 app.include_router(order, prefix="/order")
 app.include_router(token)
 app.include_router(audioWS)
 app.include_router(payment)
+app.include_router(metrics)
+app.include_router(health)
 
 if __name__ == '__main__':
-    uvicorn.run(app, host='loaclhost', port=8000)
+    # WEB_CONCURRENCY > 1 時開多個 worker（需要用 "app:app" 字串讓每個 worker 自己 import）
+    workers = int(os.getenv('WEB_CONCURRENCY', 1))
+    uvicorn.run(
+        "app:app" if workers > 1 else app,
+        host=os.getenv('HOST', 'localhost'),
+        port=int(os.getenv('PORT', 8000)),
+        workers=workers,
+    )
@@ -0,0 +1,254 @@
+# File: audio_stage.py
+# /asr websocket 與 ASR 之間的音訊處理：
+#   1. 把前端送來大小不一的 PCM 片段切成固定長度的 frame（預設 100 ms），整段對齊的部分直接用 memoryview 切原本的 bytes，不複製
+#   2. 語音偵測（VAD）：說話時照常送出；說完後保留一小段尾音讓 ASR 判斷斷句，之後的長時間靜音不送，
+#      只保留最近一小段當作下一句的開頭（pre-roll），並定時送一格維持串流不逾時
+#   3. 有上限的佇列：ASR 跟不上時 websocket 的接收會等待（背壓），等太久才丟最舊的 frame，維持即時
+# 音訊格式與前端一致：16 kHz、16-bit little-endian、單聲道。
+# VAD 預設用能量（RMS 對背景噪音自動調整門檻）；有安裝 webrtcvad 時可設 AUDIO_VAD=webrtc。
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+FRAME_MS = int(os.getenv('AUDIO_FRAME_MS', 100))
+# energy / webrtc / off（off 時所有音訊都送出）
+AUDIO_VAD = os.getenv('AUDIO_VAD', 'energy')
+# 佇列最多放幾個 frame（100 ms × 50 = 5 秒），滿了之後最多等多久才丟最舊的
+AUDIO_QUEUE_FRAMES = int(os.getenv('AUDIO_QUEUE_FRAMES', 50))
+AUDIO_PUT_TIMEOUT = float(os.getenv('AUDIO_PUT_TIMEOUT', 0.5))
+# 說話開始前補送多少、說完後繼續送多少靜音、靜音期間多久送一格維持串流（毫秒）
+PREROLL_MS = int(os.getenv('AUDIO_PREROLL_MS', 300))
+HANGOVER_MS = int(os.getenv('AUDIO_HANGOVER_MS', 800))
+KEEPALIVE_MS = int(os.getenv('AUDIO_KEEPALIVE_MS', 4000))
+
+
+def frame_bytes(frame_ms: int = FRAME_MS) -> int:
+    return SAMPLE_RATE * SAMPLE_WIDTH * frame_ms // 1000
+
+
+class FrameAggregator:
+    """
+    把任意大小的片段切成固定長度的 frame。
+    傳入的片段必須是不可變的 bytes（websocket.receive_bytes() 的回傳值），回傳的 memoryview 直接指向它；
+    只有跨片段的 frame 會複製到新的 bytearray。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._partial = bytearray(size)
+        self._filled = 0
+
+    def push(self, chunk: bytes) -> List[memoryview]:
+        view = memoryview(chunk)
+        frames = []
+        if self._filled:
+            take = min(self.size - self._filled, len(view))
+            self._partial[self._filled:self._filled + take] = view[:take]
+            self._filled += take
+            view = view[take:]
+            if self._filled < self.size:
+                return frames
+            frames.append(memoryview(self._partial))
+            # 已交出去的 frame 不能再被覆寫，換一塊新的
+            self._partial = bytearray(self.size)
+            self._filled = 0
+        whole = len(view) - len(view) % self.size
+        frames.extend(view[start:start + self.size] for start in range(0, whole, self.size))
+        rest = view[whole:]
+        if len(rest):
+            self._partial[:len(rest)] = rest
+            self._filled = len(rest)
+        return frames
+
+    def flush(self) -> Optional[memoryview]:
+        """串流結束時剩下不滿一個 frame 的部分"""
+        if not self._filled:
+            return None
+        tail = memoryview(self._partial)[:self._filled]
+        self._partial = bytearray(self.size)
+        self._filled = 0
+        return tail
+
+
+class EnergyVAD:
+    """RMS 能量高於背景噪音一定幅度才算說話；背景噪音下降時立即跟上、上升時慢慢跟上"""
+
+    def __init__(self, margin_db: float = 12.0, min_db: float = -50.0):
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.noise_db = -60.0
+
+    def is_speech(self, frame: memoryview) -> bool:
+        samples = np.frombuffer(frame, dtype='<i2').astype(np.float32)
+        if not samples.size:
+            return False
+        db = 10.0 * np.log10(float(np.mean(samples * samples)) / (32768.0 ** 2) + 1e-12)
+        speech = db > max(self.noise_db + self.margin_db, self.min_db)
+        if db < self.noise_db:
+            self.noise_db = db
+        elif not speech:
+            self.noise_db += (db - self.noise_db) * 0.05
+        return speech
+
+
+class WebRtcVAD:
+    """webrtcvad 只接受 10/20/30 ms，把一個 frame 切成 20 ms 逐段判斷，三成以上是說話就算說話"""
+
+    def __init__(self, aggressiveness: int = int(os.getenv('AUDIO_VAD_AGGRESSIVENESS', 2))):
+        self._vad = webrtcvad.Vad(aggressiveness)
+        self._step = frame_bytes(20)
+
+    def is_speech(self, frame: memoryview) -> bool:
+        steps = len(frame) // self._step
+        if not steps:
+            return False
+        voiced = sum(self._vad.is_speech(bytes(frame[i * self._step:(i + 1) * self._step]), SAMPLE_RATE)
+                     for i in range(steps))
+        return voiced / steps >= 0.3
+
+
+def create_vad(kind: str = AUDIO_VAD):
+    if kind == 'off':
+        return None
+    if kind == 'webrtc':
+        if webrtcvad is not None:
+            return WebRtcVAD()
+        logger.warning("webrtcvad not installed, falling back to energy VAD")
+    return EnergyVAD()
+
+
+class SilenceGate:
+    """依 VAD 結果決定哪些 frame 要送給 ASR"""
+
+    def __init__(self, frame_ms: int = FRAME_MS, preroll_ms: int = PREROLL_MS,
+                 hangover_ms: int = HANGOVER_MS, keepalive_ms: int = KEEPALIVE_MS):
+        self.frame_ms = frame_ms
+        self.hangover_ms = hangover_ms
+        self.keepalive_ms = keepalive_ms
+        self.speaking = False
+        self._preroll: Deque[memoryview] = deque(maxlen=max(preroll_ms // frame_ms, 0) or None)
+        self._silence_ms = 0
+        self._held_ms = 0
+
+    def push(self, frame: memoryview, speech: bool) -> List[memoryview]:
+        if speech:
+            out = list(self._preroll)
+            out.append(frame)
+            self._preroll.clear()
+            self.speaking, self._silence_ms, self._held_ms = True, 0, 0
+            return out
+        if self.speaking:
+            self._silence_ms += self.frame_ms
+            if self._silence_ms <= self.hangover_ms:
+                return [frame]
+            self.speaking = False
+        if self._preroll.maxlen:
+            self._preroll.append(frame)
+        self._held_ms += self.frame_ms
+        if self._held_ms >= self.keepalive_ms:
+            self._held_ms = 0
+            return [self._preroll.pop() if self._preroll else frame]
+        return []
+
+
+_totals = {"streams": 0, "active": 0, "bytes_in": 0, "frames_in": 0, "frames_sent": 0,
+           "speech_frames": 0, "queue_drops": 0, "max_queue_depth": 0}
+
+
+class AudioStage:
+    """
+    websocket 端呼叫 feed()/close()，ASR 端從 queue 取出 memoryview frame（None 表示結束）。
+    每個連線一個。
+    """
+
+    def __init__(self, maxsize: int = AUDIO_QUEUE_FRAMES, put_timeout: float = AUDIO_PUT_TIMEOUT,
+                 vad: str = AUDIO_VAD, frame_ms: int = FRAME_MS):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.put_timeout = put_timeout
+        self._aggregator = FrameAggregator(frame_bytes(frame_ms))
+        self._vad = create_vad(vad)
+        self._gate = SilenceGate(frame_ms=frame_ms)
+        self._closed = False
+        # 最後一個有聲音的 frame 進來的時間，ASR 後端用來計算斷句延遲
+        self.last_speech_at: Optional[float] = None
+        self.stats = {"bytes_in": 0, "frames_in": 0, "frames_sent": 0, "speech_frames": 0,
+                      "queue_drops": 0, "max_queue_depth": 0}
+        _totals["streams"] += 1
+        _totals["active"] += 1
+
+    async def feed(self, chunk: bytes):
+        self.stats["bytes_in"] += len(chunk)
+        for frame in self._aggregator.push(chunk):
+            self.stats["frames_in"] += 1
+            speech = self._vad is None or self._vad.is_speech(frame)
+            if speech:
+                self.stats["speech_frames"] += 1
+                self.last_speech_at = time.perf_counter()
+            for out in self._gate.push(frame, speech):
+                await self._put(out)
+
+    async def _put(self, item: Optional[memoryview]):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                # 背壓：ASR 跟不上時先等，websocket 這段時間不會再讀取新的音訊
+                await asyncio.wait_for(self.queue.put(item), self.put_timeout)
+            except asyncio.TimeoutError:
+                # 等太久就丟最舊的，維持即時
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.queue.put_nowait(item)
+                self.stats["queue_drops"] += 1
+        if item is not None:
+            self.stats["frames_sent"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue.qsize())
+
+    async def close(self):
+        """送出剩下的音訊與結束訊號，可重複呼叫"""
+        if self._closed:
+            return
+        self._closed = True
+        tail = self._aggregator.flush()
+        if tail is not None and (self._gate.speaking or self._vad is None):
+            await self._put(tail)
+        await self._put(None)
+        _totals["active"] -= 1
+        for key, value in self.stats.items():
+            if key == "max_queue_depth":
+                _totals[key] = max(_totals[key], value)
+            else:
+                _totals[key] += value
+        logger.info(f"audio stream closed: {self.summary()}")
+
+    def summary(self) -> Dict:
+        frames_in = self.stats["frames_in"]
+        return {
+            **self.stats,
+            "audio_s": round(self.stats["bytes_in"] / (SAMPLE_RATE * SAMPLE_WIDTH), 2),
+            "sent_ratio": round(self.stats["frames_sent"] / frames_in, 3) if frames_in else None,
+        }
+
+
+def audio_stats() -> Dict:
+    frames_in = _totals["frames_in"]
+    return {
+        **_totals,
+        "frame_ms": FRAME_MS,
+        "vad": AUDIO_VAD,
+        "sent_ratio": round(_totals["frames_sent"] / frames_in, 3) if frames_in else None,
+    }
@@ -0,0 +1,85 @@
+# File: deepgram_asr.py
+# Deepgram 即時辨識：is_final 的片段累積起來，speech_final（偵測到說完）時整句交給 on_final
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from deepgram import DeepgramClient, LiveOptions, LiveTranscriptionEvents
+
+from .audio_stage import SAMPLE_RATE, AudioStage
+from .engine import ASREngine, FinalHandler, InterimHandler
+
+logger = logging.getLogger(__name__)
+
+DEEPGRAM_MODEL = os.getenv('DEEPGRAM_MODEL', 'nova-2')
+DEEPGRAM_LANGUAGE = os.getenv('DEEPGRAM_LANGUAGE', 'zh-TW')
+# 靜音多久（毫秒）算說完
+DEEPGRAM_ENDPOINTING = int(os.getenv('DEEPGRAM_ENDPOINTING', 300))
+
+
+class DeepgramASR(ASREngine):
+    name = "deepgram"
+
+    async def _recognize(self, stage: AudioStage, on_final: FinalHandler,
+                         on_interim: Optional[InterimHandler]):
+        api_key = os.getenv("DEEPGRAM_API_KEY")
+        if not api_key:
+            raise ValueError("DEEPGRAM_API_KEY is not set in the environment variables.")
+        connection = DeepgramClient(api_key).listen.asyncwebsocket.v("1")
+        # 回呼在 SDK 的接收迴圈裡執行，交給這裡的佇列依序處理，避免 LLM 呼叫卡住接收
+        events: asyncio.Queue = asyncio.Queue()
+        segments: List[str] = []
+
+        async def on_transcript(_, result, **kwargs):
+            transcript = result.channel.alternatives[0].transcript
+            await events.put((transcript, result.is_final, getattr(result, "speech_final", False)))
+
+        async def on_error(_, error, **kwargs):
+            logger.error(f"Deepgram error: {error}")
+
+        connection.on(LiveTranscriptionEvents.Transcript, on_transcript)
+        connection.on(LiveTranscriptionEvents.Error, on_error)
+        options = LiveOptions(
+            model=DEEPGRAM_MODEL,
+            language=DEEPGRAM_LANGUAGE,
+            encoding="linear16",
+            sample_rate=SAMPLE_RATE,
+            channels=1,
+            punctuate=True,
+            interim_results=True,
+            endpointing=DEEPGRAM_ENDPOINTING,
+        )
+        if not await connection.start(options):
+            raise ConnectionError("Could not start Deepgram live transcription")
+
+        async def send_audio():
+            try:
+                while True:
+                    frame = await stage.queue.get()
+                    if frame is None:
+                        break
+                    await connection.send(bytes(frame))
+                    stage.queue.task_done()
+            finally:
+                await connection.finish()
+                await events.put(None)
+
+        async def handle_events():
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                transcript, is_final, speech_final = event
+                if is_final and transcript:
+                    segments.append(transcript)
+                if speech_final and segments:
+                    text = "".join(segments)
+                    segments.clear()
+                    await self._final(text, on_final)
+                elif not is_final and transcript:
+                    await self._interim("".join(segments) + transcript, None, on_interim)
+            if segments:
+                await self._final("".join(segments), on_final)
+
+        await asyncio.gather(send_audio(), handle_events())
@@ -0,0 +1,121 @@
+# File: engine.py
+# ASR 後端介面：/asr 只透過 create_engine() 取得辨識引擎，由 ASR_BACKEND 決定用哪一個
+#   google   - Google Cloud Speech 串流辨識（asr/google_asr.py）
+#   deepgram - Deepgram 即時辨識（asr/deepgram_asr.py）
+#   local    - 本機 CPU 的 faster-whisper，不需要網路（asr/local_asr.py），可用來離線跑完整語音流程與壓測
+# 每個引擎都從 AudioStage 的佇列讀取 frame（None 表示結束），辨識出完整句子時呼叫 on_final、
+# 中間結果呼叫 on_interim。延遲以「顧客最後一個有聲音的 frame」到「收到最終結果」計算，依後端分開統計。
+import importlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from .audio_stage import AudioStage
+
+logger = logging.getLogger(__name__)
+
+ASR_BACKEND = os.getenv('ASR_BACKEND', 'google')
+
+FinalHandler = Callable[[str], Awaitable[None]]
+InterimHandler = Callable[[str, Optional[float]], Awaitable[None]]
+
+# 名稱 → "模組:類別"，用到才 import，沒裝的 SDK 不會影響其他後端
+ENGINES = {
+    "google": "asr.google_asr:GoogleASR",
+    "deepgram": "asr.deepgram_asr:DeepgramASR",
+    "local": "asr.local_asr:LocalWhisperASR",
+}
+
+
+class ASRStats:
+    """各後端的最終結果延遲與錯誤數（本 process）"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._window = window
+        self._latency: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        # 本機引擎的解碼時間與音訊長度，算 real-time factor
+        self._decode: Dict[str, list] = {}
+
+    def _count(self, backend: str, key: str):
+        counts = self._counts.setdefault(backend, {"sessions": 0, "finals": 0, "interims": 0, "errors": 0})
+        counts[key] += 1
+
+    def record(self, backend: str, key: str, latency: Optional[float] = None):
+        with self._lock:
+            self._count(backend, key)
+            if latency is not None:
+                self._latency.setdefault(backend, deque(maxlen=self._window)).append(latency)
+
+    def record_decode(self, backend: str, audio_seconds: float, decode_seconds: float):
+        with self._lock:
+            totals = self._decode.setdefault(backend, [0.0, 0.0])
+            totals[0] += audio_seconds
+            totals[1] += decode_seconds
+
+    def stats(self) -> Dict:
+        with self._lock:
+            result = {}
+            for backend, counts in self._counts.items():
+                ordered = sorted(self._latency.get(backend, ()))
+                result[backend] = {**counts, "final_latency": {
+                    "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[int(len(ordered) * 0.95)] * 1000, 1),
+                } if ordered else None}
+                if backend in self._decode and self._decode[backend][0]:
+                    audio_seconds, decode_seconds = self._decode[backend]
+                    result[backend]["rtf"] = round(decode_seconds / audio_seconds, 3)
+            return result
+
+
+asr_stats = ASRStats()
+
+
+class ASREngine:
+    """每個 /asr 連線建立一個；子類別實作 _recognize()"""
+
+    name = "base"
+
+    def __init__(self):
+        self._stage: Optional[AudioStage] = None
+
+    async def recognize(self, stage: AudioStage, on_final: FinalHandler,
+                        on_interim: Optional[InterimHandler] = None):
+        self._stage = stage
+        asr_stats.record(self.name, "sessions")
+        try:
+            await self._recognize(stage, on_final, on_interim)
+        except Exception:
+            asr_stats.record(self.name, "errors")
+            raise
+
+    async def _recognize(self, stage: AudioStage, on_final: FinalHandler,
+                         on_interim: Optional[InterimHandler]):
+        raise NotImplementedError
+
+    async def _final(self, text: str, on_final: FinalHandler):
+        """子類別取得最終結果時呼叫，順便記錄延遲"""
+        last_speech = self._stage.last_speech_at if self._stage else None
+        latency = time.perf_counter() - last_speech if last_speech is not None else None
+        asr_stats.record(self.name, "finals", latency)
+        logger.info(f"{self.name} ASR final ({latency * 1000 if latency is not None else float('nan'):.0f} ms "
+                    f"after speech): '{text}'")
+        await on_final(text)
+
+    async def _interim(self, text: str, stability: Optional[float], on_interim: Optional[InterimHandler]):
+        asr_stats.record(self.name, "interims")
+        if on_interim is not None:
+            await on_interim(text, stability)
+
+
+def create_engine(name: Optional[str] = None) -> ASREngine:
+    name = name or ASR_BACKEND
+    if name not in ENGINES:
+        raise ValueError(f"Unknown ASR backend: {name} (choose from {', '.join(ENGINES)})")
+    module_name, class_name = ENGINES[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
@@ -0,0 +1,78 @@
+# File: google_asr.py
+# Google Cloud Speech 串流辨識（zh-TW，連續辨識並回傳中間結果）
+import logging
+import os
+from typing import Optional
+
+from google.cloud import speech
+
+from .audio_stage import SAMPLE_RATE, AudioStage
+from .engine import ASREngine, FinalHandler, InterimHandler
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ASR_LANGUAGE = os.getenv('GOOGLE_ASR_LANGUAGE', 'zh-TW')
+
+# gRPC client 在同一個 worker 的連線間共用，fork 後重建
+_client: Optional[speech.SpeechAsyncClient] = None
+
+
+def _reset_after_fork():
+    global _client
+    _client = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_client() -> speech.SpeechAsyncClient:
+    global _client
+    if _client is None:
+        _client = speech.SpeechAsyncClient()
+    return _client
+
+
+class GoogleASR(ASREngine):
+    name = "google"
+
+    async def _recognize(self, stage: AudioStage, on_final: FinalHandler,
+                         on_interim: Optional[InterimHandler]):
+        recognition_config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=SAMPLE_RATE,
+            language_code=GOOGLE_ASR_LANGUAGE,
+            enable_automatic_punctuation=True,
+        )
+        streaming_config = speech.StreamingRecognitionConfig(
+            config=recognition_config,
+            interim_results=True,
+            # 明確設定為連續辨識模式
+            single_utterance=False
+        )
+
+        async def audio_generator():
+            yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+            while True:
+                frame = await stage.queue.get()
+                if frame is None:
+                    break
+                # protobuf 需要 bytes，frame 在這裡才複製一次
+                yield speech.StreamingRecognizeRequest(audio_content=bytes(frame))
+                stage.queue.task_done()
+
+        try:
+            responses = await _get_client().streaming_recognize(requests=audio_generator())
+            logger.info("ASR response processor started. Listening for responses from Google...")
+            async for response in responses:
+                if not response.results or not response.results[0].alternatives:
+                    continue
+                result = response.results[0]
+                transcript = result.alternatives[0].transcript
+                if not transcript:
+                    continue
+                if result.is_final:
+                    await self._final(transcript, on_final)
+                else:
+                    await self._interim(transcript, result.stability or None, on_interim)
+        finally:
+            logger.info("ASR response processor finished.")
@@ -0,0 +1,154 @@
+# File: local_asr.py
+# 本機 CPU 辨識（faster-whisper，int8），不需要網路：
+# 依 AudioStage 的 VAD 斷句，顧客停頓 LOCAL_ASR_ENDPOINT_MS 後把整句送進 Whisper；
+# 可選擇每隔 LOCAL_ASR_INTERIM_MS 對還在說的句子解碼一次當作中間結果（給投機檢索用，會多花 CPU）。
+# 模型在每個 process 只載入一次，由固定數量的執行緒解碼，多個連線共用。
+#   pip install faster-whisper
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .audio_stage import SAMPLE_RATE, SAMPLE_WIDTH, AudioStage
+from .engine import ASREngine, FinalHandler, InterimHandler, asr_stats
+
+logger = logging.getLogger(__name__)
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
+LOCAL_ASR_MODEL = os.getenv('LOCAL_ASR_MODEL', 'small')
+LOCAL_ASR_COMPUTE_TYPE = os.getenv('LOCAL_ASR_COMPUTE_TYPE', 'int8')
+LOCAL_ASR_LANGUAGE = os.getenv('LOCAL_ASR_LANGUAGE', 'zh')
+# 提示 Whisper 輸出繁體中文
+LOCAL_ASR_PROMPT = os.getenv('LOCAL_ASR_PROMPT', '以下是早餐店的繁體中文點餐對話。')
+LOCAL_ASR_WORKERS = int(os.getenv('LOCAL_ASR_WORKERS', 1))
+LOCAL_ASR_CPU_THREADS = int(os.getenv('LOCAL_ASR_CPU_THREADS', 0))
+LOCAL_ASR_ENDPOINT_MS = int(os.getenv('LOCAL_ASR_ENDPOINT_MS', 500))
+LOCAL_ASR_INTERIM_MS = int(os.getenv('LOCAL_ASR_INTERIM_MS', 0))
+LOCAL_ASR_MAX_UTTERANCE_S = float(os.getenv('LOCAL_ASR_MAX_UTTERANCE_S', 15))
+
+_model = None
+_model_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _reset_after_fork():
+    global _model, _model_lock, _executor
+    _model, _model_lock, _executor = None, threading.Lock(), None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LOCAL_ASR_WORKERS, thread_name_prefix="local-asr")
+    return _executor
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if WhisperModel is None:
+                    raise ImportError("faster-whisper not installed (pip install faster-whisper)")
+                start = time.perf_counter()
+                _model = WhisperModel(LOCAL_ASR_MODEL, device="cpu", compute_type=LOCAL_ASR_COMPUTE_TYPE,
+                                      cpu_threads=LOCAL_ASR_CPU_THREADS, num_workers=LOCAL_ASR_WORKERS)
+                logger.info(f"faster-whisper {LOCAL_ASR_MODEL} ({LOCAL_ASR_COMPUTE_TYPE}) loaded "
+                            f"in {time.perf_counter() - start:.1f}s")
+    return _model
+
+
+def transcribe(samples: np.ndarray) -> Tuple[str, float]:
+    """float32 單聲道 16 kHz → (文字, 解碼秒數)；在執行緒裡呼叫"""
+    start = time.perf_counter()
+    segments, _ = get_model().transcribe(
+        samples,
+        language=LOCAL_ASR_LANGUAGE,
+        beam_size=1,
+        initial_prompt=LOCAL_ASR_PROMPT,
+        condition_on_previous_text=False,
+        without_timestamps=True,
+        vad_filter=False,  # 前面的 AudioStage 已經做過 VAD
+    )
+    text = "".join(segment.text for segment in segments).strip()
+    return text, time.perf_counter() - start
+
+
+class LocalWhisperASR(ASREngine):
+    name = "local"
+
+    async def _decode(self, audio: bytes) -> str:
+        samples = np.frombuffer(audio, dtype='<i2').astype(np.float32) / 32768.0
+        text, seconds = await asyncio.get_running_loop().run_in_executor(_get_executor(), transcribe, samples)
+        asr_stats.record_decode(self.name, len(samples) / SAMPLE_RATE, seconds)
+        return text
+
+    async def _recognize(self, stage: AudioStage, on_final: FinalHandler,
+                         on_interim: Optional[InterimHandler]):
+        # 第一次使用時載入模型，不卡住 event loop
+        await asyncio.get_running_loop().run_in_executor(_get_executor(), get_model)
+        endpoint = LOCAL_ASR_ENDPOINT_MS / 1000
+        max_bytes = int(LOCAL_ASR_MAX_UTTERANCE_S * SAMPLE_RATE) * SAMPLE_WIDTH
+        interim_bytes = LOCAL_ASR_INTERIM_MS * SAMPLE_RATE * SAMPLE_WIDTH // 1000
+        utterance = bytearray()
+        generation = 0
+        interim_at = 0
+        interim_task: Optional[asyncio.Task] = None
+
+        async def finalize():
+            nonlocal utterance, generation, interim_at
+            audio, utterance = bytes(utterance), bytearray()
+            generation += 1
+            interim_at = 0
+            if interim_task is not None and not interim_task.done():
+                interim_task.cancel()
+            text = await self._decode(audio)
+            if text:
+                await self._final(text, on_final)
+
+        async def interim(current: int, audio: bytes):
+            text = await self._decode(audio)
+            # 解碼期間句子已經結束就不送了
+            if text and current == generation:
+                await self._interim(text, None, on_interim)
+
+        try:
+            while True:
+                try:
+                    # 靜音被 AudioStage 擋下時不會有 frame 進來，定時醒來檢查是否該斷句
+                    frame = await asyncio.wait_for(stage.queue.get(), timeout=endpoint / 2)
+                except asyncio.TimeoutError:
+                    frame = False
+                if frame is None:
+                    break
+                now = time.perf_counter()
+                silent_for = now - stage.last_speech_at if stage.last_speech_at is not None else float('inf')
+                if frame is not False:
+                    stage.queue.task_done()
+                    # 句子要從有聲音的地方開始；斷句後的尾音與維持串流的靜音 frame 直接略過
+                    if utterance or silent_for < endpoint:
+                        utterance += frame
+                # 佇列裡還有積壓的 frame 時先讀完，避免把同一句切斷
+                if utterance and ((silent_for >= endpoint and stage.queue.empty()) or len(utterance) >= max_bytes):
+                    await finalize()
+                elif (on_interim is not None and interim_bytes and len(utterance) - interim_at >= interim_bytes
+                      and (interim_task is None or interim_task.done())):
+                    interim_at = len(utterance)
+                    interim_task = asyncio.get_running_loop().create_task(interim(generation, bytes(utterance)))
+            if utterance:
+                await finalize()
+        finally:
+            if interim_task is not None and not interim_task.done():
+                interim_task.cancel()
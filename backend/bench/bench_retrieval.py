@@ -0,0 +1,70 @@
+# File: bench_retrieval.py
+# 比較固定 similarity_search(k=50) 與依意圖檢索（rag/retrieval.py）的延遲、召回率與 context token 數
+# 執行（需要 Ollama 與 chroma_db）：cd backend && python -m bench.bench_retrieval
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from langchain_chroma import Chroma
+from langchain_ollama import OllamaEmbeddings
+
+from rag.menu_catalog import MenuCatalogStore
+from rag.prompt_budget import estimate_tokens
+from rag.retrieval import BASELINE_K, retrieve
+
+load_dotenv()
+
+# (查詢, 回答這句話一定要看到的品項名稱；空集合表示不需要菜單)
+LABELED_QUERIES = [
+    ("我要一份蛋餅", {"原味"}),
+    ("玉米蛋餅加起司", {"玉米"}),
+    ("兩杯大冰紅", {"古早紅茶"}),
+    ("青花椒豬堡，大冰紅", {"青花椒豬堡", "古早紅茶"}),
+    ("有什麼飲料？", {"古早紅茶", "古早奶茶", "英式奶茶", "鮮奶茶", "豆漿"}),
+    ("漢堡有哪些", {"豬肉堡", "美式牛肉堡", "脆皮雞腿堡"}),
+    ("蛋餅 A套餐", {"原味", "A"}),
+    ("奶酥厚片", {"特調奶酥", "抹茶奶酥"}),
+    ("有啥好吃的？", set()),
+    ("確認一下我的餐點", set()),
+    ("結束", set()),
+    ("我要一個薯餅蛋餅跟鮮奶茶大杯", {"薯餅蛋餅", "鮮奶茶"}),
+]
+
+
+def recall(docs, expected):
+    if not expected:
+        return 1.0
+    names = {doc.metadata.get("name") for doc in docs}
+    return len(expected & names) / len(expected)
+
+
+def run(label, search, rounds):
+    latencies, recalls, tokens = [], [], []
+    for _ in range(rounds):
+        for query, expected in LABELED_QUERIES:
+            start = time.perf_counter()
+            docs = search(query)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(recall(docs, expected))
+            tokens.append(sum(estimate_tokens(doc.page_content) for doc in docs))
+    latencies.sort()
+    print(f"{label:>10}: mean {statistics.mean(latencies) * 1000:7.1f} ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f} ms  "
+          f"recall {statistics.mean(recalls):.3f}  context tokens {statistics.mean(tokens):7.1f}")
+
+
+def main(rounds: int = 3):
+    embedding_model = OllamaEmbeddings(model="deepseek-r1:1.5b")
+    vectorstore = Chroma(
+        collection_name="morning_menu",
+        embedding_function=embedding_model,
+        persist_directory=os.getenv('CHROMADB_PATH', "./db/chroma_db"),
+    )
+    catalog = MenuCatalogStore(os.getenv('DB_PATH', "./db/morning_eat.db")).current()
+    run(f"k={BASELINE_K}", lambda q: vectorstore.similarity_search(q, k=BASELINE_K), rounds)
+    run("adaptive", lambda q: retrieve(vectorstore, q, catalog)[0], rounds)
+
+
+if __name__ == "__main__":
+    main(int(os.getenv("BENCH_ROUNDS", 3)))
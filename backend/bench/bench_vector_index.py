@@ -0,0 +1,59 @@
+# File: bench_vector_index.py
+# 比較 Chroma 與記憶體 NumPy 索引（rag/vector_index.py）的查詢延遲與結果一致性，
+# 查詢向量事先算好，只量向量查詢本身。
+# 執行（需要 Ollama 與 chroma_db）：cd backend && python -m bench.bench_vector_index
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from langchain_chroma import Chroma
+from langchain_ollama import OllamaEmbeddings
+
+from rag.vector_index import MenuVectorIndex
+
+load_dotenv()
+
+QUERIES = ["我要一份蛋餅", "兩杯大冰紅", "青花椒豬堡", "有什麼飲料？", "漢堡有哪些", "奶酥厚片", "A套餐"]
+FILTERS = [None, {"table": "drink_item"}, {"$or": [{"table": "combo_menu"}, {"class": "台式蛋餅"}]}]
+
+
+def timed(search, embeddings, k, rounds):
+    latencies = []
+    for _ in range(rounds):
+        for embedding in embeddings:
+            for where in FILTERS:
+                start = time.perf_counter()
+                search(embedding, k=k, filter=where)
+                latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+def main(k: int = 12, rounds: int = 20):
+    embedding_model = OllamaEmbeddings(model="deepseek-r1:1.5b")
+    chroma = Chroma(
+        collection_name="morning_menu",
+        embedding_function=embedding_model,
+        persist_directory=os.getenv('CHROMADB_PATH', "./db/chroma_db"),
+    )
+    embeddings = [embedding_model.embed_query(q) for q in QUERIES]
+    indexes = {dtype: MenuVectorIndex.from_chroma(chroma, dtype=dtype) for dtype in ("float32", "int8")}
+
+    mean, p95 = timed(chroma.similarity_search_by_vector, embeddings, k, rounds)
+    print(f"{'chroma':>8}: mean {mean * 1e6:9.1f} us  p95 {p95 * 1e6:9.1f} us")
+    for dtype, index in indexes.items():
+        mean, p95 = timed(index.similarity_search_by_vector, embeddings, k, rounds)
+        # 與 Chroma 的 top-k 重疊比例
+        overlap = []
+        for embedding in embeddings:
+            for where in FILTERS:
+                expected = {d.page_content for d in chroma.similarity_search_by_vector(embedding, k=k, filter=where)}
+                got = {d.page_content for d in index.similarity_search_by_vector(embedding, k=k, filter=where)}
+                overlap.append(len(expected & got) / max(len(expected), 1))
+        print(f"{dtype:>8}: mean {mean * 1e6:9.1f} us  p95 {p95 * 1e6:9.1f} us  "
+              f"top-{k} overlap {statistics.mean(overlap):.3f}")
+
+
+if __name__ == "__main__":
+    main(int(os.getenv("BENCH_K", 12)), int(os.getenv("BENCH_ROUNDS", 20)))
@@ -0,0 +1,130 @@
+# File: bench_workers.py
+# 以不同 worker 數啟動後端（uvicorn --workers N），固定並行數壓測同一個 endpoint，比較吞吐量是否隨 worker 數成長
+# 執行（需要 Redis、Ollama 與 chroma_db，與正式啟動相同）：
+#   cd backend && python -m bench.bench_workers --workers 1 2 4 --concurrency 64 --duration 15
+# 預設壓 /get-token（每個請求都是新 session：JWT、Fernet 加密與一次 Redis transaction），
+# --path /order/ordering --method POST 可壓完整點餐流程（會先拿一個 cookie 給每個連線用）。
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+
+
+def wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 180.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("server did not become ready")
+
+
+async def _client(base_url, method, path, body, concurrency, duration):
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        cookies = None
+        if path != "/get-token":
+            cookies = (await client.get("/get-token")).cookies
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body, cookies=cookies)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def _client_process(args):
+    return asyncio.run(_client(*args))
+
+
+def measure(base_url, method, path, body, concurrency, duration, clients):
+    # 用多個行程送請求，避免壓測端自己先成為瓶頸
+    per_client = max(concurrency // clients, 1)
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_client_process, [(base_url, method, path, body, per_client, duration)] * clients)
+    latencies = sorted(l for result in results for l in result[0])
+    errors = sum(result[1] for result in results)
+    return latencies, errors
+
+
+def served_by(base_url: str, samples: int = 50) -> int:
+    """/metrics 會回報 pid，看請求實際分散到幾個 worker"""
+    with httpx.Client(base_url=base_url, timeout=5) as client:
+        return len({client.get("/metrics").json()["pid"] for _ in range(samples)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="worker 數與吞吐量")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--clients", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="/get-token")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--text", default="我要一份玉米蛋餅跟大冰紅", help="--path /order/ordering 時送出的句子")
+    args = parser.parse_args()
+
+    body = {"text": args.text} if args.method.upper() == "POST" else None
+    base_url = f"http://127.0.0.1:{args.port}"
+    baseline = None
+    print(f"{args.method} {args.path}  concurrency {args.concurrency}  duration {args.duration:.0f}s")
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            wait_ready(base_url, server)
+            measure(base_url, args.method, args.path, body, args.concurrency, args.warmup, args.clients)
+            latencies, errors = measure(base_url, args.method, args.path, body,
+                                        args.concurrency, args.duration, args.clients)
+            pids = served_by(base_url)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        if not latencies:
+            print(f"workers {workers:>2}: no successful requests ({errors} errors)")
+            continue
+        throughput = len(latencies) / args.duration
+        baseline = baseline or throughput
+        print(f"workers {workers:>2}: {throughput:8.1f} req/s  x{throughput / baseline:4.2f}  "
+              f"p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f} ms  "
+              f"errors {errors}  served by {pids} pid(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from store.redis_pool import redis_client
+import warmup
+import asyncio
+
+health = APIRouter(
+    tags=["health"],
+)
+
+
+@health.get('/healthz')
+async def healthz():
+    """存活檢查：event loop 有回應就是 200，內容附上各資源的預熱狀態"""
+    return JSONResponse(content={"status": "ok", **warmup.status()}, status_code=200)
+
+
+@health.get('/readyz')
+async def readyz():
+    """就緒檢查：Redis、菜單與向量庫都可用才回 200，否則 503（負載平衡器不要把流量送過來）"""
+    redis_failed = warmup.state('redis') == 'error'
+    if warmup.is_ready() or redis_failed:
+        # Redis 啟動後也可能斷線，每次都實際確認；先前失敗的話也重新確認，恢復了就標回 ready
+        try:
+            await asyncio.wait_for(redis_client().ping(), timeout=1)
+        except Exception as e:
+            warmup.mark_unavailable('redis', e)
+        else:
+            if redis_failed:
+                warmup.mark_ready('redis')
+    body = warmup.status()
+    return JSONResponse(content=body, status_code=200 if body["ready"] else 503)
@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+import os
+from fastapi.responses import JSONResponse
+from rag.useModel import model_registry
+from rag.prompt_budget import prompt_stats
+from rag.query_cache import cache_stats
+from store.redis_pool import pool_stats
+from store.token_cache import token_cache
+from asr.audio_stage import audio_stats
+from asr.engine import asr_stats
+from tts.speaker import tts_stats
+from rag.speculation import speculation_stats
+
+metrics = APIRouter(
+    tags=["metrics"],
+)
+
+
+@metrics.get('/metrics')
+async def get_metrics():
+    """回傳各元件的執行統計（LLM 後端延遲、prompt token 數、查詢快取命中率、Redis 連線池、token 驗證快取、各 ASR 後端延遲等）"""
+    return JSONResponse(
+        content={
+            # 多 worker 時每個 worker 各自統計，pid 用來分辨是哪一個回應的
+            "pid": os.getpid(),
+            "llm": model_registry.stats(),
+            "prompt_tokens": prompt_stats.summary(),
+            "query_cache": cache_stats(),
+            "redis_pool": pool_stats(),
+            "token_cache": token_cache.stats(),
+            "audio": audio_stats(),
+            "asr": asr_stats.stats(),
+            "tts": tts_stats(),
+            "speculation": speculation_stats(),
+        },
+        status_code=200
+    )
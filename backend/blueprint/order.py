@@ -2,9 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends, Request, Cookie
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
-from rag.rag_morning_eat import order_real_time
-from setup import cus_choice, vectorstore, conn, redis_client
-from blueprint.token import decrypt_token, verify_token
+from rag.rag_morning_eat import aorder_real_time
+from redis.asyncio import Redis
+from setup import cus_choice, aget_vectorstore, aget_menu_catalog
+from blueprint.token import require_token
+from store.redis_pool import get_redis
+from store.order_state import commit_order
+from store.session import load_turn_context
+import copy
 import json
 
 # Create APIRouter instead of Blueprint
@@ -19,20 +24,7 @@ class OrderRequest(BaseModel):
 
 
 @order.post('/ordering')
-async def ordering(OrderRequest: OrderRequest, ordering_token: str = Cookie(None)):
-    try:
-        # Decrypt and verify the token
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            raise HTTPException(status_code=401, detail='Invalid or expired token')
-    except Exception as e:
-        print(f"Token verification failed: {e}")
-        return JSONResponse(
-            content={"error": "Invalid or expired token"},
-            status_code=401
-        )
-
+async def ordering(OrderRequest: OrderRequest, redis: Redis = Depends(get_redis), token_id: str = Depends(require_token)):
     try:
         if not OrderRequest.text:
             return JSONResponse(
@@ -40,19 +32,24 @@ async def ordering(OrderRequest: OrderRequest, ordering_token: str = Cookie(None
                 status_code=400
             )
         
-        order_state = json.loads(redis_client.get(f'{token_id}_order_state'))
+        # 訂單與最近對話一次讀取
+        base, conv_history = await load_turn_context(redis, token_id)
 
-        response, order_state, order_diff = order_real_time(
+        # LLM 會原地修改訂單，傳入複本，寫回時與讀取時的版本比對
+        response, order_state = await aorder_real_time(
             query=OrderRequest.text, 
-            vectorstore=vectorstore, 
+            conversation_history=conv_history,
+            vectorstore=await aget_vectorstore(), 
             cus_choice=cus_choice, 
-            order_state=order_state, 
-            conn=conn
+            order_state=copy.deepcopy(base.state), 
+            catalog=await aget_menu_catalog()
         )
+        saved, _ = await commit_order(redis, token_id, base, order_state)
         result = {
             'status_code': 200,
             'msg': 'Order processed successfully',
             'response': response,
+            'version': saved.version,
         }
         
         return JSONResponse(content=result, status_code=200)
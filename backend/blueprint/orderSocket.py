@@ -1,47 +1,55 @@
-from fastapi import APIRouter, WebSocket, Cookie
+from fastapi import APIRouter, WebSocket, Cookie, Query, Depends
 from fastapi.responses import JSONResponse
-from rag.rag_morning_eat import order_real_time
-from setup import cus_choice, vectorstore, conn, redis_client
+from rag.rag_morning_eat import astream_order_real_time
+from rag.phonetic import repair_transcript
+from setup import cus_choice, aget_vectorstore, aget_menu_catalog
+from redis.asyncio import Redis
 import os
 import logging
 import json
+import copy
 from dotenv import load_dotenv
-from deepgram import DeepgramClient, LiveTranscriptionEvents, LiveOptions
-from typing import Dict, Callable, Awaitable, Tuple, Coroutine
-from blueprint.token import decrypt_token, verify_token
+from typing import Dict, Callable, Awaitable, Tuple, Coroutine, Optional
+from blueprint.token import require_token, resolve_token, TokenInvalid
+from store.conversation import append_turns, read_turns, HISTORY_PAGE_MAX, GREETING
+from store.order_state import commit_order
+from store.redis_pool import get_redis, redis_client
+from store.session import load_turn_context
+from asr.audio_stage import AudioStage
+from asr.engine import create_engine
+from rag.speculation import SPECULATION, Speculator
+from tts.speaker import Speaker, create_speaker
 from datetime import datetime
-from google.cloud import speech
 import asyncio
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-TranscriptHandler = Callable[[Dict], Awaitable[None]]
-
-
 audioWS = APIRouter()
 
 @audioWS.get('/history')
-async def get_conversation_history(ordering_token: str = Cookie(None)):
-    """獲取對話歷史"""
-    try:
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            raise Exception("Invalid or expired token")
-    except Exception as e:
-        logger.error(f"Token verification failed: {e}")
-        return JSONResponse(
-            content={"error": "Invalid or expired token"},
-            status_code=401
-        )
-
-    # 從 Redis 獲取對話歷史
-    conversation_history = redis_client.get(f'{token_id}_conversation')
-    if conversation_history:
+async def get_conversation_history(since: Optional[int] = Query(None, ge=0),
+                                   offset: int = Query(0, ge=0),
+                                   limit: Optional[int] = Query(None, ge=1, le=HISTORY_PAGE_MAX),
+                                   redis: Redis = Depends(get_redis),
+                                   token_id: str = Depends(require_token)):
+    """
+    獲取對話歷史。
+    - offset / limit：分頁
+    - since：增量同步，只回傳第 since 筆之後的對話（since 為上次回傳的 next）
+    """
+    # 從 Redis 獲取對話歷史（只讀需要的範圍）
+    start = since if since is not None else offset
+    conversation_history, total = await read_turns(redis, token_id, start=start, limit=limit)
+    if total:
         return JSONResponse(
-            content={"conversation": json.loads(conversation_history)},
+            content={
+                "conversation": conversation_history,
+                "offset": start,
+                "total": total,
+                "next": start + len(conversation_history),
+            },
             status_code=200
         )
     else:
@@ -50,143 +58,150 @@ async def get_conversation_history(ordering_token: str = Cookie(None)):
             status_code=404
         )
 
-# 對話歷史
-conversation_history = []
-
-async def start_google_streaming_asr(transcript_received_handler: TranscriptHandler) -> Tuple[asyncio.Queue, Coroutine]:
+async def process_audio(fast_socket: WebSocket, ordering_token: str, redis: Redis = None,
+                        speaker: Optional[Speaker] = None) -> Tuple[AudioStage, Coroutine]:
     """
-    準備 Google ASR 串流，並回傳音訊佇列以及需要被執行的回應處理器協程。
+    設定 ASR（後端由 ASR_BACKEND 決定），並回傳音訊處理階段以及辨識協程。
+    有 speaker 時顧客回應會邊生成邊合成語音送回。
     """
-    try:
-        audio_queue = asyncio.Queue()
-        client = speech.SpeechAsyncClient()
-        recognition_config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=16000,
-            language_code="zh-TW",
-            enable_automatic_punctuation=True,
-        )
-        streaming_config = speech.StreamingRecognitionConfig(
-            config=recognition_config,
-            interim_results=True,
-            # 明確設定為連續辨識模式
-            single_utterance=False
-        )
-
-        async def audio_generator():
-            yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
-            while True:
-                chunk = await audio_queue.get()
-                if chunk is None:
-                    break
-                yield speech.StreamingRecognizeRequest(audio_content=chunk)
-                audio_queue.task_done()
+    redis = redis or redis_client()
 
-        async def response_processor():
-            """
-            此協程現在會由呼叫者 (websocket_endpoint) 執行，確保錯誤能被捕獲。
-            """
-            try:
-                requests = audio_generator()
-                responses = await client.streaming_recognize(requests=requests)
-                logger.info("ASR response processor started. Listening for responses from Google...")
-                async for response in responses:
-                    logger.debug(f"Received raw response from Google: {response}")
-                    if not response.results or not response.results[0].alternatives:
-                        continue
-                    result = response.results[0]
-                    transcript = result.alternatives[0].transcript
-                    if result.is_final:
-                        if transcript:
-                            logger.info(f"Google ASR FINAL transcript: '{transcript}'")
-                            formatted_result = {"channel": {"alternatives": [{"transcript": transcript}]}}
-                            await transcript_received_handler(formatted_result)
-                    else:
-                        logger.info(f"Google ASR Interim transcript: '{transcript}'")
-            finally:
-                logger.info("ASR response processor finished.")
+    async def load_context():
+        base, conv_history = await load_turn_context(redis, ordering_token)
+        return turn_context_key(base, conv_history), prompt_order_state(base.state), conv_history
 
-        # 回傳佇列和尚未被執行的協程
-        return audio_queue, response_processor()
-    except Exception as e:
-        raise Exception(f'Could not start Google ASR stream: {e}')
+    # 冷啟動的 worker 在 executor 執行緒建立菜單與向量庫，不卡住其他連線
+    catalog = await aget_menu_catalog()
+    # 顧客還在說話時依中間結果先檢索（與選用的 LLM 投機生成）
+    speculator = Speculator(load_context, await aget_vectorstore(), catalog, cus_choice) if SPECULATION else None
 
+    async def on_interim(transcript: str, stability: float) -> None:
+        repaired = repair_transcript(transcript, catalog.current())
+        speculator.on_interim(repaired.text, stability or None)
 
-async def process_audio(fast_socket: WebSocket, ordering_token: str) -> Tuple[asyncio.Queue, Coroutine]:
-    """
-    設定 ASR，並回傳音訊佇列以及 Google 回應處理器。
-    """
-    async def get_transcript(data: Dict) -> None:
-        transcript = data['channel']['alternatives'][0]['transcript']
+    async def get_transcript(transcript: str) -> None:
         if transcript:
             # --- 您的核心業務邏輯，無需變動 ---
             logger.info(f"Handler processing final transcript: {transcript}")
-            conv = json.loads(redis_client.get(f'{ordering_token}_conversation'))
+            # 依讀音把聽錯的品項名稱改回菜單寫法，再交給 LLM
+            repaired = repair_transcript(transcript, catalog.current())
+            if repaired.corrections:
+                logger.info(f"Transcript repaired: {repaired.corrections}")
+            transcript = repaired.text
             try:
                 transcript_send = {"type": "cus", "transcript": transcript, "time": datetime.now().isoformat()}
+                if repaired.changed:
+                    transcript_send["raw_transcript"] = repaired.raw
                 await fast_socket.send_json(transcript_send)
-                conv.append(transcript_send)
             except Exception as e:
                 logger.error(f"Error sending transcript: {e}")
                 return
+            # 顧客回應每湊滿一個短句就開始合成語音
+            speech = speaker.stream() if speaker else None
+
+            async def on_delta(delta: str) -> None:
+                await fast_socket.send_json({"type": "llm_delta", "delta": delta})
+                if speech:
+                    speech.feed(delta)
+
             try:
-                response, status, order_diff = await call_llm(transcript, ordering_token)
+                # 顧客回應邊生成邊送出，每套用一行 sys 指令就推送一次訂單差異
+                response, status, order_diff, rebased_state = await call_llm(
+                    transcript, ordering_token, redis, speculator=speculator,
+                    on_delta=on_delta,
+                    on_order_diff=lambda diff: fast_socket.send_json({"type": "order", "diff": diff}),
+                )
                 llm_send = {"type": "llm", "response": response, "time": datetime.now().isoformat()}
                 await fast_socket.send_json(llm_send)
-                await fast_socket.send_json({"type": "order", "diff": order_diff})
-                conv.append(llm_send)
+                if rebased_state is not None:
+                    # 生成期間訂單被其他請求（/ordering、付款）改過：前面逐行送出的差異是對舊版本算的，
+                    # 再送一次本輪的合併差異與寫入後的完整訂單，讓前端與 Redis 一致
+                    await fast_socket.send_json({"type": "order", "diff": order_diff, "state": rebased_state})
             except Exception as e:
                 logger.error(f"Error calling LLM: {e}")
+                if speech:
+                    speech.cancel()
                 return
-            redis_client.set(f'{ordering_token}_conversation', json.dumps(conv))
+            turns = [transcript_send, llm_send]
             if status:
                 end_send = {"type": "end", "msg": "Conversation ended"}
+                turns.append(end_send)
+            # 這一輪的顧客、店員（與結束標記）一次 RPUSH 到對話最後
+            await append_turns(redis, ordering_token, *turns)
+            if speech:
+                try:
+                    # 念完剩下的部分再結束這一輪（結束對話時也要先念完才關閉連線）
+                    await speech.finish(response)
+                except Exception as e:
+                    logger.error(f"Error streaming TTS audio: {e}")
+                    speech.cancel()
+            if status:
                 await fast_socket.send_json(end_send)
-                conv.append(end_send)
-                redis_client.set(f'{ordering_token}_conversation', json.dumps(conv))
                 await fast_socket.close()
 
-    audio_queue, google_response_processor = await start_google_streaming_asr(get_transcript)
-    return audio_queue, google_response_processor
+    # 固定長度 frame、VAD 與有上限的佇列，ASR 只收到需要辨識的音訊
+    audio_stage = AudioStage()
+    engine = create_engine()
+
+    async def run_recognizer():
+        try:
+            await engine.recognize(audio_stage, get_transcript, on_interim if speculator else None)
+        finally:
+            if speculator:
+                speculator.close()
+
+    return audio_stage, run_recognizer()
 
 
 @audioWS.websocket("/asr")
-async def websocket_endpoint(websocket: WebSocket, ordering_token: str = Cookie(None)):
+async def websocket_endpoint(websocket: WebSocket, ordering_token: str = Cookie(None), redis: Redis = Depends(get_redis),
+                             tts: bool = Query(False)):
     await websocket.accept()
     await websocket.send_json({"type": "success", "msg": "WebSocket connection established"})
 
-    audio_queue = None
+    audio_stage = None
     try:
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            raise Exception("Invalid or expired token")
+        token_id = await resolve_token(ordering_token, redis)
+
+        # 語音回覆是二進位訊息，只送給以 /asr?tts=1 明確要求、會播放音訊的前端
+        speaker = create_speaker(websocket) if tts else None
+        audio_stage, recognizer = await process_audio(websocket, ordering_token=token_id, redis=redis,
+                                                      speaker=speaker)
 
-        audio_queue, google_response_processor = await process_audio(websocket, ordering_token=token_id)
+        async def greet():
+            """新的對話（只有歡迎詞）念出歡迎詞，音訊來自預先合成的快取"""
+            try:
+                _, total = await read_turns(redis, token_id, start=0, limit=1)
+                if total == 1:
+                    await speaker.say(GREETING)
+            except Exception as e:
+                logger.error(f"Error speaking greeting: {e}")
 
         # --- 全新的任務管理結構 ---
         async def forward_audio_to_queue():
-            """從 WebSocket 接收音訊並放入佇列"""
+            """從 WebSocket 接收音訊交給 AudioStage（佇列滿時會等待，形成背壓）"""
             try:
                 while True:
                     data = await websocket.receive_bytes()
-                    # *** 關鍵偵錯日誌：檢查音訊內容 ***
-                    logger.info(f"Received audio data of length: {len(data)}, first 20 bytes (hex): {data[:20].hex()}")
-                    await audio_queue.put(data)
+                    await audio_stage.feed(data)
             except Exception as e:
                 logger.error(f"Error receiving audio from websocket: {e}")
             finally:
                 # 確保如果接收迴圈結束，也發送結束訊號
-                if audio_queue:
-                    await audio_queue.put(None)
+                if audio_stage:
+                    await audio_stage.close()
                 logger.info("Audio forwarding task finished.")
 
-        # 同時執行兩個任務：一個轉發音訊，一個處理 Google 回應
+        # 同時執行兩個任務：一個轉發音訊，一個執行 ASR 並處理辨識結果（開啟語音時另外念歡迎詞）
         await asyncio.gather(
             forward_audio_to_queue(),
-            google_response_processor
+            recognizer,
+            *([greet()] if speaker else [])
         )
 
+    except TokenInvalid as e:
+        logger.warning(f"Token verification failed: {e.detail}")
+        await websocket.send_json({"type": "error", "msg": "Invalid or expired token"})
     except Exception as e:
         logger.error(f"FATAL ERROR in websocket_endpoint: {e}", exc_info=True)
     finally:
@@ -229,63 +244,59 @@ def order_diff_state(order_state: Dict, new_order_state: Dict):
     }
 
 
-# 假設的 LLM 呼叫函數（可替換為 Gemini、OpenAI 或本地模型）
-async def call_llm(text: str, token: str) -> str:
-    order_state = json.loads(redis_client.get(f'{token}_order_state'))
-    new_order_state = {
+def prompt_order_state(order_state: Dict) -> Dict:
+    """LLM 看到、也會修改的訂單欄位"""
+    return {
         "items": order_state.get('items', []),
         "total_price": order_state.get('total_price', 0),
         "status": order_state.get('status', 'start'),
     }
 
-    conv_history = json.loads(redis_client.get(f'{token}_conversation'))
 
-    response, neww_order_state = order_real_time(
-        query=text, 
-        conversation_history=conv_history,
-        vectorstore=vectorstore, 
-        cus_choice=cus_choice, 
-        order_state=new_order_state, 
-        conn=conn
-    )
-    order_diff = order_diff_state(new_order_state, neww_order_state)
-    order_state.update(new_order_state)
-    redis_client.set(f'{token}_order_state', json.dumps(order_state))
-    return response, order_state.get('status', '') == 'end', order_diff
+def turn_context_key(base, conv_history) -> Tuple:
+    """訂單版本與最後一筆對話；投機生成時與最終結果時不同，就表示 prompt 已過期"""
+    return (base.version if base else None, len(conv_history), conv_history[-1].get('time') if conv_history else None)
 
-@audioWS.websocket("/asr")
-async def websocket_endpoint(websocket: WebSocket, ordering_token: str = Cookie(None)):
-    await websocket.accept()
-    await websocket.send_json({"type": "success", "msg": "WebSocket connection established"})
 
-    try:
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            await websocket.send_json({"type": "error", "msg": "Invalid or expired token"})
-            await websocket.close(code=1008)
-            raise Exception("Invalid or expired token")
-    except Exception as e:
-        logger.error(f"Token verification failed: {e}")
-        await websocket.send_json({"type": "close", "msg": "Token verification failed"})
-        await websocket.close(code=1008)
-        return
-    try:
-        deepgram_socket = await process_audio(websocket, ordering_token=token_id) 
+# 假設的 LLM 呼叫函數（可替換為 Gemini、OpenAI 或本地模型）
+async def call_llm(text: str, token: str, redis: Redis,
+                   on_delta: Callable[[str], Awaitable[None]] = None,
+                   on_order_diff: Callable[[Dict], Awaitable[None]] = None,
+                   speculator: Optional[Speculator] = None) -> Tuple[str, bool, Dict, Optional[Dict]]:
+    """回傳 (回應, 是否結束, 本輪訂單差異, 寫入時經過合併則為合併後的訂單，否則 None)"""
+    # 訂單與最近對話一次讀取
+    base, conv_history = await load_turn_context(redis, token)
+    order_state = base.state
+    new_order_state = prompt_order_state(order_state)
+    # 中間結果的投機檢索／生成和最終句子夠接近就直接沿用
+    hit = await speculator.take(text, turn_context_key(base, conv_history)) if speculator else None
 
-        while True:
-            data = await websocket.receive_bytes()
-            # logger.info(f"Received audio data of length: {len(data)}")
-            await deepgram_socket.send(data)  # Use await for async send
-    except Exception as e:
-        logger.error(f"Error processing audio: {e}")
-        await websocket.send_json({"type": "error", "msg": f"Error processing audio"})
-        raise Exception(f'Could not process audio: {e}')
-    finally:
-        # Add finish() call before closing
-        if 'deepgram_socket' in locals():
-            await deepgram_socket.finish()
-        # Only close websocket if it's still open
-        if websocket.client_state.name == "CONNECTED":
-            await websocket.send_json({"type": "close", "msg": "Closing WebSocket connection"})
-            await websocket.close()
\ No newline at end of file
+    # 串流過程會原地修改 working_state，保留原本的訂單才比得出差異
+    working_state = copy.deepcopy(new_order_state)
+    last_state = copy.deepcopy(working_state)
+    response = ""
+    async for kind, value in astream_order_real_time(
+        query=text, 
+        conversation_history=conv_history,
+        vectorstore=await aget_vectorstore(), 
+        cus_choice=cus_choice, 
+        order_state=working_state, 
+        catalog=await aget_menu_catalog(),
+        docs=hit.docs if hit else None,
+        chunks=hit.chunks if hit else None,
+    ):
+        if kind == "cus" and on_delta:
+            await on_delta(value)
+        elif kind == "sys" and on_order_diff:
+            line_diff = order_diff_state(last_state, working_state)
+            last_state = copy.deepcopy(working_state)
+            if any(line_diff.values()):
+                await on_order_diff(line_diff)
+        elif kind == "done":
+            response = value
+    order_diff = order_diff_state(new_order_state, working_state)
+    # LLM 生成期間其他請求（/ordering、付款）可能改過訂單，依版本比對寫入，衝突時合併後再寫
+    saved, rebased = await commit_order(redis, token, base, {**order_state, **working_state})
+    if rebased:
+        order_diff = order_diff_state(order_state, saved.state)
+    return response, saved.state.get('status', '') == 'end', order_diff, saved.state if rebased else None
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Cookie
+from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
-from setup import redis_client
-from blueprint.token import decrypt_token, verify_token
+from redis.asyncio import Redis
+from blueprint.token import require_token
+from store.redis_pool import get_redis
+from store.order_state import load_order, update_order, OrderNotFound
+from store.token_cache import revoke_token
 import json
 
 
@@ -11,30 +14,17 @@ payment = APIRouter(
 
 
 @payment.get('/see_order')
-async def see_order(ordering_token: str = Cookie(None)):
+async def see_order(redis: Redis = Depends(get_redis), token_id: str = Depends(require_token)):
     try:
-        # Decrypt and verify the token
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            raise HTTPException(status_code=401, detail='Invalid or expired token')
-    except Exception as e:
-        print(f"Token verification failed: {e}")
-        return JSONResponse(
-            content={"error": "Invalid or expired token"},
-            status_code=401
-        )
-
-    try:
-        order_state = json.loads(redis_client.get(f'{token_id}_order_state'))
-        if not order_state:
+        order = await load_order(redis, token_id)
+        if not order:
             return JSONResponse(
                 content={"error": "Order state not found"},
                 status_code=404
             )
 
         return JSONResponse(
-            content={"order_state": order_state},
+            content={"order_state": order.state, "version": order.version},
             status_code=200
         )
     except Exception as e:
@@ -45,34 +35,19 @@ async def see_order(ordering_token: str = Cookie(None)):
         )
 
 @payment.post('/submit_payment')
-async def submit_payment(ordering_token: str = Cookie(None)):
+async def submit_payment(redis: Redis = Depends(get_redis), token_id: str = Depends(require_token)):
     try:
-        # Decrypt and verify the token
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            raise HTTPException(status_code=401, detail='Invalid or expired token')
-    except Exception as e:
-        print(f"Token verification failed: {e}")
-        return JSONResponse(
-            content={"error": "Invalid or expired token"},
-            status_code=401
-        )
-
-    try:
-        order_state = json.loads(redis_client.get(f'{token_id}_order_state'))
-        if not order_state:
+        # 假設支付邏輯在這裡（以版本比對寫入，不會蓋掉同時進行的點餐）
+        try:
+            order = await update_order(redis, token_id, lambda state: state['payment'].update(status='paid'))
+        except OrderNotFound:
             return JSONResponse(
                 content={"error": "Order state not found"},
                 status_code=404
             )
+        order_state = order.state
 
-        # 假設支付邏輯在這裡
-        order_state['payment']['status'] = 'paid'
-        
-        # 更新 Redis 中的訂單狀態
-        redis_client.set(f'{token_id}_order_state', json.dumps(order_state))
-        redis_client.delete(f'{token_id}_order_state', f'{token_id}_conversation')  # 清除之前的訂單狀態
+        await redis.delete(f'{token_id}_order_state', f'{token_id}_conversation')  # 清除之前的訂單狀態
 
         return JSONResponse(
             content={"msg": "Payment submitted successfully", "order_state": order_state},
@@ -86,23 +61,11 @@ async def submit_payment(ordering_token: str = Cookie(None)):
         )
 
 @payment.post('/clean_cookie')
-async def clean_cookie(ordering_token: str = Cookie(None)):
-    try:
-        # Decrypt and verify the token
-        token = decrypt_token(ordering_token)
-        token_id = await verify_token(token)
-        if not token_id:
-            raise HTTPException(status_code=401, detail='Invalid or expired token')
-    except Exception as e:
-        print(f"Token verification failed: {e}")
-        return JSONResponse(
-            content={"error": "Invalid or expired token"},
-            status_code=401
-        )
-
+async def clean_cookie(redis: Redis = Depends(get_redis), token_id: str = Depends(require_token)):
     try:
-        # 清除 Redis 中的訂單狀態和對話歷史
-        redis_client.delete(f'{token_id}_order_state', f'{token_id}_conversation')
+        # 清除 Redis 中的訂單狀態和對話歷史，並撤銷 token（通知各 worker 清掉驗證快取）
+        await redis.delete(f'{token_id}_order_state', f'{token_id}_conversation')
+        await revoke_token(redis, token_id)
         response = JSONResponse(
             content={"msg": "Cookies cleaned successfully"},
             status_code=200
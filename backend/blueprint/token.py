@@ -1,16 +1,24 @@
-from fastapi import APIRouter, WebSocket, HTTPException, Response, Request
+from fastapi import APIRouter, WebSocket, HTTPException, Response, Request, Depends, Cookie
 from fastapi.responses import HTMLResponse, JSONResponse
 from jose import JWTError, jwt
 from cryptography.fernet import Fernet
 from datetime import datetime, timedelta
 from typing import Optional
+import time
 import uvicorn
 import uuid
+import base64
+import hashlib
 from dotenv import load_dotenv
 import os
 import json
 import logging
-from setup import redis_client ,init_order_state
+from redis.asyncio import Redis
+from setup import init_order_state
+from store.redis_pool import get_redis, redis_client
+from store.session import create_session, ensure_session
+from store.token_cache import token_cache
+from warmup import schedule_prewarm
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,7 +32,8 @@ ALGORITHM = os.getenv('ALGORITHM', "HS256")
 TOKEN_EXPIRE_MINUTES = int(os.getenv('TOKEN_EXPIRE_MINUTES', 30))
 
 # Fernet 加密設定
-FERNET_KEY = os.getenv("FERNET_KEY", Fernet.generate_key())  # 實際應用中應儲存在環境變數
+# 沒設定 FERNET_KEY 時由 SECRET_KEY 推導，所有 worker / 機器拿到同一把金鑰，任何一個都能解開別人發的 cookie
+FERNET_KEY = os.getenv("FERNET_KEY") or base64.urlsafe_b64encode(hashlib.sha256(SECRET_KEY.encode()).digest())
 cipher = Fernet(FERNET_KEY)
 
 @token.get("/me")
@@ -68,38 +77,60 @@ def decrypt_token(encrypted_token: str) -> str:
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid encrypted token")
 
-# 驗證 JWT token
-async def verify_token(token: str):
+class TokenInvalid(HTTPException):
+    """token 驗證失敗，app 會統一回 401 {"error": "Invalid or expired token"}"""
+
+    def __init__(self, detail: str = "Invalid or expired token"):
+        super().__init__(status_code=401, detail=detail)
+
+
+async def _verify_payload(token: str, redis: Optional[Redis] = None) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        token_id: str = payload.get("sub")
-        # 檢查 Redis 中是否存在該 token
-        if not redis_client.exists(token_id):
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
-        return token_id
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise TokenInvalid("Invalid token")
+    # 檢查 Redis 中是否存在該 token
+    if not payload.get("sub") or not await (redis or redis_client()).exists(payload["sub"]):
+        raise TokenInvalid("Invalid or expired token")
+    return payload
+
+# 驗證 JWT token
+async def verify_token(token: str, redis: Optional[Redis] = None):
+    return (await _verify_payload(token, redis))["sub"]
+
+
+async def resolve_token(ordering_token: Optional[str], redis: Redis) -> str:
+    """
+    cookie → token_id。驗證過的 cookie 會在本 process 快取 TOKEN_CACHE_TTL 秒，
+    期間不再解密、驗 JWT、查 Redis；撤銷時由 store.token_cache 的 pub/sub 通知清除。
+    """
+    if not ordering_token:
+        raise TokenInvalid("Missing token")
+    token_id = token_cache.get(ordering_token)
+    if token_id:
+        return token_id
+    try:
+        token = cipher.decrypt(ordering_token.encode()).decode()
+    except Exception:
+        raise TokenInvalid("Invalid encrypted token")
+    payload = await _verify_payload(token, redis)
+    expires_in = payload["exp"] - time.time() if isinstance(payload.get("exp"), (int, float)) else None
+    token_cache.put(ordering_token, payload["sub"], expires_in)
+    return payload["sub"]
+
+
+async def require_token(ordering_token: str = Cookie(None), redis: Redis = Depends(get_redis)) -> str:
+    """FastAPI dependency：`token_id: str = Depends(require_token)`"""
+    return await resolve_token(ordering_token, redis)
 
 @token.get("/get-token")
-async def get_token(request: Request):
+async def get_token(request: Request, redis: Redis = Depends(get_redis)):
     if "ordering_token" in request.cookies:
         logger.info("Access token already exists in cookies.")
-        encrypted_token = request.cookies.get("ordering_token")
-        decrypted_token = decrypt_token(encrypted_token)
-        token_id = await verify_token(decrypted_token)
-        if not redis_client.exists(f"{token_id}_order_state"):
-            logger.info("Initializing order state for existing token.")
-            redis_client.setex(f"{token_id}_order_state", TOKEN_EXPIRE_MINUTES * 60, json.dumps(init_order_state()))
-
-        if not redis_client.exists(f"{token_id}_conversation"):
-            logger.info("Initializing conversation for existing token.")
-            redis_client.setex(f"{token_id}_conversation", TOKEN_EXPIRE_MINUTES * 60, json.dumps([
-            {
-                "type": "llm",
-                "response": "您好！歡迎使用語音點餐系統，請參考上方菜單並告訴我您想要什麼餐點？",
-                "time": datetime.now().isoformat()
-            }
-        ]))
+        token_id = await resolve_token(request.cookies.get("ordering_token"), redis)
+        created = await ensure_session(redis, token_id, init_order_state(), TOKEN_EXPIRE_MINUTES * 60)
+        if created:
+            logger.info(f"Initialized {', '.join(created)} for existing token.")
         return JSONResponse(
             content={"msg": "Token already set"},
             status_code=200
@@ -110,15 +141,10 @@ async def get_token(request: Request):
         access_token = create_access_token(
             data={"sub": token_id}, expires_delta=access_token_expires
         )
-        redis_client.setex(token_id, TOKEN_EXPIRE_MINUTES * 60, "valid")
-        redis_client.setex(f"{token_id}_order_state", TOKEN_EXPIRE_MINUTES * 60, json.dumps(init_order_state()))
-        redis_client.setex(f"{token_id}_conversation", TOKEN_EXPIRE_MINUTES * 60, json.dumps([
-            {
-                "type": "llm",
-                "response": "您好！歡迎使用語音點餐系統，請參考上方菜單並告訴我您想要什麼餐點？",
-                "time": datetime.now().isoformat()
-            }
-        ]))
+        # token、訂單、對話一次寫入
+        await create_session(redis, token_id, init_order_state(), TOKEN_EXPIRE_MINUTES * 60)
+        # 顧客快要開始說話了，順便把這個 worker 閒置後可能被卸載的模型叫醒（背景執行）
+        schedule_prewarm()
 
         encrypted_token = encrypt_token(access_token)
         logger.info(f"Setting cookie with encrypted_token: {encrypted_token}")
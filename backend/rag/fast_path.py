@@ -0,0 +1,275 @@
+# File: fast_path.py
+# 常見點餐句型的規則解析（例如「我要一份蛋餅」「兩杯大冰紅」），
+# 在呼叫 LLM 之前先比對菜單索引，能確定時直接產生與 LLM 相同格式的 sys/cus 回應。
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from .menu_catalog import MenuCatalog
+
+# 類別的口語簡稱，品項名稱 + 簡稱 也算別名（例如「玉米蛋餅」「火腿吐司」）
+CLASS_SHORT_NAMES = {
+    '台式蛋餅': ['蛋餅'],
+    '漢堡': ['堡'],
+    '帕瑪森軟法': ['軟法'],
+    '蛋包飯磚': ['蛋包飯'],
+}
+
+# 不在資料表內、但顧客常講的固定別名（對應 prompt 裡的模糊輸入規則）
+EXTRA_ALIASES = {
+    '蛋餅': '1',
+    '原味蛋餅': '1',
+    '紅茶': '1001',
+    '冰紅': '1001',
+    '冰紅茶': '1001',
+}
+
+# 主餐客製選項對應 main_menu 的欄位（0=不可選、1=可選）
+CUS_COLUMNS = {
+    '加蛋': 'add_egg',
+    '起司': 'cheese',
+    '泡菜': 'kimchi',
+    '燒肉': 'roast',
+    '起司牛奶': 'cheese_milk',
+    '山型丹麥': 'danish',
+}
+CUS_SYNONYMS = {'雙蛋': '加蛋'}
+CUS_DISPLAY = {'加蛋': '雙蛋'}
+
+# 飲料客製，None 表示預設值不需記錄
+DRINK_OPTIONS = {
+    '大杯': '大杯', '大': '大杯',
+    '中杯': None, '中': None, '冰': None, '正常冰': None,
+    '去冰': '去冰', '少冰': '少冰', '微冰': '微冰', '常溫': '常溫', '溫': '溫', '熱': '熱',
+    '無糖': '無糖', '微糖': '微糖', '半糖': '半糖', '少糖': '少糖', '全糖': None,
+}
+
+FILLERS = [
+    '我想要', '我想點', '請給我', '麻煩你', '我要', '我想', '給我', '幫我', '來個', '再來', '再加',
+    '還要', '還有', '然後', '以及', '加上', '謝謝', '麻煩', '好了', '就好', '這樣', '一下',
+    '要', '來', '再', '和', '跟', '加', '請', '我', '點', '的', '嗯', '那',
+]
+COUNTERS = set('份杯個塊片條碗盒顆套')
+NUMERALS = {'零': 0, '一': 1, '二': 2, '兩': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+PUNCTUATION = re.compile(r"[\s，。、！？,.!?；;：:～~「」]+")
+MAX_QUANTITY = 20
+
+_index_lock = threading.Lock()
+_index_cache: Dict[Tuple, "MenuIndex"] = {}
+
+
+def normalize_text(text: str) -> str:
+    """全形轉半形、英文轉大寫並移除標點與空白"""
+    text = unicodedata.normalize("NFKC", text).upper()
+    return PUNCTUATION.sub("", text)
+
+
+def clean_name(name: str) -> str:
+    """移除品項名稱裡的括號說明與空白，例如「麥克雞塊 (4塊)」→「麥克雞塊」"""
+    name = re.sub(r"\(.*?\)", "", unicodedata.normalize("NFKC", name))
+    return name.replace(" ", "").upper()
+
+
+def _fmt_price(price: float) -> str:
+    return str(int(price)) if float(price).is_integer() else str(price)
+
+
+def parse_quantity(text: str) -> Optional[int]:
+    """解析阿拉伯數字或中文數字（到九十九），無法解析回傳 None"""
+    if text.isdigit():
+        return int(text)
+    if not text or any(ch not in NUMERALS for ch in text):
+        return None
+    if '十' not in text:
+        return NUMERALS[text] if len(text) == 1 else None
+    tens, _, ones = text.partition('十')
+    value = (NUMERALS[tens] if tens else 1) * 10 + (NUMERALS[ones] if ones else 0)
+    return value if len(tens) <= 1 and len(ones) <= 1 else None
+
+
+class MenuIndex:
+    """菜單別名索引，以最長比對把整句話切成品項、數量、客製與贅詞"""
+
+    def __init__(self, items: Dict[str, Dict], cus_choice: Dict[str, int]):
+        self.items = items
+        self.lexicon: Dict[str, Tuple[str, object]] = {}
+        aliases: Dict[str, set] = {}
+
+        def add_alias(alias, item_id):
+            aliases.setdefault(alias, set()).add(item_id)
+
+        for item_id, item in items.items():
+            if item['table'] == 'combo_menu':
+                letter = item['name'].upper()
+                for alias in (f"{letter}套餐", f"{letter}餐", f"套餐{letter}"):
+                    add_alias(alias, item_id)
+                continue
+            name = clean_name(item['name'])
+            cls = item['class']
+            add_alias(name, item_id)
+            if item['table'] == 'drink_item':
+                continue
+            add_alias(cls + name, item_id)
+            for short in [cls] + CLASS_SHORT_NAMES.get(cls, []):
+                if not name.endswith(short) and not (short.endswith('堡') and name.endswith('堡')):
+                    add_alias(name + short, item_id)
+        for alias, item_id in EXTRA_ALIASES.items():
+            if item_id in items:
+                aliases[alias] = {item_id}
+
+        # 同一個別名對應多個品項就是模糊，交給 LLM
+        for alias, ids in aliases.items():
+            self.lexicon[alias] = ('item', next(iter(ids)) if len(ids) == 1 else None)
+        for key in cus_choice:
+            for surface in (key, '加' + key):
+                self.lexicon.setdefault(surface, ('cus', key))
+        for surface, key in CUS_SYNONYMS.items():
+            if key in cus_choice:
+                self.lexicon.setdefault(surface, ('cus', key))
+        for surface, option in DRINK_OPTIONS.items():
+            self.lexicon.setdefault(surface, ('drink', option))
+        for filler in FILLERS:
+            self.lexicon.setdefault(filler, ('filler', None))
+        self.max_len = max(len(word) for word in self.lexicon)
+
+    def tokenize(self, text: str) -> Optional[List[Tuple[str, object]]]:
+        """最長比對切詞；有任何字元無法辨識就回傳 None"""
+        tokens = []
+        i = 0
+        while i < len(text):
+            match = None
+            for length in range(min(self.max_len, len(text) - i), 0, -1):
+                word = text[i:i + length]
+                if word in self.lexicon:
+                    match = (word, self.lexicon[word])
+                    break
+            if match is None:
+                j = i
+                while j < len(text) and (text[j].isdigit() or text[j] in NUMERALS):
+                    j += 1
+                quantity = parse_quantity(text[i:j]) if j > i else None
+                if quantity is None:
+                    return None
+                if j < len(text) and text[j] in COUNTERS:
+                    j += 1
+                tokens.append(('qty', quantity))
+                i = j
+                continue
+            word, (kind, value) = match
+            if kind != 'filler':
+                tokens.append((kind, value))
+            i += len(word)
+        return tokens
+
+    def _accepts(self, item: Dict, kind: str, value) -> bool:
+        if kind == 'drink':
+            if item['table'] != 'drink_item':
+                return False
+            return value != '大杯' or item.get('L') is not None
+        if item['table'] != 'main_menu':
+            return False
+        column = CUS_COLUMNS.get(value)
+        return column is None or bool(item.get(column))
+
+    def match(self, text: str) -> Optional[List[Dict]]:
+        """把整句話解析成品項列表，只要有不確定的地方就回傳 None"""
+        tokens = self.tokenize(normalize_text(text))
+        if not tokens:
+            return None
+        orders: List[Dict] = []
+        pending_qty = None
+        pending_mods: List[Tuple[str, object]] = []
+        for kind, value in tokens:
+            if kind == 'item':
+                if value is None:
+                    return None
+                item = self.items[value]
+                if any(not self._accepts(item, k, v) for k, v in pending_mods):
+                    return None
+                orders.append({'item': item, 'quantity': pending_qty, 'cus': [v for _, v in pending_mods]})
+                pending_qty, pending_mods = None, []
+            elif kind == 'qty':
+                if pending_qty is not None:
+                    return None
+                pending_qty = value
+            else:
+                # 客製先套用到前一個品項，不適用的話留給下一個品項（例如「蛋餅大冰紅」）
+                if orders and pending_qty is None and not pending_mods and self._accepts(orders[-1]['item'], kind, value):
+                    orders[-1]['cus'].append(value)
+                else:
+                    pending_mods.append((kind, value))
+        if pending_mods:
+            return None
+        if pending_qty is not None:
+            # 「蛋餅兩份」：數量放在品項後面
+            if not orders or orders[-1]['quantity'] is not None:
+                return None
+            orders[-1]['quantity'] = pending_qty
+        for order in orders:
+            order['quantity'] = order['quantity'] or 1
+            if not 0 < order['quantity'] <= MAX_QUANTITY:
+                return None
+            order['cus'] = list(dict.fromkeys(c for c in order['cus'] if c))
+        return orders or None
+
+
+def _load_items(catalog: MenuCatalog) -> Dict[str, Dict]:
+    items = {}
+    for table, rows in catalog.tables.items():
+        for row in rows:
+            item = dict(row)
+            item['table'] = table
+            items[str(item['id'])] = item
+    return items
+
+
+def get_menu_index(catalog: MenuCatalog, cus_choice: Dict[str, int]) -> MenuIndex:
+    """每份菜單快照與客製設定只建一次索引，菜單重新載入後自動重建"""
+    key = (catalog.version, tuple(sorted(cus_choice.items())))
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is None:
+            index = MenuIndex(_load_items(catalog), cus_choice)
+            _index_cache.clear()
+            _index_cache[key] = index
+    return index
+
+
+def _describe(order: Dict, cus_choice: Dict[str, int]) -> str:
+    item, cus = order['item'], order['cus']
+    if item['table'] == 'combo_menu':
+        label = f"{item['name']}套餐 {_fmt_price(item['price'])} 元（{item['description']}）"
+    else:
+        if item['table'] == 'drink_item':
+            price = item['L'] if '大杯' in cus else item['M']
+        else:
+            price = item['price'] + sum(cus_choice.get(c, 0) for c in cus)
+        if item['table'] == 'main_menu':
+            extra = f" 加{'、'.join(CUS_DISPLAY.get(c, c) for c in cus)}" if cus else ''
+        else:
+            extra = ''.join(cus)
+        label = f"{item['class']}-{clean_name(item['name'])}{extra} {_fmt_price(price)} 元"
+    if order['quantity'] > 1:
+        label += f" x {order['quantity']}"
+    return label
+
+
+def fast_path_response(query: str, cus_choice: Dict[str, int], catalog: MenuCatalog) -> Optional[str]:
+    """
+    規則解析顧客查詢，能完全確定時回傳與 LLM 相同格式的回應（```sys / ```cus 區塊），
+    否則回傳 None 交給 LLM。
+    """
+    try:
+        orders = get_menu_index(catalog, cus_choice).match(query)
+    except Exception as e:
+        print(f"快速解析失敗：{e}")
+        return None
+    if not orders:
+        return None
+    sys_lines = ["intent: order"]
+    for order in orders:
+        cus = '、'.join(order['cus']) or '無'
+        sys_lines.append(f"+ {order['item']['id']} {order['quantity']} {cus}")
+    reply = f"好喔，{'，'.join(_describe(order, cus_choice) for order in orders)}！還要什麼嗎？"
+    return "```sys\n" + "\n".join(sys_lines) + "\n```\n```cus\n" + reply + "\n```"
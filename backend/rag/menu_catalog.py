@@ -0,0 +1,106 @@
+# File: menu_catalog.py
+# 啟動時一次把 SQLite 菜單載入記憶體，取代每行 sys 指令都查一次資料庫
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from .CRUD_database import dict_factory
+
+logger = logging.getLogger(__name__)
+
+MENU_TABLES = ('main_menu', 'drink_item', 'combo_menu')
+
+
+@dataclass(frozen=True)
+class MenuCatalog:
+    """不可變的菜單快照，可在多個執行緒間共用"""
+    version: Tuple[int, int]
+    tables: Mapping[str, Tuple[Mapping, ...]]
+    _by_id: Mapping[str, Mapping] = field(repr=False)
+    _by_class_name: Mapping[Tuple[str, str], Tuple[Mapping, ...]] = field(repr=False)
+
+    @classmethod
+    def from_rows(cls, rows: Dict[str, List[Dict]], version: Tuple[int, int] = (0, 0)) -> "MenuCatalog":
+        by_id: Dict[str, Mapping] = {}
+        by_class_name: Dict[Tuple[str, str], List[Mapping]] = {}
+        tables = {}
+        for table in MENU_TABLES:
+            frozen_rows = tuple(MappingProxyType(dict(row)) for row in rows.get(table, []))
+            tables[table] = frozen_rows
+            for row in frozen_rows:
+                by_id[str(row['id'])] = row
+                if table != 'combo_menu':
+                    by_class_name.setdefault((row['class'], row['name']), []).append(row)
+        return cls(
+            version=version,
+            tables=MappingProxyType(tables),
+            _by_id=MappingProxyType(by_id),
+            _by_class_name=MappingProxyType({k: tuple(v) for k, v in by_class_name.items()}),
+        )
+
+    def item(self, item_id: str) -> Optional[Mapping]:
+        """依 id 查品項（主餐為數字、飲料為 1001 起、套餐為 A1 等）"""
+        return self._by_id.get(str(item_id).strip())
+
+    def find(self, cls: str, name: str) -> List[Mapping]:
+        """依類別與品項名稱查詢，對應 query_name_to_price"""
+        return list(self._by_class_name.get((cls, name), ()))
+
+
+def load_catalog(db_file: str) -> MenuCatalog:
+    """以唯讀連線讀取所有菜單資料表，讀完即關閉連線"""
+    stat = os.stat(db_file)
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        conn.row_factory = dict_factory
+        rows = {table: conn.execute(f"SELECT * FROM {table}").fetchall() for table in MENU_TABLES}
+    finally:
+        conn.close()
+    return MenuCatalog.from_rows(rows, version=(stat.st_mtime_ns, stat.st_size))
+
+
+class MenuCatalogStore:
+    """
+    持有目前的菜單快照；SQLite 檔案變動時重新載入並整個替換，
+    讀取端拿到的永遠是完整的一份快照。
+    """
+
+    def __init__(self, db_file: str, check_interval: float = 2.0):
+        self.db_file = db_file
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._catalog = load_catalog(db_file)
+        self._checked_at = time.monotonic()
+        logger.info(f"menu catalog loaded: {sum(len(rows) for rows in self._catalog.tables.values())} items")
+
+    def current(self) -> MenuCatalog:
+        """回傳目前的快照，每隔 check_interval 秒檢查一次檔案是否變動"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._maybe_reload()
+        return self._catalog
+
+    def _maybe_reload(self):
+        if not self._lock.acquire(blocking=False):
+            # 其他執行緒正在重新載入，先用舊快照
+            return
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.db_file)
+            except OSError as e:
+                logger.error(f"Menu database not accessible: {e}")
+                return
+            if (stat.st_mtime_ns, stat.st_size) == self._catalog.version:
+                return
+            try:
+                self._catalog = load_catalog(self.db_file)
+                logger.info("menu catalog reloaded")
+            except Exception as e:
+                logger.error(f"Failed to reload menu catalog, keeping previous snapshot: {e}")
+        finally:
+            self._lock.release()
@@ -0,0 +1,192 @@
+# File: phonetic.py
+# 以菜單名稱的讀音建立索引，在送進 LLM 之前把 ASR 聽錯的同音、近音字改回菜單上的寫法
+# （例如「古早宏茶」→「古早紅茶」、「青花焦豬堡」→「青花椒豬堡」），不再靠 prompt 讓 LLM 猜。
+# 讀音使用 pypinyin（拼音與注音一一對應）、簡轉繁使用 opencc，兩者都是選用套件：
+#   pip install pypinyin opencc-python-reimplemented
+# 沒安裝 pypinyin 時只做全形轉半形與簡轉繁。
+import logging
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from .fast_path import CLASS_SHORT_NAMES, CUS_COLUMNS, CUS_SYNONYMS, DRINK_OPTIONS, EXTRA_ALIASES, clean_name
+from .menu_catalog import MenuCatalog
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+    logger.warning("pypinyin not installed, phonetic transcript repair disabled")
+
+try:
+    from opencc import OpenCC
+    _s2t = OpenCC("s2tw")
+except ImportError:
+    _s2t = None
+    logger.warning("opencc not installed, simplified-to-traditional conversion disabled")
+
+# 至少幾個音節才允許一個音節不同（太短的名稱容易誤判，例如「大奶茶」不該變成「鮮奶茶」）
+NEAR_MATCH_MIN_SYLLABLES = 4
+WILDCARD = "*"
+
+# 台灣口音與 ASR 常混淆的聲母
+_INITIALS = (("zh", "z"), ("ch", "c"), ("sh", "s"), ("n", "l"))
+
+
+def _fuzzy(syllable: str) -> str:
+    """把容易混淆的讀音歸成同一類：捲舌／不捲舌、n／l、前後鼻音（ing/in、eng/en、ang/an），不分聲調"""
+    for src, dst in _INITIALS:
+        if syllable.startswith(src):
+            syllable = dst + syllable[len(src):]
+            break
+    if syllable.endswith("ng") and not syllable.endswith("ong") and len(syllable) > 2:
+        syllable = syllable[:-1]
+    return syllable
+
+
+def to_traditional(text: str) -> str:
+    return _s2t.convert(text) if _s2t is not None else text
+
+
+def normalize_transcript(text: str) -> str:
+    """全形轉半形並轉為繁體"""
+    return to_traditional(unicodedata.normalize("NFKC", text))
+
+
+class PhoneticIndex:
+    """菜單詞彙（品項、常用別名、客製選項）的讀音索引，啟動時建立一次"""
+
+    def __init__(self, terms: List[str]):
+        self._syllables: Dict[str, str] = {}
+        self.terms = frozenset(terms)
+        exact: Dict[Tuple[str, ...], set] = {}
+        near: Dict[Tuple[str, ...], set] = {}
+        for term in terms:
+            key = self.key(term)
+            exact.setdefault(key, set()).add(term)
+            if len(key) >= NEAR_MATCH_MIN_SYLLABLES:
+                for i in range(len(key)):
+                    near.setdefault(key[:i] + (WILDCARD,) + key[i + 1:], set()).add(term)
+        self.exact: Dict[Tuple[str, ...], FrozenSet[str]] = {k: frozenset(v) for k, v in exact.items()}
+        self.near: Dict[Tuple[str, ...], FrozenSet[str]] = {k: frozenset(v) for k, v in near.items()}
+        self.lengths = sorted({len(k) for k in self.exact}, reverse=True)
+
+    def syllable(self, char: str) -> str:
+        """單字讀音（有快取）；非中文字原樣回傳（英文轉大寫）"""
+        value = self._syllables.get(char)
+        if value is None:
+            value = _fuzzy(lazy_pinyin(char, style=Style.NORMAL)[0]) if '一' <= char <= '鿿' else char.upper()
+            self._syllables[char] = value
+        return value
+
+    def key(self, text: str) -> Tuple[str, ...]:
+        return tuple(self.syllable(char) for char in text)
+
+    def _literal_spans(self, text: str) -> List[Optional[Tuple[int, int]]]:
+        """每個字所在的、本身就是菜單詞彙的最長片段；改寫時不能只切到這種片段的一部分"""
+        spans: List[Optional[Tuple[int, int]]] = [None] * len(text)
+        for length in self.lengths:
+            for i in range(len(text) - length + 1):
+                if text[i:i + length] in self.terms:
+                    for j in range(i, i + length):
+                        if spans[j] is None:
+                            spans[j] = (i, i + length)
+        return spans
+
+    def _lookup(self, window: str, key: Tuple[str, ...]) -> Optional[str]:
+        candidates = self.exact.get(key)
+        if candidates is None and len(key) >= NEAR_MATCH_MIN_SYLLABLES:
+            found = set()
+            for i in range(len(key)):
+                found |= self.near.get(key[:i] + (WILDCARD,) + key[i + 1:], frozenset())
+            candidates = frozenset(found) if found else None
+        if not candidates:
+            return None
+        if window in candidates:
+            return window
+        # 同音的品項不只一個時不改，交給 LLM
+        return next(iter(candidates)) if len(candidates) == 1 else None
+
+    def repair(self, text: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """由左到右、較長的詞優先，把讀音相同（或只差一個音節）的片段換成菜單寫法"""
+        key = self.key(text)
+        spans = self._literal_spans(text)
+        out, corrections = [], []
+        i = 0
+        while i < len(text):
+            for length in self.lengths:
+                if i + length > len(text):
+                    continue
+                window = text[i:i + length]
+                end = i + length
+                if window not in self.terms and any(
+                        span is not None and (span[0] < i or span[1] > end) for span in spans[i:end]):
+                    continue
+                target = self._lookup(window, key[i:i + length])
+                if target is not None:
+                    if target != window:
+                        corrections.append((window, target))
+                    out.append(target)
+                    i += length
+                    break
+            else:
+                out.append(text[i])
+                i += 1
+        return "".join(out), corrections
+
+
+def _menu_terms(catalog: MenuCatalog) -> List[str]:
+    terms = set(EXTRA_ALIASES) | set(CUS_COLUMNS) | set(CUS_SYNONYMS) | set(DRINK_OPTIONS)
+    for table in ('main_menu', 'drink_item'):
+        for row in catalog.tables[table]:
+            name = clean_name(row['name'])
+            terms.add(name)
+            for short in CLASS_SHORT_NAMES.get(row.get('class'), []):
+                if not name.endswith(short):
+                    terms.add(name + short)
+    # 少於兩個中文字的詞太容易誤判
+    return sorted(t for t in terms if sum('一' <= c <= '鿿' for c in t) >= 2)
+
+
+_index_lock = threading.Lock()
+_index_cache: Dict[Tuple, PhoneticIndex] = {}
+
+
+def get_phonetic_index(catalog: MenuCatalog) -> Optional[PhoneticIndex]:
+    """依菜單版本建立並快取讀音索引；沒有 pypinyin 時回傳 None"""
+    if lazy_pinyin is None:
+        return None
+    index = _index_cache.get(catalog.version)
+    if index is None:
+        with _index_lock:
+            index = _index_cache.get(catalog.version)
+            if index is None:
+                index = PhoneticIndex(_menu_terms(catalog))
+                _index_cache.clear()
+                _index_cache[catalog.version] = index
+                logger.info(f"phonetic index built: {len(index.terms)} terms")
+    return index
+
+
+@dataclass
+class TranscriptRepair:
+    text: str
+    raw: str
+    corrections: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return self.text != self.raw
+
+
+def repair_transcript(text: str, catalog: MenuCatalog) -> TranscriptRepair:
+    """ASR 結果送進 LLM 前的校正：全形轉半形、簡轉繁，再依讀音把品項名稱改回菜單寫法"""
+    normalized = normalize_transcript(text)
+    index = get_phonetic_index(catalog)
+    if index is None:
+        return TranscriptRepair(text=normalized, raw=text)
+    repaired, corrections = index.repair(normalized)
+    return TranscriptRepair(text=repaired, raw=text, corrections=corrections)
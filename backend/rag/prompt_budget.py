@@ -0,0 +1,124 @@
+# File: prompt_budget.py
+# 依 token 預算組出 prompt 的動態部分：對話紀錄只保留最近幾輪，較早的收成摘要，
+# 菜單資訊依檢索相關度由高到低放到預算用完為止。
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+# 整個 prompt（含固定說明）的 token 上限
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000))
+# 逐字保留的最近對話筆數
+HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", 6))
+# 對話紀錄最多佔動態預算的比例，其餘留給菜單資訊
+HISTORY_SHARE = 0.3
+MIN_CONTEXT_DOCS = 3
+
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓字元一字約一個 token，其餘約四個字元一個 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _turn_text(turn: Dict) -> Optional[str]:
+    if turn.get("type") == "cus":
+        return f"顧客：{turn.get('transcript', '')}"
+    if turn.get("type") == "llm":
+        return f"店員：{turn.get('response', '')}"
+    return None
+
+
+def _summarize(turns: List[Dict], limit: int = 40) -> str:
+    """較早的對話只留顧客說過的話，點了什麼已經記在訂單狀態裡"""
+    said = [t.get("transcript", "") for t in turns if t.get("type") == "cus" and t.get("transcript")]
+    if not said:
+        return ""
+    quoted = "、".join(f"「{text[:limit]}」" for text in said[-5:])
+    return f"（較早 {len(turns)} 筆對話已省略，顧客曾說：{quoted}；已點品項以當前訂單狀態為準）"
+
+
+def format_history(conversation_history: List[Dict], budget: int, turns: int = HISTORY_TURNS) -> str:
+    kept = [t for t in conversation_history if _turn_text(t)]
+    split = max(len(kept) - turns, 0)
+    recent = [_turn_text(t) for t in kept[split:]]
+    # 最近的對話也超過預算時，從最舊的開始併入摘要
+    while recent and estimate_tokens("\n".join(recent)) > budget:
+        recent.pop(0)
+        split += 1
+    summary = _summarize(kept[:split])
+    return "\n".join(([summary] if summary else []) + recent)
+
+
+def format_order_state(order_state: Dict) -> str:
+    return json.dumps(order_state, ensure_ascii=False, separators=(",", ":"))
+
+
+def format_context(docs, budget: int):
+    """docs 已依相關度排序，放到預算用完為止（至少保留 MIN_CONTEXT_DOCS 筆）"""
+    chunks, used = [], 0
+    for doc in docs:
+        cost = estimate_tokens(doc.page_content) + 1
+        if chunks and len(chunks) >= MIN_CONTEXT_DOCS and used + cost > budget:
+            break
+        chunks.append(doc.page_content)
+        used += cost
+    return "\n\n".join(chunks), len(chunks)
+
+
+class PromptStats:
+    """保留最近幾輪的 prompt token 數，給 /metrics 查看"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._turns = deque(maxlen=window)
+
+    def record(self, stats: Dict):
+        with self._lock:
+            self._turns.append(stats)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            turns = list(self._turns)
+        if not turns:
+            return {"turns": 0}
+        totals = [t["total"] for t in turns]
+        return {
+            "turns": len(turns),
+            "avg_total": round(sum(totals) / len(totals), 1),
+            "max_total": max(totals),
+            "last": turns[-1],
+        }
+
+
+prompt_stats = PromptStats()
+
+
+def assemble_prompt_inputs(query: str, conversation_history: List[Dict], docs, order_state: Dict,
+                           static_tokens: int, budget: int = PROMPT_TOKEN_BUDGET) -> Dict:
+    """回傳 history / context / order_state 三個 prompt 欄位，並記錄本輪 token 數"""
+    order_text = format_order_state(order_state)
+    fixed = static_tokens + estimate_tokens(query) + estimate_tokens(order_text)
+    dynamic = max(budget - fixed, 0)
+    history = format_history(conversation_history or [], int(dynamic * HISTORY_SHARE))
+    history_tokens = estimate_tokens(history)
+    context, docs_used = format_context(docs or [], dynamic - history_tokens)
+    context = context or "暫無菜單資訊"
+    stats = {
+        "static": static_tokens,
+        "query": estimate_tokens(query),
+        "order_state": estimate_tokens(order_text),
+        "history": history_tokens,
+        "context": estimate_tokens(context),
+        "docs_used": docs_used,
+        "docs_total": len(docs or []),
+    }
+    stats["total"] = sum(v for k, v in stats.items() if k not in ("docs_used", "docs_total"))
+    prompt_stats.record(stats)
+    return {"history": history, "context": context, "order_state": order_text, "stats": stats}
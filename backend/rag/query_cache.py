@@ -0,0 +1,180 @@
+# File: query_cache.py
+# 顧客整天重複同樣的話（「有什麼飲料」「大冰紅」「蛋餅」），查詢向量與檢索結果以正規化後的文字為 key 快取。
+# 本機一層 LRU（筆數 + TTL 上限），可選擇再加一層 Redis 讓所有 worker 共用。
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from langchain_core.documents import Document
+
+from .fast_path import normalize_text
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", 3600))
+
+
+class QueryCache:
+    """
+    執行緒安全的 LRU + TTL 快取。attach_redis() 之後本機沒命中會再查 Redis，
+    Redis 有錯誤時只記錄並當作沒命中，不影響點餐流程。
+    """
+
+    def __init__(self, name: str, maxsize: int = QUERY_CACHE_SIZE, ttl: int = QUERY_CACHE_TTL,
+                 dumps: Optional[Callable] = None, loads: Optional[Callable] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._dumps = dumps
+        self._loads = loads
+        self._redis = None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._namespace = None
+        self._counts = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0,
+                        "expired": 0, "invalidations": 0, "redis_errors": 0}
+        # fork 時其他執行緒可能正持有鎖，子行程換一把新的
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def attach_redis(self, client):
+        if self._dumps is None or self._loads is None:
+            raise ValueError(f"{self.name} cache has no serializer for redis")
+        self._redis = client
+
+    def _redis_key(self, key: str) -> str:
+        return f"query_cache:{self.name}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counts[counter] += 1
+
+    def use_namespace(self, namespace: str):
+        """namespace（菜單版本）改變時清空本機快取；Redis 的舊資料因 key 帶版本而不會再命中"""
+        if namespace == self._namespace:
+            return
+        with self._lock:
+            if namespace != self._namespace:
+                if self._namespace is not None:
+                    self._entries.clear()
+                    self._counts["invalidations"] += 1
+                    logger.info(f"{self.name} cache invalidated")
+                self._namespace = namespace
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self._counts["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._counts["expired"] += 1
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning(f"{self.name} cache redis get failed: {e}")
+                self._count("redis_errors")
+                raw = None
+            if raw is not None:
+                value = self._loads(raw)
+                self._put(key, value)
+                self._count("redis_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def _put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def set(self, key: str, value):
+        self._put(key, value)
+        if self._redis is not None:
+            try:
+                self._redis.setex(self._redis_key(key), self.ttl, self._dumps(value))
+            except Exception as e:
+                logger.warning(f"{self.name} cache redis set failed: {e}")
+                self._count("redis_errors")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+            size = len(self._entries)
+        lookups = counts["hits"] + counts["redis_hits"] + counts["misses"]
+        return {
+            **counts,
+            "size": size,
+            "maxsize": self.maxsize,
+            "hit_rate": round((counts["hits"] + counts["redis_hits"]) / lookups, 3) if lookups else None,
+            "redis": self._redis is not None,
+        }
+
+
+def _dump_vector(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _load_vector(raw: bytes):
+    vector = array("f")
+    vector.frombytes(raw)
+    return vector.tolist()
+
+
+def _dump_docs(docs) -> str:
+    return json.dumps([[doc.page_content, doc.metadata] for doc in docs], ensure_ascii=False)
+
+
+def _load_docs(raw):
+    return [Document(page_content=text, metadata=metadata) for text, metadata in json.loads(raw)]
+
+
+# 查詢向量只跟 embedding 模型有關，與菜單版本無關
+embedding_cache = QueryCache("embedding", dumps=_dump_vector, loads=_load_vector)
+# 檢索結果（已排序的 docs）依菜單版本分區
+retrieval_cache = QueryCache("retrieval", dumps=_dump_docs, loads=_load_docs)
+
+
+def cache_key(text: str) -> str:
+    return normalize_text(text)
+
+
+def embed_query(embeddings, query: str):
+    """帶快取的 embed_query，key 為模型名稱 + 正規化後的查詢"""
+    key = f"{getattr(embeddings, 'model', type(embeddings).__name__)}:{cache_key(query)}"
+    vector = embedding_cache.get(key)
+    if vector is None:
+        vector = embeddings.embed_query(query)
+        embedding_cache.set(key, vector)
+    return vector
+
+
+def attach_redis(client):
+    """讓所有 worker 共用快取，setup.py 在 QUERY_CACHE_REDIS=1 時呼叫"""
+    embedding_cache.attach_redis(client)
+    retrieval_cache.attach_redis(client)
+
+
+def cache_stats() -> Dict:
+    return {"embedding": embedding_cache.stats(), "retrieval": retrieval_cache.stats()}
@@ -1,10 +1,18 @@
 # File: rag_retrieval.py
 # 晨間廚房語音點餐系統，基於 morning_eat.xlsx，LLM 回傳 id 給系統，顧客用自然語言，生成 JSON 訂單並匯出
 from langchain_core.prompts import PromptTemplate
-from .CRUD_database import query_drink_menu, query_main_menu, query_combo_menu, query_name_to_price
-from .useModel import useModel
-from sqlite3 import Connection
+from .useModel import model_registry
+from .fast_path import fast_path_response
+from .menu_catalog import MenuCatalog, MenuCatalogStore
+from .prompt_budget import assemble_prompt_inputs, estimate_tokens
+from .retrieval import retrieve, aretrieve
+import asyncio
+import json
+import logging
 import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
 
 
 # 初始化訂單
@@ -16,46 +24,168 @@ def init_order_state():
     }
 
 # RAG 檢索 + LLM 生成回應 + 解析訂單
-def rag_query(query, conversation_history, vectorstore, order_state, cus_choice, conn):
-    # 檢索相關菜單
+def rag_query(query, conversation_history, vectorstore, order_state, cus_choice, catalog: MenuCatalog):
+    # 常見點餐句型先用規則解析，能確定就不呼叫 LLM
+    fast_response = fast_path_response(query, cus_choice, catalog)
+    if fast_response is not None:
+        return parse_llm_response(fast_response, order_state, cus_choice, catalog)
+
+    # 依意圖與類別檢索相關菜單，view_cus / end 不檢索
     try:
-        docs = vectorstore.similarity_search(query, k=50)
-        context = "\n\n".join([doc.page_content for doc in docs])
+        docs, plan = retrieve(vectorstore, query, catalog)
+        logger.info(f"retrieval: intent={plan.intent} k={plan.k} filter={plan.filter} docs={len(docs)}")
     except Exception as e:
         print(f"RAG 檢索失敗：{e}")
-        context = "暫無菜單資訊"
+        docs = []
 
-    prompt, ex_json = create_prompt_template()
+    inputs = build_prompt_inputs(query, conversation_history, docs, order_state)
 
     # 用 Ollama 生成回應
     try:
-        model = useModel("gemini_api")
+        chain = create_chain()
 
-        chain = prompt | model
+        with model_registry.timed():
+            response = chain.invoke(inputs)
 
-        response = chain.invoke({'json': ex_json, 'history': conversation_history, 'context': context, 'order_state': order_state, 'query': query})
-
-        if response.content != None:
-            response = response.content
+        response = response_text(response)
 
         # 解析 LLM 回應，更新訂單
-        customer_response, new_order_state = parse_llm_response(response, order_state, cus_choice, conn)
+        customer_response, new_order_state = parse_llm_response(response, order_state, cus_choice, catalog)
         return customer_response, new_order_state
     except Exception as e:
         print(f"Ollama 推理失敗：{e}")
         return "不好意思，系統出了點問題，可以再說一次你的需求嗎？", order_state
 
-def query_db(item_id, conn):
-    if item_id.isnumeric() and int(item_id) > 1000:
-        result = query_drink_menu(conn, item_id)
-    elif item_id.isnumeric():
-        result = query_main_menu(conn, item_id)
-    else:
-        result = query_combo_menu(conn, item_id)
+# 非同步版本：檢索與 LLM 呼叫都不阻塞 event loop，同一個 worker 可以同時服務多個點餐連線
+async def arag_query(query, conversation_history, vectorstore, order_state, cus_choice, catalog: MenuCatalog):
+    fast_response = fast_path_response(query, cus_choice, catalog)
+    if fast_response is not None:
+        return parse_llm_response(fast_response, order_state, cus_choice, catalog)
+
+    # 依意圖檢索相關菜單（embedding 與 Chroma 查詢會丟到 executor 執行）
+    try:
+        docs, plan = await aretrieve(vectorstore, query, catalog)
+        logger.info(f"retrieval: intent={plan.intent} k={plan.k} filter={plan.filter} docs={len(docs)}")
+    except Exception as e:
+        print(f"RAG 檢索失敗：{e}")
+        docs = []
+
+    inputs = build_prompt_inputs(query, conversation_history, docs, order_state)
+
+    try:
+        # 第一次取用會建立 HTTP/gRPC client 與前綴快取，放到 executor 避免卡住 event loop
+        chain = await asyncio.get_running_loop().run_in_executor(None, create_chain)
+
+        with model_registry.timed():
+            response = await chain.ainvoke(inputs)
+
+        response = response_text(response)
+
+        customer_response, new_order_state = parse_llm_response(response, order_state, cus_choice, catalog)
+        return customer_response, new_order_state
+    except Exception as e:
+        print(f"Ollama 推理失敗：{e}")
+        return "不好意思，系統出了點問題，可以再說一次你的需求嗎？", order_state
+
+async def astream_rag_query(query, conversation_history, vectorstore, order_state, cus_choice, catalog: MenuCatalog,
+                            docs=None, raise_errors: bool = False):
+    """
+    逐段產生 LLM 原始輸出（```sys / ```cus 格式），快速解析命中時一次給完整回應。
+    docs 為事先檢索好的菜單（例如依 ASR 中間結果投機檢索的結果）時不再檢索。
+    raise_errors=True 時 LLM 失敗直接丟出例外，不產生道歉回應（投機生成要知道輸出不完整）。
+    """
+    fast_response = fast_path_response(query, cus_choice, catalog)
+    if fast_response is not None:
+        yield fast_response
+        return
+
+    if docs is None:
+        try:
+            docs, plan = await aretrieve(vectorstore, query, catalog)
+            logger.info(f"retrieval: intent={plan.intent} k={plan.k} filter={plan.filter} docs={len(docs)}")
+        except Exception as e:
+            print(f"RAG 檢索失敗：{e}")
+            docs = []
+
+    inputs = build_prompt_inputs(query, conversation_history, docs, order_state)
+
+    started = False
+    try:
+        chain = await asyncio.get_running_loop().run_in_executor(None, create_chain)
+        with model_registry.timed() as mark_first_token:
+            async for chunk in chain.astream(inputs):
+                text = response_text(chunk)
+                if text:
+                    mark_first_token()
+                    started = True
+                    yield text
+    except Exception as e:
+        print(f"Ollama 推理失敗：{e}")
+        if raise_errors:
+            raise
+        if not started:
+            yield "```cus\n不好意思，系統出了點問題，可以再說一次你的需求嗎？\n```"
+
+async def astream_order_real_time(query: str, conversation_history, vectorstore, order_state, cus_choice, catalog: MenuCatalogStore,
+                                  docs=None, chunks=None):
+    """
+    串流版 order_real_time，依序產生事件：
+    ("cus", 文字片段)、("sys", 已套用到 order_state 的指令)，最後是 ("done", 完整顧客回應)。
+    chunks 為已經在生成中的 LLM 原始輸出（投機執行命中時）則直接解析它，不再呼叫 LLM。
+    """
+    cus_choice = {"加蛋": 10, "起司": 10, "泡菜": 10, '燒肉': 20, '起司牛奶': 5, '山型丹麥': 10}
+    menu = catalog.current()
+    parser = StreamingResponseParser()
+    cus_parts = []
+
+    def handle(events):
+        for kind, value in events:
+            if kind == "sys":
+                try:
+                    apply_sys_line(value, order_state, cus_choice, menu)
+                except Exception as e:
+                    print(f"無法套用指令 {value!r}：{e}")
+                    continue
+            else:
+                cus_parts.append(value)
+            yield kind, value
+
+    if chunks is None:
+        chunks = astream_rag_query(query, conversation_history, vectorstore, order_state, cus_choice, menu, docs=docs)
+    async for chunk in chunks:
+        for event in handle(parser.feed(chunk)):
+            yield event
+    for event in handle(parser.close()):
+        yield event
+    yield "done", "".join(cus_parts).strip()
+
+def build_prompt_inputs(query, conversation_history, docs, order_state):
+    """依 token 預算裁剪對話紀錄與菜單資訊，組出 prompt 的輸入欄位"""
+    prompt, ex_json = create_prompt_template()
+    static_tokens = estimate_tokens(static_prompt_prefix())
+    parts = assemble_prompt_inputs(query, conversation_history, docs, order_state, static_tokens)
+    logger.info(f"prompt tokens: {parts['stats']}")
+    return {'json': ex_json, 'history': parts['history'], 'context': parts['context'], 'order_state': parts['order_state'], 'query': query}
+
+def create_chain(model_name=None):
+    """後端已快取固定前綴時只套用動態部分的 template，否則送完整 prompt"""
+    model, prefix_cached = model_registry.with_prefix(model_name, static_prompt_prefix())
+    prompt = create_suffix_template() if prefix_cached else create_prompt_template()[0]
+    return prompt | model
+
+def response_text(response):
+    # Chat 模型回傳 AIMessage，Ollama LLM 直接回傳字串
+    content = getattr(response, 'content', None)
+    return content if content is not None else response
+
+def query_db(item_id, catalog: MenuCatalog):
+    result = catalog.item(item_id)
+    if result is None:
+        raise KeyError(f"菜單中沒有 id {item_id}")
     return result
 
-def query_price(cls: str, name: str, conn: Connection):
-    result = query_name_to_price(conn, cls, name)
+def query_price(cls: str, name: str, catalog: MenuCatalog):
+    result = catalog.find(cls, name)
     return result
 
 def gen_random_id():
@@ -65,7 +195,7 @@ def gen_random_id():
 def deal_with_price(item, cus):
     if item.get('price', None) is not None:
         return item['price']
-    if cus == "大杯":
+    if "大杯" in cus:
         return item['L']
     return item['M']
 
@@ -110,7 +240,7 @@ def deal_with_cus(cus, cus_choice):
             cus_price += value
     return cus, cus_price
 
-def parse_llm_response(response, order_state, cus_choice, conn):
+def parse_llm_response(response, order_state, cus_choice, catalog: MenuCatalog):
     # 找到sys和cus的區塊
     sys_block = re.search(r"```sys\n(.*?)```", response, re.DOTALL)
     cus_block = re.search(r"```cus\n(.*?)```", response, re.DOTALL)
@@ -125,40 +255,120 @@ def parse_llm_response(response, order_state, cus_choice, conn):
     # 解析系統回應
     sys_lines = sys_content.split("\n")
     for line in sys_lines:
-        if line.startswith("intent:"):
-            intent = line.split(": ")[1].strip()
-            order_state["status"] = intent
-        if line.startswith("+"):
-            action, item_id, quantity, cus = line.split()
-            result = query_db(item_id, conn=conn)
-            cus, cus_price = deal_with_cus(cus, cus_choice)
-            order_state = change_order(order_state, action, result, int(quantity), cus, cus_price)
-        if line.startswith("-"):
-            action, item_id, quantity = line.split()
-            order_state = change_order(order_state, action, item_id, int(quantity))
+        order_state = apply_sys_line(line, order_state, cus_choice, catalog)
     return cus_content, order_state
 
-def create_prompt_template():
-    example_json = {
-          "items": [
-              {
-                "id": 12131,
-                "item_id": 1,
-                "class": "台式蛋餅",
-                "name": "原味",
-                "unitPrice": 30,
-                "subtotal": 65,
-                "quantity": 1,
-                "customization": {
-                    "cus_price": 35,
-                    "note": "雙蛋、起司、泡菜",
-                }
-              }
-            ],
-          "total_price": 65,
-          "status": "ongoing"
-    }
-    template = '''
+def apply_sys_line(line, order_state, cus_choice, catalog: MenuCatalog):
+    """套用單行 sys 指令（intent / + / -）到訂單"""
+    if line.startswith("intent:"):
+        intent = line.split(": ")[1].strip()
+        order_state["status"] = intent
+    if line.startswith("+"):
+        action, item_id, quantity, cus = line.split()
+        result = query_db(item_id, catalog=catalog)
+        cus, cus_price = deal_with_cus(cus, cus_choice)
+        order_state = change_order(order_state, action, result, int(quantity), cus, cus_price)
+    if line.startswith("-"):
+        action, item_id, quantity = line.split()
+        order_state = change_order(order_state, action, item_id, int(quantity))
+    return order_state
+
+class StreamingResponseParser:
+    """
+    邊接收 LLM 串流邊解析 ```sys / ```cus 區塊：
+    sys 區塊每湊滿一行就回傳 ("sys", line)，cus 區塊的文字以 ("cus", delta) 逐段回傳。
+    """
+    FENCE = "```"
+
+    def __init__(self):
+        self.buffer = ""
+        self.block = None
+        self.cus_started = False
+
+    def feed(self, chunk: str):
+        self.buffer += chunk
+        events = []
+        while True:
+            if self.block is None:
+                match = re.search(r"```(sys|cus)[ \t]*\n", self.buffer)
+                if not match:
+                    # 保留可能是區塊開頭的尾巴，其餘丟掉
+                    self.buffer = self.buffer[-8:]
+                    break
+                self.block = match.group(1)
+                self.buffer = self.buffer[match.end():]
+            elif self.block == "sys":
+                fence, newline = self.buffer.find(self.FENCE), self.buffer.find("\n")
+                if fence >= 0 and (newline < 0 or fence < newline):
+                    # 結束標記可能緊接在最後一行指令後面（「+ 1 1 無```」），先切開再送出指令
+                    line = self.buffer[:fence].strip()
+                    if line:
+                        events.append(("sys", line))
+                    self._close_block(fence)
+                    continue
+                if newline < 0:
+                    break
+                line, self.buffer = self.buffer.split("\n", 1)
+                if line.strip():
+                    events.append(("sys", line.strip()))
+            else:
+                end = self.buffer.find(self.FENCE)
+                if end >= 0:
+                    self._emit_cus(self.buffer[:end].rstrip(), events)
+                    self._close_block(end)
+                    continue
+                # 結尾的反引號或換行可能屬於結束標記，先保留
+                keep = len(self.buffer) - len(self.buffer.rstrip("`\n "))
+                self._emit_cus(self.buffer[:len(self.buffer) - keep], events)
+                self.buffer = self.buffer[len(self.buffer) - keep:]
+                break
+        return events
+
+    def close(self):
+        """串流結束，送出殘留的內容（LLM 忘了寫結束標記時）"""
+        events = []
+        if self.block == "sys" and self.buffer.split(self.FENCE, 1)[0].strip():
+            events.append(("sys", self.buffer.split(self.FENCE, 1)[0].strip()))
+        elif self.block == "cus":
+            self._emit_cus(self.buffer.rstrip("`\n "), events)
+        self.buffer, self.block = "", None
+        return events
+
+    def _close_block(self, end: int = None):
+        start = self.buffer.find(self.FENCE) if end is None else end
+        self.buffer = self.buffer[start + len(self.FENCE):]
+        self.block = None
+
+    def _emit_cus(self, text: str, events):
+        if not self.cus_started:
+            text = text.lstrip()
+        if text:
+            self.cus_started = True
+            events.append(("cus", text))
+
+# 範例訂單 JSON，顯示在固定說明裡讓 LLM 知道訂單格式
+EXAMPLE_ORDER_JSON = {
+    "items": [
+        {
+            "id": 12131,
+            "item_id": 1,
+            "class": "台式蛋餅",
+            "name": "原味",
+            "unitPrice": 30,
+            "subtotal": 65,
+            "quantity": 1,
+            "customization": {
+                "cus_price": 35,
+                "note": "雙蛋、起司、泡菜",
+            }
+        }
+    ],
+    "total_price": 65,
+    "status": "ongoing"
+}
+
+# 固定說明與範例：每輪都一樣，放在 prompt 最前面，讓後端可以快取這段前綴
+STATIC_PREFIX_TEMPLATE = '''
     你是一個晨間廚房早餐店店員，負責幫顧客快速點餐、確認訂單、回答菜單問題，態度要親切、熱情，像在台灣早餐店櫃檯服務一樣！用戶可能因語音辨識錯誤，你要自己想辦法猜回來，嘗試用語音角度理解可能的正確詞彙，你的任務是根據顧客的自然語言查詢、菜單資訊和當前訂單狀態，生成兩部分純文字回應：
     1. **給系統**：這輪顧客點了什麼或刪除了什麼品項的 id 編號及數量，以及客製化內容。
     2. **給顧客**：親切的台灣口語回應，包含完整品項名稱、價格（用 OO 元標示）、客製等。
@@ -407,7 +617,10 @@ def create_prompt_template():
     ### 當前訂單狀態（JSON 格式）
     {json}
 
-    ### 對話紀錄 (JSON 格式)
+'''
+
+# 每輪變動的部分（對話、菜單資訊、訂單、查詢），盡量保持精簡
+DYNAMIC_SUFFIX_TEMPLATE = '''    ### 對話紀錄（較早的對話只保留摘要）
     {history}
 
     ### 開始吧！
@@ -417,13 +630,36 @@ def create_prompt_template():
     - **用戶查詢**: {query}
 
       '''
+
+@lru_cache(maxsize=1)
+def static_prompt_prefix() -> str:
+    """填好範例 JSON 的固定前綴，和完整 prompt 的開頭逐字相同"""
+    return STATIC_PREFIX_TEMPLATE.replace("{json}", str(EXAMPLE_ORDER_JSON))
+
+@lru_cache(maxsize=1)
+def create_prompt_template():
+    # PromptTemplate 只編譯一次，之後每輪直接重用
     prompt = PromptTemplate(
-        template=template,
+        template=STATIC_PREFIX_TEMPLATE + DYNAMIC_SUFFIX_TEMPLATE,
         input_variables=["json", "history", "context", "order_state", "query"]
     )
-    return prompt, example_json
+    return prompt, EXAMPLE_ORDER_JSON
+
+@lru_cache(maxsize=1)
+def create_suffix_template():
+    """後端已快取固定前綴時，只送出動態部分"""
+    return PromptTemplate(
+        template=DYNAMIC_SUFFIX_TEMPLATE,
+        input_variables=["history", "context", "order_state", "query"]
+    )
+
+def order_real_time(query: str, conversation_history, vectorstore, order_state, cus_choice, catalog: MenuCatalogStore):
+    cus_choice = {"加蛋": 10, "起司": 10, "泡菜": 10, '燒肉': 20, '起司牛奶': 5, '山型丹麥': 10}
+    # 整輪對話使用同一份菜單快照
+    response, order_state = rag_query(query, conversation_history, vectorstore, order_state, cus_choice, catalog.current())
+    return response, order_state
 
-def order_real_time(query: str, conversation_history, vectorstore, order_state, cus_choice, conn):
+async def aorder_real_time(query: str, conversation_history, vectorstore, order_state, cus_choice, catalog: MenuCatalogStore):
     cus_choice = {"加蛋": 10, "起司": 10, "泡菜": 10, '燒肉': 20, '起司牛奶': 5, '山型丹麥': 10}
-    response, order_state = rag_query(query, conversation_history, vectorstore, order_state, cus_choice, conn)
-    return response, order_state
\ No newline at end of file
+    response, order_state = await arag_query(query, conversation_history, vectorstore, order_state, cus_choice, catalog.current())
+    return response, order_state
@@ -0,0 +1,193 @@
+# File: retrieval.py
+# 依意圖與類別決定要不要檢索、檢索幾筆、用哪些 metadata 過濾，
+# 取代每輪固定 similarity_search(k=50)。metadata（table/class/name）由 morning_eat_convert_database.py 寫入。
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from .fast_path import CLASS_SHORT_NAMES, normalize_text, clean_name
+from .menu_catalog import MenuCatalog
+from .query_cache import cache_key, embed_query, retrieval_cache
+
+logger = logging.getLogger(__name__)
+
+# 意圖關鍵字，依序判斷（先比對到的優先）
+INTENT_KEYWORDS = [
+    ('end', ['結束', '就這樣', '就這些', '沒有了', '沒了', '結帳', '買單', '送出訂單']),
+    ('view_cus', ['確認', '我點了', '點了什麼', '點了哪些', '我的餐點', '我的訂單', '總共', '一共']),
+    ('cancel', ['不要了', '取消', '刪掉', '去掉', '拿掉', '不要']),
+    # 不放單獨的「嗎」「什麼」：「我要一份蛋餅可以嗎」是點餐，不能被句尾的問句判成 query
+    ('query', ['有什麼', '有哪些', '有啥', '有沒有', '有賣', '推薦', '菜單', '多少錢', '幾塊', '好吃',
+               '是什麼', '什麼口味', '哪些口味', '哪幾種']),
+]
+# 不需要菜單資訊的意圖（句子裡沒提到任何品項或類別時才略過檢索）
+SKIP_RETRIEVAL_INTENTS = {'end', 'view_cus'}
+
+DRINK_KEYWORDS = ['飲料', '飲品', '喝', '紅茶', '綠茶', '奶茶', '果茶', '桂花青', '咖啡', '拿鐵', '豆漿', '調味乳', '冰紅']
+COMBO_KEYWORDS = ['套餐']
+
+NAMED_K = 6
+CATEGORY_MAX_K = 30
+BROAD_K = 20
+DEFAULT_K = 12
+BASELINE_K = 50
+
+
+@dataclass
+class RetrievalPlan:
+    intent: str
+    k: int
+    filter: Optional[Dict] = None
+    names: List[str] = field(default_factory=list)
+    classes: List[str] = field(default_factory=list)
+
+    @property
+    def skip(self) -> bool:
+        return self.k == 0
+
+
+def classify_intent(query: str, exclude=()) -> str:
+    text = normalize_text(query)
+    for intent, keywords in INTENT_KEYWORDS:
+        if intent in exclude:
+            continue
+        if any(keyword in text for keyword in keywords):
+            return intent
+    return 'order'
+
+
+def _mentioned_names(text: str, catalog: MenuCatalog) -> List[str]:
+    """找出查詢中提到的品項名稱（較長的優先，避免「火腿」蓋掉「大火腿片」）"""
+    names = {}
+    for table in ('main_menu', 'drink_item'):
+        for row in catalog.tables[table]:
+            clean = clean_name(row['name'])
+            if len(clean) >= 2 and clean in text:
+                names[clean] = row['name']
+    found = sorted(names, key=len, reverse=True)
+    kept = [name for i, name in enumerate(found) if not any(name in longer for longer in found[:i])]
+    return [names[name] for name in kept]
+
+
+def _mentioned_classes(text: str, catalog: MenuCatalog) -> List[str]:
+    classes = []
+    for row in catalog.tables['main_menu']:
+        cls = row['class']
+        if cls in classes:
+            continue
+        if cls in text or any(short in text for short in CLASS_SHORT_NAMES.get(cls, []) if len(short) >= 2):
+            classes.append(cls)
+    return classes
+
+
+def _or(filters: List[Dict]) -> Optional[Dict]:
+    if not filters:
+        return None
+    return filters[0] if len(filters) == 1 else {"$or": filters}
+
+
+def plan_retrieval(query: str, catalog: MenuCatalog) -> RetrievalPlan:
+    """依意圖、提到的品項與類別決定檢索筆數與過濾條件"""
+    text = normalize_text(query)
+    names = _mentioned_names(text, catalog)
+    classes = _mentioned_classes(text, catalog)
+    mentions_menu = bool(names or classes) or any(keyword in text for keyword in DRINK_KEYWORDS + COMBO_KEYWORDS)
+    intent = classify_intent(query)
+    if intent in SKIP_RETRIEVAL_INTENTS:
+        if not mentions_menu:
+            return RetrievalPlan(intent=intent, k=0)
+        # 「再來一杯奶茶，沒了」「鮪魚蛋餅總共多少」：有點到品項時，「沒了」「總共」這類字不能蓋過品項
+        intent = classify_intent(query, exclude=SKIP_RETRIEVAL_INTENTS)
+    filters = []
+    size = 0
+    if any(keyword in text for keyword in DRINK_KEYWORDS):
+        filters.append({"table": "drink_item"})
+        size += len(catalog.tables['drink_item'])
+    if any(keyword in text for keyword in COMBO_KEYWORDS):
+        filters.append({"table": "combo_menu"})
+        size += len(catalog.tables['combo_menu'])
+    for cls in classes:
+        filters.append({"class": cls})
+        size += sum(1 for row in catalog.tables['main_menu'] if row['class'] == cls)
+
+    if names and intent != 'query':
+        # 點到具體品項：同名品項全部帶上，再補少量近似項
+        return RetrievalPlan(intent=intent, k=NAMED_K, filter=_or(filters), names=names, classes=classes)
+    if filters:
+        return RetrievalPlan(intent=intent, k=min(max(size, NAMED_K), CATEGORY_MAX_K), filter=_or(filters),
+                             names=names, classes=classes)
+    return RetrievalPlan(intent=intent, k=BROAD_K if intent == 'query' else DEFAULT_K, names=names, classes=classes)
+
+
+def rerank(docs, query: str, plan: RetrievalPlan):
+    """以原始相似度排名為底，加上品項名稱／類別命中與推薦品項的分數"""
+    text = normalize_text(query)
+    wants_recommend = '推薦' in text or '好吃' in text
+
+    def score(pair):
+        rank, doc = pair
+        meta = doc.metadata or {}
+        value = 1.0 / (1 + rank)
+        if meta.get('name') in plan.names or clean_name(str(meta.get('name', ''))) in text:
+            value += 1.0
+        if meta.get('class') in plan.classes:
+            value += 0.5
+        if wants_recommend and '推薦: 1' in doc.page_content:
+            value += 0.3
+        return value
+
+    return [doc for _, doc in sorted(enumerate(docs), key=score, reverse=True)]
+
+
+def _dedupe(docs):
+    seen, unique = set(), []
+    for doc in docs:
+        key = (doc.metadata or {}).get('table'), (doc.metadata or {}).get('name'), (doc.metadata or {}).get('class')
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(doc)
+    return unique
+
+
+def _search(vectorstore, embedding, k: int, filter: Optional[Dict]):
+    if filter is not None:
+        try:
+            return vectorstore.similarity_search_by_vector(embedding, k=k, filter=filter)
+        except Exception as e:
+            logger.warning(f"filtered retrieval failed, falling back: {e}")
+    return vectorstore.similarity_search_by_vector(embedding, k=k)
+
+
+def menu_version(vectorstore, catalog: MenuCatalog) -> str:
+    """SQLite 菜單或向量 collection 任一變動，版本就不同（Chroma 沒有版本，只看 SQLite）"""
+    return f"{catalog.version[0]}-{catalog.version[1]}-{getattr(vectorstore, 'version', '')}"
+
+
+def retrieve(vectorstore, query: str, catalog: MenuCatalog):
+    """依檢索計畫查詢，查詢文字只做一次 embedding；回傳 (docs, plan)"""
+    plan = plan_retrieval(query, catalog)
+    if plan.skip:
+        return [], plan
+    # 檢索計畫與排序都只看正規化後的文字，同樣的說法直接用快取結果
+    version = menu_version(vectorstore, catalog)
+    retrieval_cache.use_namespace(version)
+    key = f"{version}:{cache_key(query)}"
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached), plan
+    embedding = embed_query(vectorstore.embeddings, query)
+    docs = []
+    if plan.names:
+        named = sum(1 for table in ('main_menu', 'drink_item') for row in catalog.tables[table] if row['name'] in plan.names)
+        docs += _search(vectorstore, embedding, named, _or([{"name": name} for name in plan.names]))
+    docs += _search(vectorstore, embedding, plan.k, plan.filter)
+    docs = rerank(_dedupe(docs), query, plan)
+    retrieval_cache.set(key, docs)
+    return list(docs), plan
+
+
+async def aretrieve(vectorstore, query: str, catalog: MenuCatalog):
+    # embedding 與向量查詢都是同步呼叫，整段丟到 executor
+    return await asyncio.get_running_loop().run_in_executor(None, retrieve, vectorstore, query, catalog)
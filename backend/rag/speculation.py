@@ -0,0 +1,231 @@
+# File: speculation.py
+# 依 ASR 的中間結果（interim transcript）先做檢索、也可以先開始 LLM 生成，
+# 等最終結果出來時和投機的句子比對：夠接近就直接沿用，否則捨棄（取消仍在進行的 LLM 請求）。
+# 顧客還在說話、ASR 還在判斷斷句的時間，就拿來做檢索與 LLM 的工作。
+#   - 檢索：最終句子與投機句子相似度 >= SPECULATION_RETRIEVAL_MATCH，且最終句子的檢索計畫
+#     （意圖、品項、類別、過濾條件）與投機時相同才沿用檢索結果；句子後面多說了一個品項時計畫會不同
+#   - LLM（SPECULATIVE_LLM=1 才啟用，會多花 LLM 呼叫）：去掉標點後完全相同、
+#     且訂單版本與對話紀錄都沒變才沿用，數量差一個字意思就不同，不能只看相似度；生成失敗的輸出不沿用
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .fast_path import fast_path_response, normalize_text
+from .rag_morning_eat import astream_rag_query
+from .retrieval import COMBO_KEYWORDS, DRINK_KEYWORDS, RetrievalPlan, aretrieve, plan_retrieval
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculationFailed(Exception):
+    """投機的 LLM 生成中途失敗或被取消，已產生的輸出不完整"""
+
+
+SPECULATION = os.getenv('SPECULATION', '1') == '1'
+SPECULATIVE_LLM = os.getenv('SPECULATIVE_LLM', '0') == '1'
+# 中間結果穩定多久（毫秒）沒有再變才開始 LLM；檢索不等待
+SPECULATION_DEBOUNCE_MS = int(os.getenv('SPECULATION_DEBOUNCE_MS', 300))
+SPECULATION_RETRIEVAL_MATCH = float(os.getenv('SPECULATION_RETRIEVAL_MATCH', 0.85))
+# Google 的 stability 低於這個值的中間結果還會大幅變動，不值得投機
+SPECULATION_MIN_STABILITY = float(os.getenv('SPECULATION_MIN_STABILITY', 0.0))
+SPECULATION_MIN_CHARS = 2
+
+# 回傳 (context_key, 給 prompt 的訂單狀態, 最近對話)；context_key 不同表示 LLM 投機時看到的狀態已過期
+ContextLoader = Callable[[], Awaitable[Tuple[Any, Dict, List[Dict]]]]
+
+_stats = {"started": 0, "superseded": 0, "hits": 0, "retrieval_hits": 0, "llm_hits": 0, "misses": 0, "plan_mismatches": 0,
+          "llm_started": 0, "llm_wasted": 0, "lead_ms_total": 0.0}
+
+
+def similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio() if a and b else 0.0
+
+
+def menu_keywords(canonical: str) -> List[str]:
+    return [keyword for keyword in DRINK_KEYWORDS + COMBO_KEYWORDS if keyword in canonical]
+
+
+def same_plan(a: RetrievalPlan, b: RetrievalPlan) -> bool:
+    """兩句話的檢索計畫相同時，檢索結果才能共用"""
+    return (a.intent == b.intent and sorted(a.names) == sorted(b.names)
+            and sorted(a.classes) == sorted(b.classes) and a.filter == b.filter)
+
+
+@dataclass
+class Speculation:
+    text: str
+    canonical: str
+    started_at: float = field(default_factory=time.perf_counter)
+    docs: "asyncio.Future" = None
+    plan: Optional[RetrievalPlan] = None
+    context_key: Any = None
+    llm_started: bool = False
+    chunks: List[str] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+    failed: bool = False
+    _updated: asyncio.Event = field(default_factory=asyncio.Event)
+    _done: bool = False
+
+    def _push(self, chunk: Optional[str]):
+        if chunk is None:
+            self._done = True
+        else:
+            self.chunks.append(chunk)
+        self._updated.set()
+
+    async def replay(self) -> AsyncIterator[str]:
+        """先給已經生成的部分，再接著等還在生成的部分"""
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self._done:
+                if self.failed:
+                    raise SpeculationFailed(self.text)
+                return
+            self._updated.clear()
+            await self._updated.wait()
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        if self.docs is not None and not self.docs.done():
+            self.docs.cancel()
+
+
+@dataclass
+class SpeculationHit:
+    docs: Optional[list]
+    chunks: Optional[AsyncIterator[str]]
+
+
+class Speculator:
+    """每個 /asr 連線一個；on_interim() 由 ASR 中間結果呼叫，take() 在最終結果時取用"""
+
+    def __init__(self, load_context: ContextLoader, vectorstore, catalog, cus_choice: Dict,
+                 llm: bool = SPECULATIVE_LLM, debounce_ms: int = SPECULATION_DEBOUNCE_MS):
+        self._load_context = load_context
+        self._vectorstore = vectorstore
+        self._catalog = catalog
+        self._cus_choice = cus_choice
+        self._llm = llm
+        self._debounce = debounce_ms / 1000
+        self.current: Optional[Speculation] = None
+
+    def on_interim(self, text: str, stability: Optional[float] = None):
+        canonical = normalize_text(text)
+        if len(canonical) < SPECULATION_MIN_CHARS:
+            return
+        if stability is not None and stability < SPECULATION_MIN_STABILITY:
+            return
+        if self.current is not None:
+            if self.current.canonical == canonical:
+                return
+            self.current.cancel()
+            _stats["superseded"] += 1
+            if self.current.llm_started:
+                _stats["llm_wasted"] += 1
+        spec = Speculation(text=text, canonical=canonical)
+        loop = asyncio.get_running_loop()
+        spec.docs = loop.create_future()
+        spec.task = loop.create_task(self._run(spec))
+        self.current = spec
+        _stats["started"] += 1
+
+    async def _run(self, spec: Speculation):
+        menu = self._catalog.current()
+        try:
+            # 規則就能解析的句子不需要檢索與 LLM
+            if fast_path_response(spec.text, self._cus_choice, menu) is not None:
+                spec.docs.set_result(None)
+                return
+            docs, spec.plan = await aretrieve(self._vectorstore, spec.text, menu)
+            spec.docs.set_result(docs)
+            if not self._llm:
+                return
+            await asyncio.sleep(self._debounce)
+            context_key, order_state, history = await self._load_context()
+            spec.context_key = (context_key, menu.version)
+            spec.llm_started = True
+            _stats["llm_started"] += 1
+            async for chunk in astream_rag_query(spec.text, history, self._vectorstore, order_state,
+                                                 self._cus_choice, menu, docs=docs, raise_errors=True):
+                spec._push(chunk)
+        except asyncio.CancelledError:
+            spec.failed = True
+            raise
+        except Exception as e:
+            logger.warning(f"speculation failed: {e}")
+            spec.failed = True
+            if not spec.docs.done():
+                spec.docs.set_result(None)
+        finally:
+            spec._push(None)
+
+    async def take(self, text: str, context_key: Any) -> Optional[SpeculationHit]:
+        """
+        最終結果出來時呼叫，回傳可沿用的部分（沒有就回傳 None）。
+        context_key 為目前的訂單版本與對話狀態，和 LLM 投機時不同就不沿用 LLM 結果。
+        """
+        spec, self.current = self.current, None
+        if spec is None:
+            return None
+        canonical = normalize_text(text)
+        if similarity(canonical, spec.canonical) < SPECULATION_RETRIEVAL_MATCH:
+            spec.cancel()
+            _stats["misses"] += 1
+            if spec.llm_started:
+                _stats["llm_wasted"] += 1
+            return None
+        # 檢索多半已經完成；還在跑的話等它也比重新檢索快。
+        # 只看 future 本身是否被取消，呼叫端自己的 task 被取消時照常往外傳
+        await asyncio.wait([spec.docs])
+        docs = None if spec.docs.cancelled() else spec.docs.result()
+        chunks = None
+        menu = self._catalog.current()
+        if docs is not None and (spec.plan is None or not same_plan(plan_retrieval(text, menu), spec.plan)
+                                 or menu_keywords(canonical) != menu_keywords(spec.canonical)):
+            # 例如「…跟一杯」→「…跟一杯大冰紅」、「…一杯奶茶」→「…一杯紅茶」：相似度夠高，
+            # 但最後說的品項不在投機的檢索結果（或排序）裡，重新檢索
+            _stats["plan_mismatches"] += 1
+            docs = None
+        # 已經失敗的生成不沿用；還在生成中途失敗時 replay() 會丟出 SpeculationFailed，不會當成完整回應
+        if (spec.llm_started and not spec.failed and canonical == spec.canonical
+                and spec.context_key == (context_key, menu.version)):
+            chunks = spec.replay()
+            _stats["llm_hits"] += 1
+        else:
+            if spec.llm_started:
+                _stats["llm_wasted"] += 1
+            spec.cancel()
+        if docs is not None:
+            _stats["retrieval_hits"] += 1
+        if docs is None and chunks is None:
+            return None
+        lead_ms = (time.perf_counter() - spec.started_at) * 1000
+        _stats["hits"] += 1
+        _stats["lead_ms_total"] += lead_ms
+        logger.info(f"speculation hit: retrieval={docs is not None} llm={chunks is not None} lead={lead_ms:.0f}ms")
+        return SpeculationHit(docs=docs, chunks=chunks)
+
+    def close(self):
+        if self.current is not None:
+            self.current.cancel()
+            if self.current.llm_started:
+                _stats["llm_wasted"] += 1
+            self.current = None
+
+
+def speculation_stats() -> Dict:
+    hits = _stats["hits"]
+    return {
+        **{k: v for k, v in _stats.items() if k != "lead_ms_total"},
+        "enabled": SPECULATION,
+        "llm_enabled": SPECULATIVE_LLM,
+        "avg_lead_ms": round(_stats["lead_ms_total"] / hits, 1) if hits else None,
+    }
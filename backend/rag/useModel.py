@@ -1,25 +1,252 @@
+import hashlib
+import logging
 import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
 from dotenv import load_dotenv
 from langchain_ollama import OllamaLLM
 load_dotenv()
 
-def useModel(model):
-    if model == "gemini_api":
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY is not set in the environment variables.")
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0,
-            max_tokens=None,
-            timeout=10,
-            max_retries=2,
+logger = logging.getLogger(__name__)
+
+# 預設使用的 LLM 後端，可用環境變數切換（gemini_api / gemma3:4b / stub）
+DEFAULT_MODEL = os.getenv("LLM_BACKEND", "gemini_api")
+
+# 前綴快取建立失敗後，隔多久再重試（秒）
+PREFIX_RETRY_SECONDS = 600
+
+STUB_RESPONSE = "```sys\nintent: query\n```\n```cus\n好喔！還需要什麼嗎？\n```"
+
+
+def _build_gemini():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY is not set in the environment variables.")
+    return ChatGoogleGenerativeAI(
+        model=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
+        temperature=0,
+        max_tokens=None,
+        timeout=int(os.getenv("GEMINI_TIMEOUT", 10)),
+        max_retries=int(os.getenv("GEMINI_MAX_RETRIES", 2)),
+    )
+
+
+def _build_ollama(model_name: str):
+    def build():
+        return OllamaLLM(
+            model=model_name,
+            base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+            temperature=0.7,
+            top_k=30,
+            top_p=0.9,
+            # 讓模型常駐在 Ollama 裡，避免每輪重新載入權重
+            keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
         )
-        return llm
-    if model == "qwen3:4b":
-        from langchain_community.llms import Qwen
-        llm = OllamaLLM(model="gemma3:4b", temperature=0.7, top_k=30, top_p=0.9)
-        return llm
-    
-        
\ No newline at end of file
+    return build
+
+
+def _gemini_prefix_cache(model, prefix: str):
+    """
+    把固定前綴存成 Gemini 的 context cache，之後每輪只送動態部分。
+    快取內容太短（低於模型的最低 token 數）時建立會失敗，呼叫端會退回一般模式。
+    """
+    from google.ai import generativelanguage_v1beta as glm
+    from google.protobuf import duration_pb2
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    ttl = int(os.getenv("GEMINI_CACHE_TTL", 3600))
+    # context cache 需要指定固定版本的模型
+    cache_model = os.getenv("GEMINI_CACHE_MODEL", "gemini-2.0-flash-001")
+    client = glm.CacheServiceClient(client_options={"api_key": os.getenv("GOOGLE_API_KEY")})
+    cached = client.create_cached_content(cached_content=glm.CachedContent(
+        model=f"models/{cache_model}",
+        system_instruction=glm.Content(parts=[glm.Part(text=prefix)]),
+        ttl=duration_pb2.Duration(seconds=ttl),
+    ))
+    llm = ChatGoogleGenerativeAI(
+        model=cache_model,
+        cached_content=cached.name,
+        temperature=0,
+        max_tokens=None,
+        timeout=int(os.getenv("GEMINI_TIMEOUT", 10)),
+        max_retries=int(os.getenv("GEMINI_MAX_RETRIES", 2)),
+    )
+    # 提早一分鐘重建，避免用到剛過期的快取
+    return llm, time.time() + ttl - 60
+
+
+def _ollama_prefix_warm(model, prefix: str):
+    """
+    Ollama（llama.cpp）會重用和上一次請求相同開頭的 KV cache，
+    先用固定前綴跑一次 1 個 token 的生成，讓常駐模型保留這段前綴的 KV。
+    完整 prompt 仍照常送出，所以回傳 None。
+    """
+    import ollama
+    client = ollama.Client(host=model.base_url)
+    client.generate(model=model.model, prompt=prefix, options={"num_predict": 1}, keep_alive=model.keep_alive)
+    # 超過 keep_alive 模型可能已被卸載，之後再用到時重新預熱
+    keep_alive = _keep_alive_seconds(model.keep_alive)
+    return None, (time.time() + keep_alive if keep_alive is not None else None)
+
+
+def _keep_alive_seconds(keep_alive) -> Optional[float]:
+    """Ollama 的 keep_alive（"30m"、"1h"、300、-1）換成秒數；常駐（負數）或不保留（0）時回傳 None，不需要重新預熱"""
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*", str(keep_alive or "5m"))
+    if match is None:
+        return None
+    seconds = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return seconds if seconds > 0 else None
+
+
+def _build_stub():
+    # 本地測試用，不需要網路也不需要 API key
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=[os.getenv("LLM_STUB_RESPONSE", STUB_RESPONSE)])
+
+
+class ModelRegistry:
+    """
+    每個 process 只建立一次各個 LLM 後端並重複使用（保持 HTTP/gRPC 連線），
+    同時記錄每個後端的呼叫延遲。
+    """
+
+    def __init__(self, window: int = 200):
+        self._factories: Dict[str, Callable] = {}
+        self._models: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._window = window
+        self._latency: Dict[str, deque] = {}
+        self._first_token: Dict[str, deque] = {}
+        self._errors: Dict[str, int] = {}
+        self._prefix_hooks: Dict[str, Callable] = {}
+        self._prefixed: Dict[Tuple[str, str], Tuple[object, Optional[float]]] = {}
+        self._prefix_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # 父行程建立的 HTTP/gRPC client 不能跨 fork 共用，子行程第一次用到時重建
+        self._models.clear()
+        self._prefixed.clear()
+        self._lock = threading.Lock()
+        self._prefix_lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable, prefix_hook: Optional[Callable] = None):
+        with self._lock:
+            self._factories[name] = factory
+            self._models.pop(name, None)
+            if prefix_hook is not None:
+                self._prefix_hooks[name] = prefix_hook
+
+    def names(self):
+        return list(self._factories)
+
+    def get(self, name: Optional[str] = None):
+        name = name or DEFAULT_MODEL
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                if name not in self._factories:
+                    raise ValueError(f"Unknown model backend: {name}")
+                model = self._factories[name]()
+                self._models[name] = model
+        return model
+
+    def with_prefix(self, name: Optional[str], prefix: str):
+        """
+        取得可重用固定前綴的模型，回傳 (model, prefix_cached)。
+        prefix_cached 為 True 時前綴已在後端快取，呼叫端只需要送動態部分。
+        """
+        name = name or DEFAULT_MODEL
+        model = self.get(name)
+        hook = self._prefix_hooks.get(name)
+        if hook is None:
+            return model, False
+        key = (name, hashlib.sha1(prefix.encode("utf-8")).hexdigest())
+        entry = self._prefixed.get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            with self._prefix_lock:
+                entry = self._prefixed.get(key)
+                if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+                    try:
+                        entry = hook(model, prefix)
+                        logger.info(f"prefix cache ready for {name}")
+                    except Exception as e:
+                        # 失敗就一般模式送完整 prompt，過一段時間再試
+                        logger.warning(f"prefix cache unavailable for {name}: {e}")
+                        entry = (None, time.time() + PREFIX_RETRY_SECONDS)
+                    self._prefixed[key] = entry
+        cached_model = entry[0]
+        return (cached_model, True) if cached_model is not None else (model, False)
+
+    def record(self, name: str, seconds: float, first_token: Optional[float] = None, error: bool = False):
+        with self._lock:
+            self._latency.setdefault(name, deque(maxlen=self._window)).append(seconds)
+            if first_token is not None:
+                self._first_token.setdefault(name, deque(maxlen=self._window)).append(first_token)
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    @contextmanager
+    def timed(self, name: Optional[str] = None):
+        """量測一次呼叫的總延遲；yield 出的 mark_first_token() 用於串流記錄首字延遲"""
+        name = name or DEFAULT_MODEL
+        start = time.perf_counter()
+        first = {}
+
+        def mark_first_token():
+            first.setdefault("t", time.perf_counter() - start)
+
+        failed = cancelled = False
+        try:
+            yield mark_first_token
+        except Exception:
+            failed = True
+            raise
+        except BaseException:
+            # 被取消（例如捨棄的投機執行）不列入延遲統計
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self.record(name, time.perf_counter() - start, first.get("t"), error=failed)
+
+    def stats(self) -> Dict[str, Dict]:
+        def summary(samples):
+            if not samples:
+                return None
+            ordered = sorted(samples)
+            return {
+                "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+            }
+        with self._lock:
+            return {
+                name: {
+                    "loaded": name in self._models,
+                    "calls": len(self._latency.get(name, ())),
+                    "errors": self._errors.get(name, 0),
+                    "latency": summary(list(self._latency.get(name, ()))),
+                    "first_token": summary(list(self._first_token.get(name, ()))),
+                }
+                for name in self._factories
+            }
+
+
+model_registry = ModelRegistry()
+model_registry.register("gemini_api", _build_gemini, prefix_hook=_gemini_prefix_cache)
+model_registry.register("gemma3:4b", _build_ollama("gemma3:4b"), prefix_hook=_ollama_prefix_warm)
+# 舊名稱，實際上一直是跑 gemma3:4b
+model_registry.register("qwen3:4b", _build_ollama("gemma3:4b"), prefix_hook=_ollama_prefix_warm)
+model_registry.register("stub", _build_stub)
+
+
+def useModel(model: Optional[str] = None):
+    return model_registry.get(model)
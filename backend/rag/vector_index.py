@@ -0,0 +1,177 @@
+# File: vector_index.py
+# 菜單只有幾百筆文件，啟動時把 chroma_db 裡的向量一次讀進 NumPy 矩陣，
+# 查詢時直接在記憶體做 cosine top-k，不再經過 Chroma。
+# 介面和 langchain 的 Chroma 相同（similarity_search / similarity_search_by_vector / filter），可直接替換 setup.py 的 vectorstore。
+import hashlib
+import json
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _match(value, condition) -> bool:
+    """Chroma where 條件中單一欄位的比對"""
+    if not isinstance(condition, dict):
+        return value == condition
+    for op, target in condition.items():
+        if op == "$eq" and value != target:
+            return False
+        if op == "$ne" and value == target:
+            return False
+        if op == "$in" and value not in target:
+            return False
+        if op == "$nin" and value in target:
+            return False
+        if op not in ("$eq", "$ne", "$in", "$nin"):
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return True
+
+
+def _where(metadata: Dict, where: Dict) -> bool:
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_where(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(_where(metadata, sub) for sub in condition):
+                return False
+        elif not _match(metadata.get(key), condition):
+            return False
+    return True
+
+
+class _IndexState(NamedTuple):
+    matrix: np.ndarray
+    scale: Optional[np.ndarray]
+    documents: List[Document]
+    # 文件內容的雜湊，collection 重建後改變，檢索快取以此判斷是否失效
+    version: str
+    # filter -> (文件索引, 對應的子矩陣, 子矩陣縮放)
+    subsets: Dict[str, Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]
+
+
+class MenuVectorIndex:
+    """
+    記憶體內的向量索引，所有文件向量存成一個連續的 float32（或 int8）矩陣。
+    矩陣與文件建好後不再修改，重建時整份 _state 一次替換，查詢不需要上鎖。
+    """
+
+    def __init__(self, embedding_function, texts: Sequence[str], metadatas: Sequence[Dict],
+                 vectors, ids: Optional[Sequence[str]] = None, dtype: str = "float32"):
+        self._embedding_function = embedding_function
+        self._chroma = None
+        self.dtype = dtype
+        self._state = self._build(texts, metadatas, vectors, ids, dtype)
+
+    @staticmethod
+    def _build(texts, metadatas, vectors, ids, dtype) -> _IndexState:
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+        scale = None
+        if dtype == "int8":
+            # 每列各自縮放到 [-127, 127]，記憶體是 float32 的四分之一，分數誤差約 1%
+            row_max = np.abs(matrix).max(axis=1, keepdims=True)
+            row_max[row_max == 0] = 1.0
+            matrix = np.round(matrix / row_max * 127).astype(np.int8)
+            scale = (row_max[:, 0] / 127).astype(np.float32)
+        documents = [
+            Document(page_content=text, metadata=dict(metadata or {}), id=doc_id)
+            for text, metadata, doc_id in zip(texts, metadatas, ids or [None] * len(texts))
+        ]
+        digest = hashlib.sha1()
+        for doc in documents:
+            digest.update(doc.page_content.encode("utf-8"))
+            digest.update(json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return _IndexState(np.ascontiguousarray(matrix), scale, documents, digest.hexdigest()[:12], {})
+
+    @classmethod
+    def from_chroma(cls, chroma, dtype: str = "float32") -> "MenuVectorIndex":
+        """從既有的 Chroma collection 讀出所有文件與向量（不重新做 embedding）"""
+        data = chroma.get(include=["embeddings", "documents", "metadatas"])
+        if data["embeddings"] is None or len(data["embeddings"]) == 0:
+            raise ValueError("Chroma collection is empty, run load_menu_to_chroma.py first")
+        index = cls(chroma.embeddings, data["documents"], data["metadatas"], data["embeddings"],
+                    ids=data["ids"], dtype=dtype)
+        index._chroma = chroma
+        matrix = index._state.matrix
+        logger.info(f"vector index built: {len(index)} docs, dim {matrix.shape[1]}, {dtype}, "
+                    f"{matrix.nbytes / 1024:.0f} KiB")
+        return index
+
+    def rebuild(self):
+        """菜單 collection 重建後呼叫，從原本的 Chroma 重新讀取並整份替換"""
+        self._state = MenuVectorIndex.from_chroma(self._chroma, dtype=self.dtype)._state
+
+    @property
+    def version(self) -> str:
+        return self._state.version
+
+    def __len__(self):
+        return len(self._state.documents)
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    @staticmethod
+    def _subset(state: _IndexState, filter: Optional[Dict]):
+        """filter 對應的文件索引與子矩陣；同樣的 filter 只計算一次，之後查詢不必再複製矩陣"""
+        if not filter:
+            return None, state.matrix, state.scale
+        key = json.dumps(filter, sort_keys=True, ensure_ascii=False)
+        subset = state.subsets.get(key)
+        if subset is None:
+            rows = np.flatnonzero([_where(doc.metadata, filter) for doc in state.documents])
+            scale = state.scale[rows] if state.scale is not None else None
+            subset = (rows, np.ascontiguousarray(state.matrix[rows]), scale)
+            state.subsets[key] = subset
+        return subset
+
+    def _top_k(self, state: _IndexState, embedding, k: int, filter: Optional[Dict]) -> List[Tuple[int, float]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        rows, matrix, scale = self._subset(state, filter)
+        scores = matrix @ query
+        if scale is not None:
+            scores = scores * scale
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        positions = rows[top] if rows is not None else top
+        return [(int(i), float(scores[j])) for i, j in zip(positions, top)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, filter: Optional[Dict] = None, **kwargs):
+        """回傳 (Document, cosine 距離)，距離越小越相近"""
+        state = self._state
+        return [(state.documents[i], 1.0 - score) for i, score in self._top_k(state, embedding, k, filter)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: Optional[Dict] = None, **kwargs):
+        state = self._state
+        return [state.documents[i] for i, _ in self._top_k(state, embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding_function.embed_query(query), k, filter)
+
+    async def asimilarity_search_by_vector(self, embedding, k: int = 4, filter: Optional[Dict] = None, **kwargs):
+        return self.similarity_search_by_vector(embedding, k, filter)
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs):
+        # 只有 embedding 需要等待 Ollama，查詢本身在記憶體內完成
+        embedding = await self._embedding_function.aembed_query(query)
+        return self.similarity_search_by_vector(embedding, k, filter)
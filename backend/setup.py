@@ -1,12 +1,17 @@
 from langchain_chroma import Chroma
 from langchain_ollama import OllamaEmbeddings
-from rag.CRUD_database import create_connection
+from rag.menu_catalog import MenuCatalogStore
+from rag.vector_index import MenuVectorIndex
+from rag.phonetic import get_phonetic_index
 # from rag.rag_morning_eat import create_prompt_template
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
+import asyncio
 import logging
+import threading
 import redis
 import os
+from typing import Any, Callable, Dict
 load_dotenv()
 
 def init_embedding():
@@ -26,6 +31,9 @@ def load_menu_to_vectorstore(persist_directory: str = "./chroma_db", name: str =
             persist_directory=persist_directory
         )
         print("向量資料庫載入成功")
+        # 預設把向量讀進記憶體查詢，VECTOR_INDEX=chroma 時沿用 Chroma
+        if os.getenv('VECTOR_INDEX', 'numpy') == 'numpy':
+            return MenuVectorIndex.from_chroma(vectorstore, dtype=os.getenv('VECTOR_INDEX_DTYPE', 'float32'))
         return vectorstore
     except Exception as e:
         print(f"Chroma 資料庫載入失敗：{e}")
@@ -60,29 +68,93 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 cus_choice = {"加蛋": 10, "起司": 10, "泡菜": 10, '燒肉': 20, '起司牛奶': 5, '山型丹麥': 10}
-try:
-    embedding_model = init_embedding()
-    logger.info("embedding model initialized")
-except Exception as e:
-    logger.error(f"Failed to initialize embedding model: {e}")
-    raise e
-try:
-    vectorstore = load_menu_to_vectorstore(persist_directory=os.getenv('CHROMADB_PATH'), name="morning_menu", embedding_model=embedding_model)
-    conn = create_connection(db_file=os.getenv('DB_PATH', "./db/database.db"))
-    logger.info("vectorstore and database connection initialized")
-except Exception as e:
-    logger.error(f"Failed to initialize vectorstore or database connection: {e}")
-    raise e
-# rag_template, _ = create_prompt_template()
-try:
-    redis_client = redis.Redis(
-        host=os.getenv('REDIS_HOST', 'localhost'),
-        port=int(os.getenv('REDIS_PORT', 6379)),
-        db=int(os.getenv('REDIS_DB', 0)),
-        password=os.getenv('REDIS_PASSWORD', None)
-    )
-    redis_client.ping()  # 確認 Redis 連線是否成功
-    logger.info("redis client initialized")
-except redis.ConnectionError as e:
-    logger.error(f"Redis connection failed: {e}")
-    raise e
\ No newline at end of file
+
+# 嵌入模型、向量庫、菜單與 Redis client 都在每個 worker 第一次用到時才建立（不在 import 時），
+# 多 worker（uvicorn --workers / gunicorn）時每個行程各自持有一份；fork 後子行程會丟掉父行程建立的物件重建，
+# 不會共用 socket 或 SQLite handle。session 狀態全部在 Redis，任何 worker 都能接手任何 session。
+_resources: Dict[str, Any] = {}
+# 每項資源各自一把鎖：建立菜單不用等向量庫；向量庫的 factory 取得嵌入模型時也不會等到自己持有的鎖
+_resource_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _reset_after_fork():
+    global _locks_guard
+    _resources.clear()
+    _resource_locks.clear()
+    _locks_guard = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _resource(name: str, factory: Callable[[], Any]):
+    value = _resources.get(name)
+    if value is None:
+        with _locks_guard:
+            lock = _resource_locks.setdefault(name, threading.Lock())
+        with lock:
+            value = _resources.get(name)
+            if value is None:
+                value = factory()
+                _resources[name] = value
+    return value
+
+
+async def _aresource(name: str, getter: Callable[[], Any]):
+    """async handler 用：已建立就直接回傳；否則在 executor 執行緒建立（或等 warm-up 建好），不卡住 event loop"""
+    value = _resources.get(name)
+    if value is None:
+        value = await asyncio.get_running_loop().run_in_executor(None, getter)
+    return value
+
+
+def _create_menu_catalog() -> MenuCatalogStore:
+    menu_catalog = MenuCatalogStore(db_file=os.getenv('DB_PATH', "./db/database.db"))
+    # 讀音索引跟著菜單一起建好，第一句語音不用等
+    get_phonetic_index(menu_catalog.current())
+    logger.info(f"menu catalog initialized (pid {os.getpid()})")
+    return menu_catalog
+
+
+# 同步 client 只給在 executor 執行緒裡跑的查詢快取用；async handler 一律用 store/redis_pool.py 的連線池
+def _create_sync_redis() -> redis.Redis:
+    try:
+        client = redis.Redis(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            db=int(os.getenv('REDIS_DB', 0)),
+            password=os.getenv('REDIS_PASSWORD', None)
+        )
+        client.ping()  # 確認 Redis 連線是否成功
+    except redis.ConnectionError as e:
+        logger.error(f"Redis connection failed: {e}")
+        raise e
+    logger.info(f"redis client initialized (pid {os.getpid()})")
+    return client
+
+
+def get_embedding_model() -> OllamaEmbeddings:
+    return _resource('embedding_model', init_embedding)
+
+
+def get_vectorstore():
+    return _resource('vectorstore', lambda: load_menu_to_vectorstore(
+        persist_directory=os.getenv('CHROMADB_PATH'), name="morning_menu", embedding_model=get_embedding_model()))
+
+
+def get_menu_catalog() -> MenuCatalogStore:
+    return _resource('menu_catalog', _create_menu_catalog)
+
+
+async def aget_vectorstore():
+    return await _aresource('vectorstore', get_vectorstore)
+
+
+async def aget_menu_catalog() -> MenuCatalogStore:
+    return await _aresource('menu_catalog', get_menu_catalog)
+
+
+def get_redis_client() -> redis.Redis:
+    return _resource('redis_client', _create_sync_redis)
+
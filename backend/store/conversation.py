@@ -0,0 +1,103 @@
+# File: conversation.py
+# 對話紀錄存成 Redis list（{token}_conversation），每輪只 RPUSH 新的對話，
+# 讀取時用 LRANGE 只拿需要的範圍，不再整包讀出、解析、再寫回。
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+GREETING = "您好！歡迎使用語音點餐系統，請參考上方菜單並告訴我您想要什麼餐點？"
+# 組 prompt 時最多讀最近幾筆（prompt_budget 會再決定逐字保留多少、其餘收成摘要）
+PROMPT_HISTORY_READ = int(os.getenv("PROMPT_HISTORY_READ", 40))
+HISTORY_PAGE_MAX = 200
+
+
+def conversation_key(token_id: str) -> str:
+    return f'{token_id}_conversation'
+
+
+def greeting_turn() -> Dict:
+    return {"type": "llm", "response": GREETING, "time": datetime.now().isoformat()}
+
+
+def is_wrong_type(error: Exception) -> bool:
+    return isinstance(error, ResponseError) and 'WRONGTYPE' in str(error)
+
+
+async def migrate_legacy(redis, token_id: str):
+    """舊版把整個對話存成一個 JSON 字串，遇到時轉成 list 並保留原本的 TTL"""
+    key = conversation_key(token_id)
+    if await redis.type(key) not in (b'string', 'string'):
+        return
+    turns = json.loads(await redis.get(key) or '[]')
+    ttl = await redis.ttl(key)
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    if turns:
+        pipe.rpush(key, *(json.dumps(turn, ensure_ascii=False) for turn in turns))
+        if ttl and ttl > 0:
+            pipe.expire(key, ttl)
+    await pipe.execute()
+    logger.info(f"migrated legacy conversation {key} ({len(turns)} turns)")
+
+
+def init_conversation(pipe, token_id: str, ttl: int):
+    """在 pipeline 裡排入建立只含歡迎詞的對話，由呼叫端與其他指令一起送出"""
+    key = conversation_key(token_id)
+    pipe.delete(key)
+    pipe.rpush(key, json.dumps(greeting_turn(), ensure_ascii=False))
+    pipe.expire(key, ttl)
+
+
+async def append_turns(redis, token_id: str, *turns: Dict) -> int:
+    """把一或多筆對話原子地加到最後（RPUSH 不會重設 TTL），回傳目前總筆數"""
+    if not turns:
+        return 0
+    return await redis.rpush(conversation_key(token_id), *(json.dumps(turn, ensure_ascii=False) for turn in turns))
+
+
+def decode_turns(raw_turns) -> List[Dict]:
+    return [json.loads(raw) for raw in raw_turns]
+
+
+def queue_recent_turns(pipe, token_id: str, limit: int = PROMPT_HISTORY_READ):
+    """在 pipeline 裡排入讀取最近 limit 筆對話，結果用 decode_turns 解析"""
+    pipe.lrange(conversation_key(token_id), -max(limit, 1), -1)
+
+
+async def recent_turns(redis, token_id: str, limit: int = PROMPT_HISTORY_READ) -> List[Dict]:
+    """最近 limit 筆對話，給組 prompt 用"""
+    if limit <= 0:
+        return []
+    try:
+        return decode_turns(await redis.lrange(conversation_key(token_id), -limit, -1))
+    except ResponseError as e:
+        if not is_wrong_type(e):
+            raise
+    await migrate_legacy(redis, token_id)
+    return decode_turns(await redis.lrange(conversation_key(token_id), -limit, -1))
+
+
+async def read_turns(redis, token_id: str, start: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """
+    讀取 start 起的 limit 筆對話，回傳 (對話, 總筆數)。
+    對話只會往後加，start 可以當作增量同步的游標（上次回傳的總筆數）。
+    """
+    key = conversation_key(token_id)
+    end = -1 if limit is None else start + limit - 1
+    for attempt in range(2):
+        pipe = redis.pipeline(transaction=False)
+        pipe.lrange(key, start, end)
+        pipe.llen(key)
+        try:
+            raw_turns, total = await pipe.execute()
+            return decode_turns(raw_turns), total
+        except ResponseError as e:
+            if attempt or not is_wrong_type(e):
+                raise
+            await migrate_legacy(redis, token_id)
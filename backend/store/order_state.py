@@ -0,0 +1,237 @@
+# File: order_state.py
+# 訂單狀態存成 Redis hash（{token}_order_state），每個品項一個欄位，另有版本號：
+#   _version  版本號，每次寫入 +1
+#   _meta     品項以外的欄位（order_id、status、total_price、payment…）的 JSON
+#   _items    品項 id 的順序
+#   item:<id> 單一品項的 JSON
+# 寫入時用 Lua 腳本比對版本（樂觀鎖），只寫有變動的品項；版本不符代表期間有人改過，
+# 由呼叫端以最新狀態重新合併後再寫。
+import copy
+import json
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+VERSION_FIELD = '_version'
+META_FIELD = '_meta'
+ITEMS_FIELD = '_items'
+ITEM_PREFIX = 'item:'
+MAX_RETRIES = 5
+
+# ARGV: 預期版本, _meta（空字串表示不變）, _items（空字串表示不變）, 寫入筆數 n, n 組 field/value, 其餘為要刪除的 field
+_COMMIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {-1, 0} end
+local current = tonumber(redis.call('HGET', KEYS[1], '_version') or '0')
+if current ~= tonumber(ARGV[1]) then return {0, current} end
+local next_version = current + 1
+redis.call('HSET', KEYS[1], '_version', next_version)
+if ARGV[2] ~= '' then redis.call('HSET', KEYS[1], '_meta', ARGV[2]) end
+if ARGV[3] ~= '' then redis.call('HSET', KEYS[1], '_items', ARGV[3]) end
+local i = 5
+for _ = 1, tonumber(ARGV[4]) do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    i = i + 2
+end
+for j = i, #ARGV do redis.call('HDEL', KEYS[1], ARGV[j]) end
+return {1, next_version}
+"""
+
+
+_scripts: Dict[int, object] = {}
+
+
+def _commit_script(redis):
+    script = _scripts.get(id(redis))
+    if script is None:
+        script = _scripts[id(redis)] = redis.register_script(_COMMIT_SCRIPT)
+    return script
+
+
+class OrderConflict(Exception):
+    """寫入時版本已被其他請求更新"""
+
+
+class OrderNotFound(Exception):
+    """訂單不存在（token 過期或已付款清除）"""
+
+
+@dataclass
+class VersionedOrder:
+    state: Dict
+    version: int
+
+
+def order_key(token_id: str) -> str:
+    return f'{token_id}_order_state'
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _split(state: Dict) -> Tuple[Dict, List[str], Dict[str, Dict]]:
+    meta = {k: v for k, v in state.items() if k != 'items'}
+    items = state.get('items', [])
+    return meta, [str(item['id']) for item in items], {str(item['id']): item for item in items}
+
+
+def _hash_fields(state: Dict, version: int) -> Dict[str, str]:
+    meta, order, items = _split(state)
+    fields = {VERSION_FIELD: str(version), META_FIELD: _dumps(meta), ITEMS_FIELD: _dumps(order)}
+    fields.update({ITEM_PREFIX + item_id: _dumps(item) for item_id, item in items.items()})
+    return fields
+
+
+def init_order(pipe, token_id: str, state: Dict, ttl: int):
+    """在 pipeline 裡排入建立新訂單（版本 1），由呼叫端與其他指令一起送出"""
+    key = order_key(token_id)
+    pipe.delete(key)
+    pipe.hset(key, mapping=_hash_fields(state, 1))
+    pipe.expire(key, ttl)
+
+
+async def migrate_legacy(redis, token_id: str):
+    """舊版把整個訂單存成 JSON 字串，遇到時轉成 hash 並保留 TTL"""
+    key = order_key(token_id)
+    if await redis.type(key) not in (b'string', 'string'):
+        return
+    state = json.loads(await redis.get(key))
+    ttl = await redis.ttl(key)
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping=_hash_fields(state, 1))
+    if ttl and ttl > 0:
+        pipe.expire(key, ttl)
+    await pipe.execute()
+    logger.info(f"migrated legacy order state {key}")
+
+
+def decode_order(raw: Dict) -> Optional[VersionedOrder]:
+    """HGETALL 的結果轉回訂單，key 不存在時回傳 None"""
+    if not raw:
+        return None
+    fields = {(k.decode() if isinstance(k, bytes) else k): v for k, v in raw.items()}
+    state = json.loads(fields[META_FIELD])
+    state['items'] = [json.loads(fields[ITEM_PREFIX + item_id])
+                      for item_id in json.loads(fields[ITEMS_FIELD]) if ITEM_PREFIX + item_id in fields]
+    return VersionedOrder(state=state, version=int(fields[VERSION_FIELD]))
+
+
+def queue_load_order(pipe, token_id: str):
+    """在 pipeline 裡排入讀取訂單，結果用 decode_order 解析"""
+    pipe.hgetall(order_key(token_id))
+
+
+async def load_order(redis, token_id: str) -> Optional[VersionedOrder]:
+    key = order_key(token_id)
+    try:
+        raw = await redis.hgetall(key)
+    except ResponseError as e:
+        if 'WRONGTYPE' not in str(e):
+            raise
+        await migrate_legacy(redis, token_id)
+        raw = await redis.hgetall(key)
+    return decode_order(raw)
+
+
+def _diff_args(base: Dict, new: Dict) -> List[str]:
+    """base → new 的差異轉成 Lua 腳本參數，只包含有變動的品項"""
+    base_meta, base_order, base_items = _split(base)
+    new_meta, new_order, new_items = _split(new)
+    upserts = [(item_id, item) for item_id, item in new_items.items() if base_items.get(item_id) != item]
+    deletes = [ITEM_PREFIX + item_id for item_id in base_items if item_id not in new_items]
+    args = [
+        _dumps(new_meta) if new_meta != base_meta else '',
+        _dumps(new_order) if new_order != base_order else '',
+        str(len(upserts)),
+    ]
+    for item_id, item in upserts:
+        args += [ITEM_PREFIX + item_id, _dumps(item)]
+    return args + deletes
+
+
+async def save_order(redis, token_id: str, base: VersionedOrder, new_state: Dict) -> VersionedOrder:
+    """base 版本仍是最新時寫入 new_state 與 base 的差異，否則丟出 OrderConflict"""
+    status, version = await _commit_script(redis)(
+        keys=[order_key(token_id)], args=[base.version] + _diff_args(base.state, new_state))
+    if status == -1:
+        raise OrderNotFound(token_id)
+    if status == 0:
+        raise OrderConflict(f"{token_id}: expected version {base.version}, found {version}")
+    return VersionedOrder(state=new_state, version=int(version))
+
+
+def rebase(base: Dict, ours: Dict, latest: Dict) -> Dict:
+    """
+    三方合併：把 base → ours 的變動套到 latest 上。
+    同一品項兩邊都改過時以數量差合併；對方已刪除的品項不再加回；總價依品項重新計算。
+    """
+    merged = copy.deepcopy(latest)
+    _, _, base_items = _split(base)
+    _, _, our_items = _split(ours)
+    latest_items = {str(item['id']): item for item in merged.get('items', [])}
+    for item_id in list(base_items) + [i for i in our_items if i not in base_items]:
+        before, after = base_items.get(item_id), our_items.get(item_id)
+        if before == after:
+            continue
+        current = latest_items.get(item_id)
+        if after is None:
+            latest_items.pop(item_id, None)
+        elif before is None or current == before:
+            latest_items[item_id] = copy.deepcopy(after)
+        elif current is None:
+            logger.info(f"order line {item_id} was removed concurrently, dropping our change")
+        else:
+            quantity = current['quantity'] + after['quantity'] - before['quantity']
+            if quantity > 0:
+                current['quantity'] = quantity
+            else:
+                latest_items.pop(item_id)
+    order = [str(item['id']) for item in merged.get('items', [])]
+    order += [item_id for item_id in our_items if item_id not in order]
+    merged['items'] = [latest_items[item_id] for item_id in order if item_id in latest_items]
+    for field, value in ours.items():
+        if field not in ('items', 'total_price') and value != base.get(field):
+            merged[field] = copy.deepcopy(value)
+    merged['total_price'] = sum(item['subtotal'] * item['quantity'] for item in merged['items'])
+    return merged
+
+
+async def commit_order(redis, token_id: str, base: VersionedOrder, new_state: Dict) -> Tuple[VersionedOrder, bool]:
+    """
+    寫入本次的變動；期間有其他請求改過訂單時，重新讀取並合併後再寫。
+    回傳 (寫入後的訂單, 是否經過合併)。
+    """
+    try:
+        return await save_order(redis, token_id, base, new_state), False
+    except OrderConflict as e:
+        logger.info(f"order state conflict, rebasing: {e}")
+    for _ in range(MAX_RETRIES):
+        latest = await load_order(redis, token_id)
+        if latest is None:
+            raise OrderNotFound(token_id)
+        merged = rebase(base.state, new_state, latest.state)
+        try:
+            return await save_order(redis, token_id, latest, merged), True
+        except OrderConflict:
+            continue
+    raise OrderConflict(f"{token_id}: gave up after {MAX_RETRIES} retries")
+
+
+async def update_order(redis, token_id: str, mutate: Callable[[Dict], None]) -> VersionedOrder:
+    """讀取最新訂單、以 mutate 原地修改後寫回，版本衝突時重試"""
+    for _ in range(MAX_RETRIES):
+        current = await load_order(redis, token_id)
+        if current is None:
+            raise OrderNotFound(token_id)
+        new_state = copy.deepcopy(current.state)
+        mutate(new_state)
+        try:
+            return await save_order(redis, token_id, current, new_state)
+        except OrderConflict:
+            continue
+    raise OrderConflict(f"{token_id}: gave up after {MAX_RETRIES} retries")
@@ -0,0 +1,103 @@
+# File: redis_pool.py
+# 所有 blueprint 共用的 redis.asyncio 連線池，以 FastAPI dependency（get_redis）注入，
+# 不再在 async handler 裡呼叫同步的 redis client 卡住 event loop。
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+# 連線都在使用中時最多等多久（秒）
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+
+
+class InstrumentedPool(aioredis.BlockingConnectionPool):
+    """連線用完時等待而不是直接報錯，並記錄取得連線的次數、等待時間與最高同時使用數"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.peak_in_use = 0
+
+    def in_use(self) -> int:
+        return len(getattr(self, '_in_use_connections', ()))
+
+    def idle(self) -> int:
+        return len([c for c in getattr(self, '_available_connections', ()) if c is not None])
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        wait = time.perf_counter() - start
+        self.acquired += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.peak_in_use = max(self.peak_in_use, self.in_use())
+        return connection
+
+
+def _create_pool() -> InstrumentedPool:
+    return InstrumentedPool(
+        host=os.getenv('REDIS_HOST', 'localhost'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        db=int(os.getenv('REDIS_DB', 0)),
+        password=os.getenv('REDIS_PASSWORD', None),
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+    )
+
+
+_pool: Optional[InstrumentedPool] = None
+_client: Optional[aioredis.Redis] = None
+
+
+def _reset_after_fork():
+    # 連線池綁定父行程的 socket 與 event loop，子行程重新建立
+    global _pool, _client
+    _pool, _client = None, None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def redis_client() -> aioredis.Redis:
+    """取得共用的 async client（第一次呼叫時建立連線池，連線本身在第一次使用時才建立）"""
+    global _pool, _client
+    if _client is None:
+        _pool = _create_pool()
+        _client = aioredis.Redis(connection_pool=_pool)
+    return _client
+
+
+async def get_redis() -> aioredis.Redis:
+    """FastAPI dependency：`redis: Redis = Depends(get_redis)`"""
+    return redis_client()
+
+
+async def close_redis():
+    global _pool, _client
+    if _client is not None:
+        await _client.aclose()
+        await _pool.disconnect()
+        _pool, _client = None, None
+
+
+def pool_stats() -> Dict:
+    if _pool is None:
+        return {"initialized": False}
+    return {
+        "initialized": True,
+        "max_connections": _pool.max_connections,
+        "in_use": _pool.in_use(),
+        "idle": _pool.idle(),
+        "peak_in_use": _pool.peak_in_use,
+        "acquired": _pool.acquired,
+        "avg_wait_ms": round(_pool.wait_total / _pool.acquired * 1000, 3) if _pool.acquired else None,
+        "max_wait_ms": round(_pool.wait_max * 1000, 3),
+    }
@@ -0,0 +1,54 @@
+# File: session.py
+# 點餐 session 在 Redis 裡的三個 key（token、訂單、對話）常常一起讀寫，這裡用 pipeline 合成一次往返。
+from typing import Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from .conversation import (PROMPT_HISTORY_READ, conversation_key, decode_turns, init_conversation, is_wrong_type,
+                           queue_recent_turns, recent_turns)
+from .order_state import VersionedOrder, decode_order, init_order, load_order, order_key, queue_load_order
+
+
+async def create_session(redis, token_id: str, order_state: Dict, ttl: int):
+    """新 token：token、訂單、對話在同一個 transaction 裡建立"""
+    pipe = redis.pipeline(transaction=True)
+    pipe.setex(token_id, ttl, "valid")
+    init_order(pipe, token_id, order_state, ttl)
+    init_conversation(pipe, token_id, ttl)
+    await pipe.execute()
+
+
+async def ensure_session(redis, token_id: str, order_state: Dict, ttl: int) -> List[str]:
+    """沿用舊 token：補建不存在的訂單或對話，回傳補建了哪些"""
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(order_key(token_id))
+    pipe.exists(conversation_key(token_id))
+    has_order, has_conversation = await pipe.execute()
+    if has_order and has_conversation:
+        return []
+    created = []
+    pipe = redis.pipeline(transaction=True)
+    if not has_order:
+        init_order(pipe, token_id, order_state, ttl)
+        created.append("order_state")
+    if not has_conversation:
+        init_conversation(pipe, token_id, ttl)
+        created.append("conversation")
+    await pipe.execute()
+    return created
+
+
+async def load_turn_context(redis, token_id: str,
+                            history_limit: int = PROMPT_HISTORY_READ) -> Tuple[Optional[VersionedOrder], List[Dict]]:
+    """一次往返讀取這一輪需要的訂單與最近對話"""
+    pipe = redis.pipeline(transaction=False)
+    queue_load_order(pipe, token_id)
+    queue_recent_turns(pipe, token_id, history_limit)
+    try:
+        raw_order, raw_turns = await pipe.execute()
+    except ResponseError as e:
+        if not is_wrong_type(e):
+            raise
+        # 舊格式的 key，各自讀取時會順便轉換
+        return await load_order(redis, token_id), await recent_turns(redis, token_id, history_limit)
+    return decode_order(raw_order), decode_turns(raw_turns)
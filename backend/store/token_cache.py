@@ -0,0 +1,142 @@
+# File: token_cache.py
+# 驗證過的 ordering_token cookie 在本 process 快取一小段時間，省去每個請求的 Fernet 解密、JWT 驗證與 Redis EXISTS。
+# 撤銷 token 時透過 Redis pub/sub 通知所有 worker 清掉快取；訂閱斷線期間不使用快取，確保撤銷一定生效。
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHANNEL = 'ordering_token_revoked'
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 30))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+
+class TokenCache:
+    """cookie → (token_id, 到期時間)；event loop 內使用，不需要上鎖"""
+
+    def __init__(self, ttl: float = TOKEN_CACHE_TTL, maxsize: int = TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.listening = False
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cookies: Dict[str, Set[str]] = {}
+        self._counts = {"hits": 0, "misses": 0, "revoked": 0}
+
+    def get(self, cookie: str) -> Optional[str]:
+        if not self.listening or self.ttl <= 0:
+            return None
+        entry = self._entries.get(cookie)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                self._drop(cookie)
+            self._counts["misses"] += 1
+            return None
+        self._counts["hits"] += 1
+        return entry[0]
+
+    def put(self, cookie: str, token_id: str, expires_in: Optional[float] = None):
+        """快取時間不超過 TTL，也不超過 JWT 本身剩下的有效時間"""
+        if not self.listening or self.ttl <= 0:
+            return
+        ttl = self.ttl if expires_in is None else min(self.ttl, expires_in)
+        if ttl <= 0:
+            return
+        self._drop(cookie)
+        self._entries[cookie] = (token_id, time.monotonic() + ttl)
+        self._cookies.setdefault(token_id, set()).add(cookie)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, cookie: str):
+        entry = self._entries.pop(cookie, None)
+        if entry is not None:
+            cookies = self._cookies.get(entry[0])
+            if cookies is not None:
+                cookies.discard(cookie)
+                if not cookies:
+                    del self._cookies[entry[0]]
+
+    def revoke(self, token_id: str):
+        for cookie in list(self._cookies.get(token_id, ())):
+            self._drop(cookie)
+        self._counts["revoked"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._cookies.clear()
+
+    def stats(self) -> Dict:
+        return {**self._counts, "size": len(self._entries), "ttl": self.ttl, "listening": self.listening}
+
+
+token_cache = TokenCache()
+_listener: Optional[asyncio.Task] = None
+
+
+def _reset_after_fork():
+    # 訂閱任務屬於父行程的 event loop，子行程要自己重新訂閱後才使用快取
+    global _listener
+    _listener = None
+    token_cache.listening = False
+    token_cache.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def _listen(redis):
+    backoff = 1.0
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(REVOCATION_CHANNEL)
+            token_cache.listening = True
+            backoff = 1.0
+            logger.info("token revocation listener subscribed")
+            async for message in pubsub.listen():
+                data = message.get("data")
+                token_cache.revoke(data.decode() if isinstance(data, bytes) else str(data))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"token revocation listener disconnected, retrying in {backoff:.0f}s: {e}")
+        finally:
+            # 收不到撤銷通知的期間不能相信快取
+            token_cache.listening = False
+            token_cache.clear()
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+def start_revocation_listener(redis):
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.get_running_loop().create_task(_listen(redis))
+
+
+async def stop_revocation_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+
+
+async def revoke_token(redis, token_id: str):
+    """刪除 Redis 裡的 token 並通知所有 worker 清除快取"""
+    token_cache.revoke(token_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.delete(token_id)
+    pipe.publish(REVOCATION_CHANNEL, token_id)
+    await pipe.execute()
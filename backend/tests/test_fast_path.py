@@ -0,0 +1,67 @@
+# File: test_fast_path.py
+# rag/fast_path.py：規則解析只接受能完全確定的句子，其餘交給 LLM
+import os
+
+import pytest
+
+from rag.fast_path import fast_path_response, normalize_text, parse_quantity
+from rag.menu_catalog import load_catalog
+from setup import cus_choice
+
+DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'db', 'morning_eat.db')
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return load_catalog(DB_FILE)
+
+
+def sys_lines(response: str):
+    block = response.split('```sys\n', 1)[1].split('\n```', 1)[0]
+    return block.splitlines()
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('我要一份蛋餅', ['+ 1 1 無']),
+    ('兩杯大冰紅', ['+ 1001 2 大杯']),
+    ('２杯紅茶。', ['+ 1001 2 無']),
+    ('玉米蛋餅兩份', ['+ 2 2 無']),
+    ('蛋餅加起司跟一杯大冰紅', ['+ 1 1 起司', '+ 1001 1 大杯']),
+    ('A套餐', ['+ A1 1 無']),
+])
+def test_accepts_unambiguous_orders(catalog, query, expected):
+    response = fast_path_response(query, cus_choice, catalog)
+    assert response is not None
+    assert sys_lines(response) == ['intent: order'] + expected
+    assert '```cus\n' in response and response.endswith('\n```')
+
+
+@pytest.mark.parametrize('query', [
+    '我要一份蛋餅可以嗎',  # 問句，交給 LLM
+    '就這樣',              # 沒有品項
+    '鮪魚玉米',            # 同名品項有蛋餅與吐司
+    '三十份蛋餅',          # 超過 MAX_QUANTITY
+    '蛋餅大杯',            # 飲料客製不能套在蛋餅上
+    '兩份三份蛋餅',        # 兩個數量
+    '我要一份蛋餅跟火星',  # 有無法辨識的字
+    '',
+])
+def test_rejects_uncertain_utterances(catalog, query):
+    assert fast_path_response(query, cus_choice, catalog) is None
+
+
+def test_large_drink_price(catalog):
+    response = fast_path_response('一杯大冰紅', cus_choice, catalog)
+    medium = fast_path_response('一杯冰紅', cus_choice, catalog)
+    assert '30 元' in response and '20 元' in medium
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('3', 3), ('十', 10), ('十二', 12), ('二十五', 25), ('兩', 2), ('一二', None), ('', None), ('百', None),
+])
+def test_parse_quantity(text, expected):
+    assert parse_quantity(text) == expected
+
+
+def test_normalize_text():
+    assert normalize_text('ａ套餐， 謝謝！') == 'A套餐謝謝'
@@ -0,0 +1,124 @@
+# File: test_order_state.py
+# store/order_state.py：Lua 腳本的版本比對（樂觀鎖）、衝突後的三方合併與重試
+import asyncio
+import copy
+
+import fakeredis.aioredis
+import pytest
+
+from store import order_state
+from store.order_state import (OrderConflict, OrderNotFound, commit_order, init_order, load_order, rebase,
+                               save_order, update_order)
+
+TOKEN = 'token'
+
+
+def item(item_id, name, quantity, price=30):
+    return {'id': item_id, 'name': name, 'quantity': quantity, 'subtotal': price}
+
+
+def state(*items, **meta):
+    return {'order_id': 'ORD1', 'status': 'start', **meta, 'items': list(items),
+            'total_price': sum(i['subtotal'] * i['quantity'] for i in items)}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def redis():
+    order_state._scripts.clear()
+    return fakeredis.aioredis.FakeRedis()
+
+
+async def create(redis, initial):
+    pipe = redis.pipeline()
+    init_order(pipe, TOKEN, initial, ttl=600)
+    await pipe.execute()
+    return await load_order(redis, TOKEN)
+
+
+def test_save_bumps_version_and_writes_only_changes(redis):
+    async def main():
+        base = await create(redis, state(item(1, '蛋餅', 1), item(2, '紅茶', 1)))
+        assert base.version == 1
+        new = copy.deepcopy(base.state)
+        new['items'][0]['quantity'] = 2
+        del new['items'][1]
+        saved = await save_order(redis, TOKEN, base, new)
+        loaded = await load_order(redis, TOKEN)
+        assert saved.version == loaded.version == 2
+        assert loaded.state['items'] == [item(1, '蛋餅', 2)]
+        assert not await redis.hexists(order_state.order_key(TOKEN), 'item:2')
+    run(main())
+
+
+def test_save_with_stale_version_conflicts(redis):
+    async def main():
+        base = await create(redis, state(item(1, '蛋餅', 1)))
+        await save_order(redis, TOKEN, base, state(item(1, '蛋餅', 2)))
+        with pytest.raises(OrderConflict):
+            await save_order(redis, TOKEN, base, state(item(1, '蛋餅', 3)))
+        assert (await load_order(redis, TOKEN)).state['items'] == [item(1, '蛋餅', 2)]
+    run(main())
+
+
+def test_save_missing_order(redis):
+    async def main():
+        base = await create(redis, state())
+        await redis.delete(order_state.order_key(TOKEN))
+        with pytest.raises(OrderNotFound):
+            await save_order(redis, TOKEN, base, state(item(1, '蛋餅', 1)))
+    run(main())
+
+
+def test_commit_rebases_on_concurrent_change(redis):
+    async def main():
+        base = await create(redis, state(item(1, '蛋餅', 1)))
+        # LLM 生成期間，另一個請求把蛋餅改成 2 份並付款
+        def concurrent(s):
+            s['items'][0]['quantity'] = 2
+            s['payment'] = {'status': 'paid'}
+        await update_order(redis, TOKEN, concurrent)
+        # 這一輪：蛋餅 +1、加一杯紅茶
+        ours = state(item(1, '蛋餅', 2), item(2, '紅茶', 1, price=25))
+        saved, rebased = await commit_order(redis, TOKEN, base, ours)
+        assert rebased
+        assert saved.version == 3
+        assert saved.state['items'] == [item(1, '蛋餅', 3), item(2, '紅茶', 1, price=25)]
+        assert saved.state['payment'] == {'status': 'paid'}
+        assert saved.state['total_price'] == 30 * 3 + 25
+        assert (await load_order(redis, TOKEN)).state == saved.state
+    run(main())
+
+
+def test_commit_without_conflict_is_not_rebased(redis):
+    async def main():
+        base = await create(redis, state(item(1, '蛋餅', 1)))
+        saved, rebased = await commit_order(redis, TOKEN, base, state(item(1, '蛋餅', 2)))
+        assert not rebased and saved.version == 2
+    run(main())
+
+
+def test_rebase_drops_change_to_concurrently_removed_line():
+    base = state(item(1, '蛋餅', 1), item(2, '紅茶', 1))
+    ours = state(item(1, '蛋餅', 1), item(2, '紅茶', 2))
+    latest = state(item(1, '蛋餅', 1))
+    assert rebase(base, ours, latest)['items'] == [item(1, '蛋餅', 1)]
+
+
+def test_rebase_removes_line_when_quantity_reaches_zero():
+    base = state(item(1, '蛋餅', 2))
+    ours = state(item(1, '蛋餅', 1))
+    latest = state(item(1, '蛋餅', 1))
+    merged = rebase(base, ours, latest)
+    assert merged['items'] == [] and merged['total_price'] == 0
+
+
+def test_rebase_keeps_our_meta_changes():
+    base = state(item(1, '蛋餅', 1))
+    ours = state(item(1, '蛋餅', 1), status='end')
+    latest = state(item(1, '蛋餅', 1), table_number='5')
+    merged = rebase(base, ours, latest)
+    assert merged['status'] == 'end' and merged['table_number'] == '5'
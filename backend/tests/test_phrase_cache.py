@@ -0,0 +1,49 @@
+# File: test_phrase_cache.py
+# tts/phrase_cache.py：預先合成的固定用語要與 LLM、規則解析回應切句後的寫法一致
+import os
+
+import pytest
+
+from rag.fast_path import fast_path_response
+from rag.menu_catalog import load_catalog
+from setup import cus_choice
+from tts.phrase_cache import fixed_phrases, normalize, split_clauses
+
+DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'db', 'morning_eat.db')
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return load_catalog(DB_FILE)
+
+
+@pytest.fixture(scope='module')
+def phrases(catalog):
+    return set(fixed_phrases(catalog))
+
+
+@pytest.mark.parametrize('reply, clause', [
+    # prompt 規則裡訂單總覽的大杯寫法
+    ('訂單：原味蛋餅 30 元，古早紅茶-L 30 元，總共 60 元。', '古早紅茶-L 30 元'),
+    # prompt 範例的寫法
+    ('來啦，特調飲品-古早紅茶大杯 30 元！還要啥好吃的？', '特調飲品-古早紅茶大杯 30 元'),
+    ('好喔，特調飲品-古早紅茶 20 元！', '特調飲品-古早紅茶 20 元'),
+    ('好喔，台式蛋餅-原味 30 元！', '台式蛋餅-原味 30 元'),
+])
+def test_menu_clauses_in_llm_replies_are_precomputed(phrases, reply, clause):
+    clauses = [normalize(part) for part in split_clauses(reply)]
+    assert clause in clauses
+    assert clause in phrases
+
+
+@pytest.mark.parametrize('query', ['一杯大冰紅', '一杯冰紅', '我要一份蛋餅'])
+def test_fast_path_item_clauses_are_precomputed(catalog, phrases, query):
+    reply = fast_path_response(query, cus_choice, catalog).split('```cus\n', 1)[1].rsplit('\n```', 1)[0]
+    item_clause = normalize(split_clauses(reply)[1])
+    assert item_clause in phrases
+
+
+def test_phrases_are_unique_and_normalized(catalog):
+    result = fixed_phrases(catalog)
+    assert len(result) == len(set(result))
+    assert all(phrase == normalize(phrase) for phrase in result)
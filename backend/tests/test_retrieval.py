@@ -0,0 +1,59 @@
+# File: test_retrieval.py
+# rag/retrieval.py：依意圖、品項與類別決定檢索計畫
+import os
+
+import pytest
+
+from rag.menu_catalog import load_catalog
+from rag.retrieval import NAMED_K, classify_intent, plan_retrieval
+
+DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'db', 'morning_eat.db')
+DRINKS = {'table': 'drink_item'}
+EGG_CREPES = {'class': '台式蛋餅'}
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return load_catalog(DB_FILE)
+
+
+@pytest.mark.parametrize('query, intent', [
+    ('我要一份蛋餅可以嗎', 'order'),
+    ('給我一杯奶茶好嗎', 'order'),
+    ('有什麼飲料', 'query'),
+    ('蛋餅有哪些口味', 'query'),
+    ('有賣豆漿嗎', 'query'),
+    ('奶茶是什麼', 'query'),
+    ('鮪魚玉米蛋餅多少錢', 'query'),
+    ('蛋餅不要了', 'cancel'),
+    ('就這樣', 'end'),
+    ('總共多少', 'view_cus'),
+])
+def test_classify_intent(query, intent):
+    assert classify_intent(query) == intent
+
+
+@pytest.mark.parametrize('query, intent, filter', [
+    # 問句結尾的點餐仍是點餐，檢索計畫不變
+    ('我要一份蛋餅可以嗎', 'order', EGG_CREPES),
+    ('有什麼飲料', 'query', DRINKS),
+    # 「沒了」「總共」不能蓋過句子裡的品項
+    ('再來一杯奶茶，沒了', 'order', DRINKS),
+    ('我要蛋餅就這樣', 'order', EGG_CREPES),
+    ('一份鮪魚蛋餅總共多少', 'order', EGG_CREPES),
+])
+def test_plan_keeps_retrieval_for_menu_mentions(catalog, query, intent, filter):
+    plan = plan_retrieval(query, catalog)
+    assert (plan.intent, plan.filter) == (intent, filter)
+    assert not plan.skip
+
+
+@pytest.mark.parametrize('query, intent', [('就這樣', 'end'), ('總共多少', 'view_cus'), ('沒了，結帳', 'end')])
+def test_plan_skips_retrieval_without_menu_mentions(catalog, query, intent):
+    plan = plan_retrieval(query, catalog)
+    assert plan.intent == intent and plan.skip
+
+
+def test_named_item_plan(catalog):
+    plan = plan_retrieval('我要一份鮪魚玉米蛋餅', catalog)
+    assert plan.k == NAMED_K and plan.names and plan.filter == EGG_CREPES
@@ -0,0 +1,86 @@
+# File: test_setup.py
+# setup.py 的延遲建立資源：冷啟動的行程第一次取用時不能死結，建立中的資源不會擋住其他資源或 event loop
+import asyncio
+import threading
+
+import pytest
+
+import setup
+
+
+@pytest.fixture(autouse=True)
+def cold_process():
+    setup._resources.clear()
+    setup._resource_locks.clear()
+    yield
+    setup._resources.clear()
+    setup._resource_locks.clear()
+
+
+def call_with_timeout(func, timeout: float = 5):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('value', func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"{func.__name__} 在 {timeout} 秒內沒有回傳"
+    return result['value']
+
+
+@pytest.fixture
+def fake_vectorstore(monkeypatch):
+    embedding = object()
+    monkeypatch.setattr(setup, 'init_embedding', lambda: embedding)
+    monkeypatch.setattr(setup, 'load_menu_to_vectorstore',
+                        lambda persist_directory, name, embedding_model: ('vectorstore', embedding_model))
+    return embedding
+
+
+def test_get_vectorstore_on_cold_process(fake_vectorstore):
+    # 向量庫的 factory 會再取得嵌入模型，兩者都還沒建立
+    assert call_with_timeout(setup.get_vectorstore) == ('vectorstore', fake_vectorstore)
+    assert setup.get_embedding_model() is fake_vectorstore
+    assert setup.get_vectorstore() is setup.get_vectorstore()
+
+
+def test_menu_catalog_does_not_wait_for_vectorstore(monkeypatch):
+    building, release = threading.Event(), threading.Event()
+
+    def slow_vectorstore(persist_directory, name, embedding_model):
+        building.set()
+        release.wait(5)
+        return 'vectorstore'
+
+    monkeypatch.setattr(setup, 'init_embedding', object)
+    monkeypatch.setattr(setup, 'load_menu_to_vectorstore', slow_vectorstore)
+    monkeypatch.setattr(setup, '_create_menu_catalog', lambda: 'catalog')
+    warmup = threading.Thread(target=setup.get_vectorstore, daemon=True)
+    warmup.start()
+    assert building.wait(5)
+    try:
+        assert call_with_timeout(setup.get_menu_catalog, timeout=1) == 'catalog'
+    finally:
+        release.set()
+        warmup.join(5)
+
+
+def test_async_getters_do_not_block_event_loop(monkeypatch):
+    release = threading.Event()
+
+    def slow_vectorstore(persist_directory, name, embedding_model):
+        release.wait(5)
+        return 'vectorstore'
+
+    monkeypatch.setattr(setup, 'init_embedding', object)
+    monkeypatch.setattr(setup, 'load_menu_to_vectorstore', slow_vectorstore)
+
+    async def main():
+        pending = asyncio.ensure_future(setup.aget_vectorstore())
+        # 向量庫還在 executor 執行緒建立，event loop 照樣能處理其他工作
+        await asyncio.sleep(0.05)
+        assert not pending.done()
+        release.set()
+        return await asyncio.wait_for(pending, 5)
+
+    assert asyncio.run(main()) == 'vectorstore'
+    # 已建立的資源直接回傳，不經過 executor
+    assert asyncio.run(setup.aget_vectorstore()) == 'vectorstore'
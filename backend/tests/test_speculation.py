@@ -0,0 +1,140 @@
+# File: test_speculation.py
+# rag/speculation.py：投機的檢索／LLM 結果只在確定可用時沿用
+import asyncio
+import os
+
+import pytest
+
+from rag import speculation
+from rag.menu_catalog import load_catalog
+from rag.speculation import SpeculationFailed, Speculator
+
+DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'db', 'morning_eat.db')
+CONTEXT_KEY = ('v1',)
+
+
+class CatalogStore:
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def current(self):
+        return self._catalog
+
+
+@pytest.fixture(scope='module')
+def catalog_store():
+    return CatalogStore(load_catalog(DB_FILE))
+
+
+@pytest.fixture(autouse=True)
+def fake_retrieval(monkeypatch):
+    async def aretrieve(vectorstore, text, menu):
+        return [f'doc:{text}'], speculation.plan_retrieval(text, menu)
+    monkeypatch.setattr(speculation, 'aretrieve', aretrieve)
+    monkeypatch.setattr(speculation, 'fast_path_response', lambda *args: None)
+
+
+def speculator(catalog_store, llm=True):
+    async def load_context():
+        return CONTEXT_KEY, {}, []
+    return Speculator(load_context, None, catalog_store, {}, llm=llm, debounce_ms=0)
+
+
+async def settle(spec):
+    try:
+        await spec.current.task
+    except asyncio.CancelledError:
+        pass
+
+
+def test_completed_llm_output_is_replayed(monkeypatch, catalog_store):
+    async def stream(*args, **kwargs):
+        yield '```cus\n好喔'
+        yield '！\n```'
+    monkeypatch.setattr(speculation, 'astream_rag_query', stream)
+
+    async def main():
+        spec = speculator(catalog_store)
+        spec.on_interim('我要一份鮪魚玉米蛋餅')
+        await settle(spec)
+        hit = await spec.take('我要一份鮪魚玉米蛋餅。', CONTEXT_KEY)
+        return hit.docs, [chunk async for chunk in hit.chunks]
+
+    docs, chunks = asyncio.run(main())
+    assert docs == ['doc:我要一份鮪魚玉米蛋餅']
+    assert ''.join(chunks) == '```cus\n好喔！\n```'
+
+
+def test_failed_llm_output_is_not_replayed(monkeypatch, catalog_store):
+    async def stream(*args, **kwargs):
+        assert kwargs['raise_errors']
+        yield '```sys\nintent: order\n+ 7 1 無\n'
+        raise ConnectionError('LLM disconnected')
+    monkeypatch.setattr(speculation, 'astream_rag_query', stream)
+
+    async def main():
+        spec = speculator(catalog_store)
+        spec.on_interim('我要一份鮪魚玉米蛋餅')
+        await settle(spec)
+        return await spec.take('我要一份鮪魚玉米蛋餅', CONTEXT_KEY)
+
+    hit = asyncio.run(main())
+    # 檢索結果仍可用，LLM 重新生成
+    assert hit.docs == ['doc:我要一份鮪魚玉米蛋餅'] and hit.chunks is None
+
+
+def test_failure_during_replay_raises(monkeypatch, catalog_store):
+    release = None
+
+    async def stream(*args, **kwargs):
+        yield '```sys\nintent: order\n'
+        await release.wait()
+        raise ConnectionError('LLM disconnected')
+    monkeypatch.setattr(speculation, 'astream_rag_query', stream)
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        spec = speculator(catalog_store)
+        spec.on_interim('我要一份鮪魚玉米蛋餅')
+        while not spec.current.chunks:
+            await asyncio.sleep(0.01)
+        hit = await spec.take('我要一份鮪魚玉米蛋餅', CONTEXT_KEY)
+        release.set()
+        return [chunk async for chunk in hit.chunks]
+
+    with pytest.raises(SpeculationFailed):
+        asyncio.run(main())
+
+
+def test_take_propagates_caller_cancellation(monkeypatch, catalog_store):
+    async def slow_retrieve(vectorstore, text, menu):
+        await asyncio.sleep(10)
+    monkeypatch.setattr(speculation, 'aretrieve', slow_retrieve)
+
+    async def main():
+        spec = speculator(catalog_store, llm=False)
+        spec.on_interim('我要一份鮪魚玉米蛋餅')
+        current = spec.current
+        task = asyncio.ensure_future(spec.take('我要一份鮪魚玉米蛋餅', CONTEXT_KEY))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        current.cancel()
+
+    asyncio.run(main())
+
+
+def test_cancelled_retrieval_is_a_miss(monkeypatch, catalog_store):
+    async def slow_retrieve(vectorstore, text, menu):
+        await asyncio.sleep(10)
+    monkeypatch.setattr(speculation, 'aretrieve', slow_retrieve)
+
+    async def main():
+        spec = speculator(catalog_store, llm=False)
+        spec.on_interim('我要一份鮪魚玉米蛋餅')
+        spec.current.docs.cancel()
+        return await spec.take('我要一份鮪魚玉米蛋餅', CONTEXT_KEY)
+
+    assert asyncio.run(main()) is None
@@ -0,0 +1,74 @@
+# File: test_streaming_parser.py
+# rag/rag_morning_eat.py 的 StreamingResponseParser：不論 LLM 串流在哪裡切開，解析結果都要相同
+import random
+
+import pytest
+
+from rag.rag_morning_eat import StreamingResponseParser
+
+RESPONSES = [
+    # 一般格式
+    ("```sys\nintent: order\n+ 1 1 起司\n+ 1001 2 大杯\n```\n```cus\n好喔，原味蛋餅加起司，大冰紅兩杯！還要什麼嗎？\n```",
+     ["intent: order", "+ 1 1 起司", "+ 1001 2 大杯"], "好喔，原味蛋餅加起司，大冰紅兩杯！還要什麼嗎？"),
+    # 結束標記與最後一行指令在同一行
+    ("```sys\nintent: order\n+ 1 1 無```\n```cus\n好喔，原味蛋餅一份！\n```",
+     ["intent: order", "+ 1 1 無"], "好喔，原味蛋餅一份！"),
+    # 區塊前後有多餘文字、cus 先出現、標記後有空白
+    ("好的。\n```cus \n請問還需要什麼？\n```\n```sys\nintent: query\n```",
+     ["intent: query"], "請問還需要什麼？"),
+    # cus 內容有多行
+    ("```sys\nintent: end\n```\n```cus\n總共 60 元。\n謝謝光臨！\n```",
+     ["intent: end"], "總共 60 元。\n謝謝光臨！"),
+    # 忘了寫結束標記
+    ("```sys\nintent: order\n- 1 1\n```\n```cus\n好的，已經幫你取消",
+     ["intent: order", "- 1 1"], "好的，已經幫你取消"),
+]
+
+
+def parse(chunks):
+    parser = StreamingResponseParser()
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    events += parser.close()
+    sys = [value for kind, value in events if kind == "sys"]
+    cus = "".join(value for kind, value in events if kind == "cus")
+    return sys, cus
+
+
+def split_randomly(text: str, rng: random.Random):
+    chunks, start = [], 0
+    while start < len(text):
+        size = rng.randint(1, 6)
+        chunks.append(text[start:start + size])
+        start += size
+    return chunks
+
+
+@pytest.mark.parametrize("response, sys, cus", RESPONSES)
+def test_whole_response(response, sys, cus):
+    assert parse([response]) == (sys, cus)
+
+
+@pytest.mark.parametrize("response, sys, cus", RESPONSES)
+def test_every_two_chunk_split(response, sys, cus):
+    for cut in range(1, len(response)):
+        assert parse([response[:cut], response[cut:]]) == (sys, cus), cut
+
+
+@pytest.mark.parametrize("response, sys, cus", RESPONSES)
+def test_random_chunk_boundaries(response, sys, cus):
+    rng = random.Random(0)
+    for _ in range(200):
+        assert parse(split_randomly(response, rng)) == (sys, cus)
+
+
+def test_single_characters():
+    response, sys, cus = RESPONSES[1]
+    assert parse(list(response)) == (sys, cus)
+
+
+def test_cus_streams_before_block_ends():
+    parser = StreamingResponseParser()
+    parser.feed("```sys\nintent: order\n```\n```cus\n")
+    assert parser.feed("好喔，") == [("cus", "好喔，")]
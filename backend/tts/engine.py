@@ -0,0 +1,121 @@
+# File: engine.py
+# 語音合成後端，由 TTS_ENGINE 決定：
+#   none  - 不合成（預設），/asr 只回文字
+#   piper - 本機 Piper（ONNX，CPU 即時合成，不需要網路），輸出 16-bit PCM；需要 TTS_PIPER_MODEL 指向 .onnx 聲音模型
+#   gtts  - Google Translate TTS（需要網路），輸出 mp3，直接寫進記憶體不落地
+# 引擎在每個 process 只建立一次（模型只載入一次），fork 後重建。
+import io
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from piper import PiperVoice
+except ImportError:
+    PiperVoice = None
+try:
+    from gtts import gTTS
+except ImportError:
+    gTTS = None
+
+TTS_ENGINE = os.getenv('TTS_ENGINE', 'none')
+TTS_PIPER_MODEL = os.getenv('TTS_PIPER_MODEL', './db/tts/zh_CN-huayan-medium.onnx')
+TTS_GTTS_LANG = os.getenv('TTS_GTTS_LANG', 'zh-TW')
+
+
+class TTSEngine:
+    """synthesize() 在執行緒裡呼叫，回傳一段可直接播放的音訊"""
+
+    name = "base"
+    format = ""
+    sample_rate: Optional[int] = None
+
+    @property
+    def voice(self) -> str:
+        """同一段文字換了聲音就要重新合成，快取的 key 會包含它"""
+        return ""
+
+    def synthesize(self, text: str) -> bytes:
+        raise NotImplementedError
+
+
+class PiperTTS(TTSEngine):
+    name = "piper"
+    format = "pcm_s16le"
+
+    def __init__(self, model_path: str = TTS_PIPER_MODEL):
+        if PiperVoice is None:
+            raise ImportError("piper-tts not installed (pip install piper-tts)")
+        start = time.perf_counter()
+        self.model_path = model_path
+        self._voice = PiperVoice.load(model_path)
+        self.sample_rate = self._voice.config.sample_rate
+        logger.info(f"piper voice {os.path.basename(model_path)} loaded in {time.perf_counter() - start:.1f}s")
+
+    @property
+    def voice(self) -> str:
+        return os.path.basename(self.model_path)
+
+    def synthesize(self, text: str) -> bytes:
+        if hasattr(self._voice, "synthesize_stream_raw"):
+            return b"".join(self._voice.synthesize_stream_raw(text))
+        # piper-tts 1.3 起改成逐段回傳 AudioChunk
+        return b"".join(chunk.audio_int16_bytes for chunk in self._voice.synthesize(text))
+
+
+class GoogleTranslateTTS(TTSEngine):
+    name = "gtts"
+    format = "mp3"
+
+    def __init__(self, lang: str = TTS_GTTS_LANG):
+        if gTTS is None:
+            raise ImportError("gTTS not installed (pip install gTTS)")
+        self.lang = lang
+
+    @property
+    def voice(self) -> str:
+        return self.lang
+
+    def synthesize(self, text: str) -> bytes:
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+ENGINES = {
+    "piper": PiperTTS,
+    "gtts": GoogleTranslateTTS,
+}
+
+_engine: Optional[TTSEngine] = None
+_engine_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _engine, _engine_lock
+    _engine, _engine_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def tts_enabled() -> bool:
+    return TTS_ENGINE != 'none'
+
+
+def get_tts_engine() -> Optional[TTSEngine]:
+    """TTS_ENGINE=none 時回傳 None"""
+    global _engine
+    if not tts_enabled():
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if TTS_ENGINE not in ENGINES:
+                    raise ValueError(f"Unknown TTS engine: {TTS_ENGINE} (choose from none, {', '.join(ENGINES)})")
+                _engine = ENGINES[TTS_ENGINE]()
+    return _engine
@@ -0,0 +1,170 @@
+# File: phrase_cache.py
+# 合成結果的快取，key 是「引擎｜聲音｜正規化後的文字」的 SHA-256，同一段話不論誰說、哪個 worker 都只合成一次。
+#   - 記憶體：LRU，所有合成過的短句都放
+#   - 磁碟（TTS_CACHE_DIR）：固定用語預先合成後存檔，重新啟動或多個 worker 直接讀取
+# 固定用語：歡迎詞、找不到品項的回應、結帳用語，以及菜單上每個品項「類別-名稱 價格 元」的念法
+# （與 LLM 回應的寫法一致，切句後能直接命中；大杯飲料有 prompt 的「古早紅茶-L 30 元」與
+# 範例／規則解析的「特調飲品-古早紅茶大杯 30 元」兩種寫法，都預先合成）。
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from store.conversation import GREETING
+
+from .engine import TTSEngine
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', './db/tts_cache')
+TTS_CACHE_SIZE = int(os.getenv('TTS_CACHE_SIZE', 512))
+
+# 切句的標點；逗號、頓號也切，第一段聲音可以更早送出，菜單品項也剛好落在一段裡
+CLAUSE_PUNCTUATION = "，、。！？!?；;：:\n"
+_CLAUSE_END = re.compile(f"[{re.escape(CLAUSE_PUNCTUATION)}]")
+_SPACES = re.compile(r"\s+")
+
+FIXED_REPLIES = (
+    "哎呀，沒這品項耶！可以再說清楚一點嗎？",
+    "好喔，謝謝光臨，歡迎再來！",
+    "內用還是外帶？",
+    "還要加啥？",
+    "還要啥好吃的？",
+    "要加起司、泡菜，還是套餐？",
+)
+
+
+def normalize(text: str) -> str:
+    """去掉頭尾標點與多餘空白，「30 元！」與「30 元」視為同一句"""
+    return _SPACES.sub(" ", text.strip(CLAUSE_PUNCTUATION + " \t")).strip()
+
+
+def split_clauses(text: str) -> List[str]:
+    """一段完整文字切成要分別合成的短句（保留結尾標點給合成引擎判斷語氣）"""
+    clauses, start = [], 0
+    for match in _CLAUSE_END.finditer(text):
+        clause = text[start:match.end()]
+        if normalize(clause):
+            clauses.append(clause)
+        start = match.end()
+    if normalize(text[start:]):
+        clauses.append(text[start:])
+    return clauses
+
+
+def _fmt_price(price) -> str:
+    return str(int(price)) if float(price).is_integer() else str(price)
+
+
+def fixed_phrases(catalog) -> List[str]:
+    phrases = split_clauses(GREETING)
+    for reply in FIXED_REPLIES:
+        phrases.extend(split_clauses(reply))
+    for row in catalog.tables.get('main_menu', ()):
+        phrases.append(f"{row['class']}-{row['name']} {_fmt_price(row['price'])} 元")
+    for row in catalog.tables.get('drink_item', ()):
+        for label in (f"{row['class']}-{row['name']}", row['name']):
+            phrases.append(f"{label} {_fmt_price(row['M'])} 元")
+            if row.get('L'):
+                phrases.append(f"{label}-L {_fmt_price(row['L'])} 元")
+                phrases.append(f"{label}大杯 {_fmt_price(row['L'])} 元")
+    for row in catalog.tables.get('combo_menu', ()):
+        phrases.append(f"{row['name']} {_fmt_price(row['price'])} 元")
+    # 去重但保留順序
+    return list(dict.fromkeys(normalize(phrase) for phrase in phrases if normalize(phrase)))
+
+
+class PhraseCache:
+    def __init__(self, directory: str = TTS_CACHE_DIR, maxsize: int = TTS_CACHE_SIZE):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "synth_seconds": 0.0, "precomputed": 0}
+
+    @staticmethod
+    def key(engine: TTSEngine, text: str) -> str:
+        return hashlib.sha256(f"{engine.name}|{engine.voice}|{normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _path(self, engine: TTSEngine, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.{engine.format}")
+
+    def _remember(self, key: str, audio: bytes):
+        with self._lock:
+            self._memory[key] = audio
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def get(self, engine: TTSEngine, text: str) -> Optional[bytes]:
+        key = self.key(engine, text)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return audio
+        try:
+            with open(self._path(engine, key), "rb") as f:
+                audio = f.read()
+        except OSError:
+            return None
+        self._remember(key, audio)
+        with self._lock:
+            self.stats["disk_hits"] += 1
+        return audio
+
+    def put(self, engine: TTSEngine, text: str, audio: bytes, persist: bool = False):
+        key = self.key(engine, text)
+        self._remember(key, audio)
+        if persist:
+            os.makedirs(self.directory, exist_ok=True)
+            # 先寫暫存檔再改名，其他 worker 不會讀到寫一半的檔案
+            path = self._path(engine, key)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, path)
+
+    def synthesize(self, engine: TTSEngine, text: str) -> bytes:
+        """有快取就直接回傳，否則合成後放進快取；在執行緒裡呼叫"""
+        audio = self.get(engine, text)
+        if audio is not None:
+            return audio
+        start = time.perf_counter()
+        audio = engine.synthesize(text.strip())
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["synth_seconds"] += time.perf_counter() - start
+        self.put(engine, text, audio)
+        return audio
+
+    def precompute(self, engine: TTSEngine, phrases: List[str]) -> int:
+        """固定用語預先合成並存到磁碟；已經存在的略過，回傳新合成的數量"""
+        created = 0
+        for phrase in phrases:
+            if os.path.exists(self._path(engine, self.key(engine, phrase))):
+                continue
+            self.put(engine, phrase, self.synthesize(engine, phrase), persist=True)
+            created += 1
+        with self._lock:
+            self.stats["precomputed"] = len(phrases)
+        logger.info(f"TTS phrase cache: {len(phrases)} fixed phrases, {created} newly synthesized")
+        return created
+
+    def summary(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "synth_seconds": round(self.stats["synth_seconds"], 3),
+                "entries": len(self._memory),
+                "hit_rate": round((self.stats["hits"] + self.stats["disk_hits"]) / lookups, 3) if lookups else None,
+            }
+
+
+phrase_cache = PhraseCache()
@@ -0,0 +1,192 @@
+# File: speaker.py
+# 把 LLM 串流出來的顧客回應邊生成邊念出來，經由 /asr websocket 送回前端（前端以 /asr?tts=1 連線才會開啟）：
+#   {"type": "tts_start", "format": "pcm_s16le" | "mp3", "sample_rate": 22050}
+#   二進位訊息 × N（音訊片段，每段最多 TTS_CHUNK_BYTES）
+#   {"type": "tts_end"}
+# 回應每湊滿一個短句（逗號、句號等）就開始合成，第一句好了就先送，不等整段回應生成完；
+# 合成先查 phrase_cache，固定用語與菜單品項直接用預先合成好的音訊。
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from .engine import TTSEngine, get_tts_engine
+from .phrase_cache import CLAUSE_PUNCTUATION, normalize, phrase_cache
+
+logger = logging.getLogger(__name__)
+
+TTS_WORKERS = int(os.getenv('TTS_WORKERS', 1))
+TTS_CHUNK_BYTES = int(os.getenv('TTS_CHUNK_BYTES', 16384))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _reset_after_fork():
+    global _executor
+    _executor = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+    return _executor
+
+
+_stats_lock = threading.Lock()
+_totals = {"utterances": 0, "clauses": 0, "bytes_sent": 0, "cancelled": 0}
+_first_audio: Deque[float] = deque(maxlen=200)
+
+
+def tts_stats() -> Dict:
+    with _stats_lock:
+        ordered = sorted(_first_audio)
+        return {
+            **_totals,
+            # 收到顧客的句子到送出第一段回應音訊的時間
+            "first_audio_ms": {
+                "avg": round(sum(ordered) / len(ordered) * 1000, 1),
+                "p50": round(ordered[len(ordered) // 2] * 1000, 1),
+                "p95": round(ordered[int(len(ordered) * 0.95)] * 1000, 1),
+            } if ordered else None,
+            "cache": phrase_cache.summary(),
+        }
+
+
+class ClauseSplitter:
+    """串流文字累積到標點就切出一個短句"""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def push(self, delta: str) -> List[str]:
+        self._buffer += delta
+        clauses = []
+        start = 0
+        for index, char in enumerate(self._buffer):
+            if char in CLAUSE_PUNCTUATION:
+                clauses.append(self._buffer[start:index + 1])
+                start = index + 1
+        self._buffer = self._buffer[start:]
+        return [clause for clause in clauses if normalize(clause)]
+
+    def flush(self) -> List[str]:
+        rest, self._buffer = self._buffer, ""
+        return [rest] if normalize(rest) else []
+
+
+class SpeechStream:
+    """一段回應的語音；由 Speaker.stream() 建立"""
+
+    def __init__(self, speaker: "Speaker"):
+        self._speaker = speaker
+        self._splitter = ClauseSplitter()
+        # 每個短句一收到就開始合成，送出時依原本順序
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._fed = False
+        self._started_at = time.perf_counter()
+
+    def feed(self, delta: str):
+        self._fed = True
+        for clause in self._splitter.push(delta):
+            self._enqueue(clause)
+
+    def _enqueue(self, clause: str):
+        loop = asyncio.get_running_loop()
+        synthesis = loop.run_in_executor(_get_executor(), phrase_cache.synthesize, self._speaker.engine, clause)
+        self._pending.put_nowait(synthesis)
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        engine = self._speaker.engine
+        async with self._speaker.lock:
+            await self._speaker.send_json({"type": "tts_start", "format": engine.format,
+                                           "sample_rate": engine.sample_rate})
+            first = True
+            try:
+                while True:
+                    synthesis = await self._pending.get()
+                    if synthesis is None:
+                        break
+                    try:
+                        audio = await synthesis
+                    except Exception as e:
+                        # 合成失敗的短句略過，其餘照常念完
+                        logger.error(f"TTS synthesis failed, skipping clause: {e}")
+                        continue
+                    for start in range(0, len(audio), TTS_CHUNK_BYTES):
+                        await self._speaker.send_bytes(audio[start:start + TTS_CHUNK_BYTES])
+                    if first and audio:
+                        first = False
+                        with _stats_lock:
+                            _first_audio.append(time.perf_counter() - self._started_at)
+                    with _stats_lock:
+                        _totals["clauses"] += 1
+                        _totals["bytes_sent"] += len(audio)
+            finally:
+                # 中途失敗或被取消（顧客插話）也要送 tts_end，前端才知道這段語音結束了
+                try:
+                    await self._speaker.send_json({"type": "tts_end"})
+                except Exception as e:
+                    logger.warning(f"Failed to send tts_end: {e}")
+
+    async def finish(self, text: Optional[str] = None):
+        """回應結束：念完剩下的文字並等到全部送出；沒有串流過文字時念 text"""
+        if not self._fed and text:
+            self.feed(text)
+        for clause in self._splitter.flush():
+            self._enqueue(clause)
+        if self._task is None:
+            return
+        self._pending.put_nowait(None)
+        with _stats_lock:
+            _totals["utterances"] += 1
+        await self._task
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            with _stats_lock:
+                _totals["cancelled"] += 1
+
+
+class Speaker:
+    """每個 /asr 連線一個；同一時間只送一段語音，避免兩段音訊交錯"""
+
+    def __init__(self, engine: TTSEngine, send_json: Callable[[Dict], Awaitable[None]],
+                 send_bytes: Callable[[bytes], Awaitable[None]]):
+        self.engine = engine
+        self.send_json = send_json
+        self.send_bytes = send_bytes
+        self.lock = asyncio.Lock()
+
+    def stream(self) -> SpeechStream:
+        return SpeechStream(self)
+
+    async def say(self, text: str):
+        speech = self.stream()
+        try:
+            await speech.finish(text)
+        finally:
+            speech.cancel()
+
+
+def create_speaker(websocket) -> Optional[Speaker]:
+    """TTS_ENGINE=none 或引擎無法載入時回傳 None，/asr 照常只回文字（引擎通常在預熱時已載入）"""
+    try:
+        engine = get_tts_engine()
+    except Exception as e:
+        logger.error(f"TTS engine unavailable, replies will be text only: {e}")
+        return None
+    if engine is None:
+        return None
+    return Speaker(engine, websocket.send_json, websocket.send_bytes)
@@ -0,0 +1,213 @@
+# File: warmup.py
+# worker 啟動後在背景預熱各項資源（菜單、向量庫、嵌入模型、LLM 連線、Redis），啟動本身不等待；
+# 每項資源的狀態給 /healthz、/readyz 回報。還沒預熱好的資源在請求第一次用到時照樣會建立（setup.py 的 get_xxx）。
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from rag.query_cache import embed_query
+from rag.rag_morning_eat import static_prompt_prefix
+from rag.useModel import model_registry
+from rag import query_cache
+from setup import get_menu_catalog, get_redis_client, get_vectorstore
+from store.redis_pool import redis_client
+from tts.engine import get_tts_engine, tts_enabled
+from tts.phrase_cache import fixed_phrases, phrase_cache
+
+logger = logging.getLogger(__name__)
+
+# 沒有這些資源時無法接單，/readyz 以它們為準；其餘只影響第一個請求的延遲
+REQUIRED_RESOURCES = ('redis', 'menu_catalog', 'vectorstore')
+PROBE_QUERY = "我要一份蛋餅"
+# 預熱失敗後的重試間隔（秒，指數成長到上限）
+WARMUP_RETRY_MAX = 30.0
+WARMUP_OPTIONAL_ATTEMPTS = 3
+# /get-token 觸發預熱的最短間隔（秒）
+PREWARM_INTERVAL = float(os.getenv('PREWARM_INTERVAL', 60))
+
+_started_at = time.monotonic()
+_status: Dict[str, Dict] = {}
+_task: Optional[asyncio.Task] = None
+_prewarm_task: Optional[asyncio.Task] = None
+# mark_unavailable 為每項失效的資源各自排的重試任務（不受啟動預熱是否還在跑影響）
+_retry_tasks: Dict[str, asyncio.Task] = {}
+_prewarmed_at = 0.0
+
+
+def _reset_after_fork():
+    # 背景任務屬於父行程的 event loop，子行程在自己的 startup 重新預熱
+    global _task, _prewarm_task, _prewarmed_at, _started_at
+    _task, _prewarm_task, _prewarmed_at, _started_at = None, None, 0.0, time.monotonic()
+    _status.clear()
+    _retry_tasks.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _set(name: str, state: str, **extra):
+    _status[name] = {"status": state, **extra}
+
+
+def _probe_embedding(fresh: bool = False):
+    """讓 Ollama 把嵌入模型載入記憶體；fresh=True 時略過查詢快取，確實打到模型"""
+    embeddings = get_vectorstore().embeddings
+    if fresh:
+        embeddings.embed_query(PROBE_QUERY)
+    else:
+        embed_query(embeddings, PROBE_QUERY)
+
+
+def _warm_llm():
+    """建立 LLM client 並預熱固定前綴（Ollama 載入權重與 KV、Gemini 建立 context cache）"""
+    model_registry.with_prefix(None, static_prompt_prefix())
+
+
+def _attach_query_cache():
+    query_cache.attach_redis(get_redis_client())
+
+
+def _precompute_tts():
+    """載入語音合成引擎，把歡迎詞、固定回應與菜單品項先合成好（已存在磁碟的略過）"""
+    phrase_cache.precompute(get_tts_engine(), fixed_phrases(get_menu_catalog().current()))
+
+
+def _steps() -> List[Tuple[str, Callable]]:
+    steps = [
+        ('menu_catalog', get_menu_catalog),
+        ('vectorstore', get_vectorstore),
+        ('embedding', _probe_embedding),
+        ('llm', _warm_llm),
+    ]
+    if os.getenv('QUERY_CACHE_REDIS', '0') == '1':
+        # 查詢向量與檢索結果存到 Redis，所有 worker 共用
+        steps.append(('query_cache_redis', _attach_query_cache))
+    if tts_enabled():
+        steps.append(('tts_phrases', _precompute_tts))
+    return steps
+
+
+async def _run_step(name: str, step: Callable, loop) -> bool:
+    _set(name, 'loading')
+    start = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(step):
+            await step()
+        else:
+            await loop.run_in_executor(None, step)
+    except Exception as e:
+        logger.warning(f"warm-up {name} failed: {e}")
+        _set(name, 'error', error=str(e), seconds=round(time.perf_counter() - start, 3))
+        return False
+    _set(name, 'ready', seconds=round(time.perf_counter() - start, 3))
+    return True
+
+
+async def _ping_redis():
+    await redis_client().ping()
+
+
+async def _run_steps(pending: List[Tuple[str, Callable]], loop) -> List[Tuple[str, Callable]]:
+    # 依序執行（embedding 需要 vectorstore），回傳失敗的步驟
+    failed = []
+    for name, step in pending:
+        if not await _run_step(name, step, loop):
+            failed.append((name, step))
+    return failed
+
+
+async def _warm_up(names: Optional[Tuple[str, ...]] = None):
+    loop = asyncio.get_running_loop()
+    pending = [step for step in _steps() + [('redis', _ping_redis)] if names is None or step[0] in names]
+    for name, _ in pending:
+        _set(name, 'pending')
+    backoff, attempt = 1.0, 1
+    while True:
+        redis_step = [step for step in pending if step[0] == 'redis']
+        results = await asyncio.gather(
+            _run_steps([step for step in pending if step[0] != 'redis'], loop),
+            _run_steps(redis_step, loop),
+        )
+        # 必要資源一直重試；其他資源失敗只重試幾次，之後留給第一個請求
+        pending = [step for step in results[0] + results[1]
+                   if step[0] in REQUIRED_RESOURCES or attempt < WARMUP_OPTIONAL_ATTEMPTS]
+        if not pending:
+            logger.info(f"worker warm-up finished in {time.monotonic() - _started_at:.1f}s (pid {os.getpid()})")
+            return
+        attempt += 1
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, WARMUP_RETRY_MAX)
+
+
+def start_warmup(names: Optional[Tuple[str, ...]] = None):
+    """在 app startup 呼叫，背景執行、不阻塞啟動；names 指定時只重新預熱這幾項"""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(_warm_up(names))
+
+
+async def stop_warmup():
+    global _task, _prewarm_task
+    for task in (_task, _prewarm_task, *_retry_tasks.values()):
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _task, _prewarm_task = None, None
+    _retry_tasks.clear()
+
+
+async def _prewarm():
+    loop = asyncio.get_running_loop()
+    await _run_step('embedding', lambda: _probe_embedding(fresh=True), loop)
+    await _run_step('llm', _warm_llm, loop)
+
+
+def schedule_prewarm():
+    """
+    新 session 建立時呼叫：這個 worker 閒置一段時間後 Ollama 可能已卸載模型，
+    趁顧客還沒開口先把嵌入模型與 LLM 叫醒。最多每 PREWARM_INTERVAL 秒一次，背景執行。
+    """
+    global _prewarm_task, _prewarmed_at
+    if _task is not None and not _task.done():
+        return  # 啟動預熱還在跑
+    if _prewarm_task is not None and not _prewarm_task.done():
+        return
+    if time.monotonic() - _prewarmed_at < PREWARM_INTERVAL:
+        return
+    _prewarmed_at = time.monotonic()
+    _prewarm_task = asyncio.get_running_loop().create_task(_prewarm())
+
+
+def mark_unavailable(name: str, error: Exception):
+    """啟動後才失效的資源（例如 Redis 斷線）；標記錯誤並在背景重試到恢復"""
+    _set(name, 'error', error=str(error))
+    task = _retry_tasks.get(name)
+    if task is None or task.done():
+        # 啟動預熱可能還在重試其他資源，不能靠它接手，這項資源自己排一個重試任務
+        _retry_tasks[name] = asyncio.get_running_loop().create_task(_warm_up((name,)))
+
+
+def mark_ready(name: str):
+    _set(name, 'ready')
+
+
+def state(name: str) -> Optional[str]:
+    return _status.get(name, {}).get('status')
+
+
+def is_ready() -> bool:
+    return all(state(name) == 'ready' for name in REQUIRED_RESOURCES)
+
+
+def status() -> Dict:
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.monotonic() - _started_at, 1),
+        "ready": is_ready(),
+        "resources": {name: dict(value, required=name in REQUIRED_RESOURCES) for name, value in _status.items()},
+    }
@@ -0,0 +1,137 @@
+# File: bench_nlu.py
+# 比較 main.py 意圖／實體模型的記憶體與延遲：
+#   two-models  原本的做法：兩個 bert-base-chinese（分類 + 標註），每句 tokenize 兩次、forward 兩次，沒有 inference_mode
+#   shared      共用編碼器的兩頭模型（fp32，inference_mode）
+#   shared-int8 同上，torch 動態量化成 int8
+#   onnx-int8   匯出成 ONNX 並 int8 量化，用 onnxruntime 推論（沒有匯出過會先匯出到 --onnx-dir）
+# 每種設定在獨立的子行程量測，記憶體才不會互相影響。
+#   python bench_nlu.py --runs 200
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CONFIGS = ["two-models", "shared", "shared-int8", "onnx-int8"]
+SENTENCES = [
+    "我要兩份牛肉漢堡和一杯可樂",
+    "薯條一份",
+    "請問有什麼飲料",
+    "給我一個牛肉漢堡，飲料要可樂，再加一份薯條",
+]
+
+
+def rss_mb() -> float:
+    """目前行程的常駐記憶體（MB）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def build(config: str, onnx_dir: str):
+    """回傳一個 analyze(text) 函式"""
+    if config == "two-models":
+        import torch
+        from transformers import BertTokenizer, BertForSequenceClassification, BertForTokenClassification
+        from nlu_model import decode_entities, BASE_MODEL
+
+        intent_tokenizer = BertTokenizer.from_pretrained(BASE_MODEL)
+        intent_model = BertForSequenceClassification.from_pretrained(BASE_MODEL, num_labels=2)
+        entity_tokenizer = BertTokenizer.from_pretrained(BASE_MODEL)
+        entity_model = BertForTokenClassification.from_pretrained(BASE_MODEL, num_labels=3)
+
+        def analyze(text):
+            inputs = intent_tokenizer(text, return_tensors="pt")
+            intent = torch.argmax(intent_model(**inputs).logits, dim=1).item()
+            inputs = entity_tokenizer(text, return_tensors="pt")
+            predictions = torch.argmax(entity_model(**inputs).logits, dim=2)
+            tokens = entity_tokenizer.convert_ids_to_tokens(inputs["input_ids"].squeeze().tolist())
+            return intent, decode_entities(tokens, predictions.squeeze().tolist())
+        return analyze
+
+    import nlu_model
+    if config == "onnx-int8":
+        path = os.path.join(onnx_dir, "nlu-int8.onnx")
+        if not os.path.exists(path):
+            nlu_model.export_onnx(onnx_dir)
+        nlu_model.NLU_ONNX_PATH = path
+        nlu = nlu_model.load_nlu("onnx")
+    else:
+        nlu = nlu_model.load_nlu("torch-int8" if config == "shared-int8" else "torch")
+    return nlu.analyze
+
+
+def run_child(config: str, runs: int, onnx_dir: str) -> dict:
+    baseline = rss_mb()
+    start = time.perf_counter()
+    analyze = build(config, onnx_dir)
+    load_seconds = time.perf_counter() - start
+    loaded = rss_mb()
+    for sentence in SENTENCES:  # 暖機
+        analyze(sentence)
+    latencies = []
+    for i in range(runs):
+        sentence = SENTENCES[i % len(SENTENCES)]
+        start = time.perf_counter()
+        analyze(sentence)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "config": config,
+        "load_s": round(load_seconds, 2),
+        "model_mb": round(loaded - baseline, 1),
+        "peak_rss_mb": round(rss_mb(), 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py 意圖／實體模型的記憶體與延遲比較")
+    parser.add_argument("--configs", nargs="+", default=CONFIGS, choices=CONFIGS)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=0, help="torch／onnxruntime 執行緒數（0 為預設）")
+    parser.add_argument("--onnx-dir", default="./models")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.threads:
+        os.environ["NLU_THREADS"] = str(args.threads)
+        os.environ["OMP_NUM_THREADS"] = str(args.threads)
+    if args.child:
+        if args.threads:
+            import torch
+            torch.set_num_threads(args.threads)
+        print(json.dumps(run_child(args.child, args.runs, args.onnx_dir)))
+        return
+
+    results = []
+    for config in args.configs:
+        command = [sys.executable, __file__, "--child", config, "--runs", str(args.runs),
+                   "--threads", str(args.threads), "--onnx-dir", args.onnx_dir]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"{config} 失敗：{output.stderr.strip().splitlines()[-1] if output.stderr.strip() else output.returncode}")
+            continue
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"{'config':<12} {'load_s':>7} {'model_mb':>9} {'peak_mb':>8} {'p50_ms':>8} {'p95_ms':>8} {'mean_ms':>8}")
+    for r in results:
+        print(f"{r['config']:<12} {r['load_s']:>7} {r['model_mb']:>9} {r['peak_rss_mb']:>8} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['mean_ms']:>8}")
+    base = next((r for r in results if r["config"] == "two-models"), None)
+    if base:
+        for r in results:
+            if r is not base:
+                print(f"{r['config']}: 記憶體 {r['model_mb'] / base['model_mb']:.0%}、"
+                      f"p50 延遲 {r['p50_ms'] / base['p50_ms']:.0%}（相對 two-models）")
+
+
+if __name__ == "__main__":
+    main()
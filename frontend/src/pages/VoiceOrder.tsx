@@ -16,9 +16,10 @@ interface ChatMessage {
 }
 
 interface WebSocketMessage {
-  type: 'cus' | 'llm' | 'error' | 'close' | 'success' | 'end' | "order";
+  type: 'cus' | 'llm' | 'llm_delta' | 'error' | 'close' | 'success' | 'end' | "order";
   transcript?: string;
   response?: string;
+  delta?: string;
   msg?: string;
   diff?: Array<any>;
 }
@@ -72,6 +73,7 @@ export const LiveTranscription: React.FC = () => {
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const isReconnectingRef = useRef<boolean>(false);
   const isMountedRef = useRef<boolean>(true);
+  const streamingMessageIdRef = useRef<number | null>(null);
   
   const lastTouchDistance = useRef<number>(0);
   const isDragging = useRef<boolean>(false);
@@ -287,6 +289,8 @@ export const LiveTranscription: React.FC = () => {
 
       socket.onmessage = (message) => {
         if (!isMountedRef.current) return;
+        // 語音回覆的音訊是二進位訊息（/asr?tts=1 才會送），這裡只處理 JSON 文字訊息
+        if (typeof message.data !== 'string') return;
         
         try {
           const data: WebSocketMessage = JSON.parse(message.data);
@@ -299,12 +303,34 @@ export const LiveTranscription: React.FC = () => {
                 setChatMessages(prev => [...prev, userMessage]);
               }
               break;
-            case 'llm':
+            case 'llm_delta':
+              if (data.delta) {
+                const delta = data.delta;
+                const streamingId = streamingMessageIdRef.current;
+                if (streamingId === null) {
+                  const id = Date.now();
+                  streamingMessageIdRef.current = id;
+                  setChatMessages(prev => [...prev, { id, type: 'bot', message: delta, timestamp: new Date() }]);
+                } else {
+                  setChatMessages(prev => prev.map(msg => msg.id === streamingId ? { ...msg, message: msg.message + delta } : msg));
+                }
+              }
+              break;
+            case 'llm': {
+              // 串流中的訊息以完整回應取代
+              const streamingId = streamingMessageIdRef.current;
+              streamingMessageIdRef.current = null;
               if (data.response) {
-                const botMessage: ChatMessage = { id: Date.now(), type: 'bot', message: data.response, timestamp: new Date() };
-                setChatMessages(prev => [...prev, botMessage]);
+                const response = data.response;
+                if (streamingId !== null) {
+                  setChatMessages(prev => prev.map(msg => msg.id === streamingId ? { ...msg, message: response } : msg));
+                } else {
+                  const botMessage: ChatMessage = { id: Date.now(), type: 'bot', message: response, timestamp: new Date() };
+                  setChatMessages(prev => [...prev, botMessage]);
+                }
               }
               break;
+            }
             case 'error':
               setError(data.msg || 'Unknown error');
               break;
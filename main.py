@@ -1,10 +1,12 @@
+import io
+from functools import lru_cache
+import numpy as np
 import torch
-from transformers import BertTokenizer, BertForSequenceClassification, BertForTokenClassification
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 import torchaudio
 from gtts import gTTS
 from flask import Flask, request, send_file
-import os
+from nlu_model import load_nlu
 
 # 初始化 Flask 應用
 app = Flask(__name__)
@@ -20,20 +22,28 @@ MENU = {
     "可樂": 30
 }
 
-# 載入BERT模型和tokenizer
-intent_tokenizer = BertTokenizer.from_pretrained('bert-base-chinese')
-intent_model = BertForSequenceClassification.from_pretrained('bert-base-chinese', num_labels=2)  # 意圖：點餐、查詢
-entity_tokenizer = BertTokenizer.from_pretrained('bert-base-chinese')
-entity_model = BertForTokenClassification.from_pretrained('bert-base-chinese', num_labels=3)  # 標籤：O, B-ITEM, I-ITEM
+# 意圖（點餐、查詢）與實體（O, B-ITEM, I-ITEM）共用一個 BERT 編碼器，預設用 int8 ONNX 推論（見 nlu_model.py）
+nlu = load_nlu()
+
+SAMPLE_RATE = 16000
+
+# 重新取樣的 kernel 只在第一次遇到該取樣率時建立，之後共用（Resample 不保存狀態，可跨執行緒使用）
+@lru_cache(maxsize=8)
+def get_resampler(orig_freq):
+    return torchaudio.transforms.Resample(orig_freq, SAMPLE_RATE)
+
+# 上傳的音訊直接在記憶體解碼成 16 kHz 單聲道 NumPy 陣列，不寫暫存檔
+def load_audio(data):
+    waveform, sample_rate = torchaudio.load(io.BytesIO(data))
+    waveform = waveform.mean(dim=0)  # 多聲道取平均
+    if sample_rate != SAMPLE_RATE:
+        waveform = get_resampler(sample_rate)(waveform)
+    return waveform.numpy()
 
 # 語音轉文字
-def speech_to_text(audio_path):
-    waveform, sample_rate = torchaudio.load(audio_path)
-    if sample_rate != 16000:
-        resampler = torchaudio.transforms.Resample(sample_rate, 16000)
-        waveform = resampler(waveform)
-    input_values = processor(waveform.squeeze().numpy(), sampling_rate=16000, return_tensors="pt").input_values
-    with torch.no_grad():
+def speech_to_text(audio: np.ndarray):
+    input_values = processor(audio, sampling_rate=SAMPLE_RATE, return_tensors="pt").input_values
+    with torch.inference_mode():
         logits = model(input_values).logits
     predicted_ids = torch.argmax(logits, dim=-1)
     transcription = processor.batch_decode(predicted_ids)[0]
@@ -41,36 +51,11 @@ def speech_to_text(audio_path):
 
 # 意圖識別
 def get_intent(text):
-    inputs = intent_tokenizer(text, return_tensors="pt")
-    outputs = intent_model(**inputs)
-    logits = outputs.logits
-    intent_id = torch.argmax(logits, dim=1).item()
-    intents = ["點餐", "查詢"]
-    return intents[intent_id]
+    return nlu.analyze(text).intent
 
 # 實體抽取
 def extract_entities(text):
-    inputs = entity_tokenizer(text, return_tensors="pt")
-    outputs = entity_model(**inputs)
-    logits = outputs.logits
-    predictions = torch.argmax(logits, dim=2)
-    tokens = entity_tokenizer.convert_ids_to_tokens(inputs["input_ids"].squeeze().tolist())
-    entities = []
-    current_entity = ""
-    for token, prediction in zip(tokens, predictions.squeeze().tolist()):
-        if prediction == 1:  # B-ITEM
-            if current_entity:
-                entities.append(current_entity)
-            current_entity = token
-        elif prediction == 2:  # I-ITEM
-            current_entity += token
-        else:
-            if current_entity:
-                entities.append(current_entity)
-                current_entity = ""
-    if current_entity:
-        entities.append(current_entity)
-    return entities
+    return nlu.analyze(text).entities
 
 # 解析數量（簡單示例）
 def extract_quantity(text):
@@ -80,11 +65,12 @@ def extract_quantity(text):
 
 # 解析訂單
 def parse_order(text):
-    intent = get_intent(text)
-    if intent != "點餐":
+    # 一次推論同時取得意圖與實體
+    analysis = nlu.analyze(text)
+    if analysis.intent != "點餐":
         return None, "您想查詢菜單嗎？"
     
-    entities = extract_entities(text)
+    entities = analysis.entities
     order = []
     quantity = extract_quantity(text)  # 提取數量
     for entity in entities:
@@ -93,11 +79,12 @@ def parse_order(text):
             order.append({"item": entity, "quantity": quantity, "price": MENU[entity] * quantity})
     return order, None
 
-# 文字轉語音
-def text_to_speech(text, output_file="response.mp3"):
-    tts = gTTS(text=text, lang='zh-tw')
-    tts.save(output_file)
-    return output_file
+# 文字轉語音（寫進記憶體，每個請求各自一份）
+def text_to_speech(text):
+    buffer = io.BytesIO()
+    gTTS(text=text, lang='zh-tw').write_to_fp(buffer)
+    buffer.seek(0)
+    return buffer
 
 # Flask API 端點
 @app.route("/order", methods=["POST"])
@@ -105,11 +92,12 @@ def process_order():
     if "audio" not in request.files:
         return {"error": "No audio file provided"}, 400
     
-    audio_file = request.files["audio"]
-    audio_path = "temp_audio.wav"
-    audio_file.save(audio_path)
+    try:
+        audio = load_audio(request.files["audio"].read())
+    except Exception:
+        return {"error": "Unsupported or corrupted audio file"}, 400
     
-    text = speech_to_text(audio_path)
+    text = speech_to_text(audio)
     if not text:
         response_text = "抱歉，我沒聽懂您的點餐，請再說一次。"
     else:
@@ -123,8 +111,8 @@ def process_order():
             order_summary = ", ".join(f"{item['quantity']}份{item['item']}" for item in order)
             response_text = f"您的訂單是：{order_summary}，總金額 {total} 元。請確認是否正確。"
     
-    output_audio = text_to_speech(response_text)
-    return send_file(output_audio, mimetype="audio/mpeg")
+    return send_file(text_to_speech(response_text), mimetype="audio/mpeg", download_name="response.mp3")
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # 沒有共用的暫存檔，請求可以並行處理
+    app.run(debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,200 @@
+# File: nlu_model.py
+# main.py 的意圖識別與實體抽取共用同一個 BERT 編碼器：
+#   - 一次 tokenize、一次 forward，同時得到意圖（pooler 輸出接分類頭）與每個 token 的 BIO 標籤（序列輸出接標註頭）
+#   - 推論用 torch.inference_mode()
+#   - 可匯出成 ONNX 並做 int8 動態量化，用 onnxruntime 在 CPU 上推論（NLU_BACKEND=onnx）
+# 匯出：python nlu_model.py export --out models
+import argparse
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+from transformers import BertModel, BertTokenizerFast
+
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    ort = None
+
+BASE_MODEL = os.getenv("NLU_BASE_MODEL", "bert-base-chinese")
+INTENTS = ["點餐", "查詢"]
+TAGS = ["O", "B-ITEM", "I-ITEM"]
+# torch（fp32）/ torch-int8（torch 動態量化）/ onnx（onnxruntime int8）
+NLU_BACKEND = os.getenv("NLU_BACKEND", "onnx")
+NLU_ONNX_PATH = os.getenv("NLU_ONNX_PATH", "./models/nlu-int8.onnx")
+# 兩個分類頭微調後的權重（state_dict），沒有時與原本一樣是隨機初始化
+NLU_HEADS_PATH = os.getenv("NLU_HEADS_PATH", "./models/nlu-heads.pt")
+NLU_THREADS = int(os.getenv("NLU_THREADS", 0))
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+class IntentEntityModel(nn.Module):
+    """一個編碼器、兩個頭，結構與 BertForSequenceClassification / BertForTokenClassification 的頭相同"""
+
+    def __init__(self, encoder: BertModel, num_intents: int = len(INTENTS), num_tags: int = len(TAGS)):
+        super().__init__()
+        self.encoder = encoder
+        hidden = encoder.config.hidden_size
+        self.dropout = nn.Dropout(encoder.config.hidden_dropout_prob)
+        self.intent_head = nn.Linear(hidden, num_intents)
+        self.entity_head = nn.Linear(hidden, num_tags)
+
+    @classmethod
+    def from_pretrained(cls, name: str = BASE_MODEL, heads_path: Optional[str] = NLU_HEADS_PATH) -> "IntentEntityModel":
+        model = cls(BertModel.from_pretrained(name))
+        if heads_path and os.path.exists(heads_path):
+            model.load_heads(heads_path)
+        return model.eval()
+
+    def heads_state_dict(self):
+        return {key: value for key, value in self.state_dict().items() if not key.startswith("encoder.")}
+
+    def load_heads(self, path: str):
+        self.load_state_dict(torch.load(path, map_location="cpu"), strict=False)
+
+    def forward(self, input_ids, attention_mask, token_type_ids) -> Tuple[torch.Tensor, torch.Tensor]:
+        outputs = self.encoder(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+        intent_logits = self.intent_head(self.dropout(outputs.pooler_output))
+        tag_logits = self.entity_head(self.dropout(outputs.last_hidden_state))
+        return intent_logits, tag_logits
+
+
+@dataclass
+class Analysis:
+    intent: str
+    entities: List[str]
+
+
+def decode_entities(tokens: List[str], tag_ids: List[int]) -> List[str]:
+    """BIO 標籤組成品項名稱（去掉 BERT 的 ## 分詞符號）"""
+    entities = []
+    current_entity = ""
+    for token, prediction in zip(tokens, tag_ids):
+        if token in ("[CLS]", "[SEP]", "[PAD]"):
+            prediction = 0
+        if prediction == 1:  # B-ITEM
+            if current_entity:
+                entities.append(current_entity)
+            current_entity = token
+        elif prediction == 2:  # I-ITEM
+            current_entity += token
+        else:
+            if current_entity:
+                entities.append(current_entity)
+                current_entity = ""
+    if current_entity:
+        entities.append(current_entity)
+    return [entity.replace("##", "") for entity in entities]
+
+
+class TorchRunner:
+    def __init__(self, model: IntentEntityModel, quantize: bool = False):
+        if quantize:
+            # Linear 層權重轉 int8，推論時動態量化輸入
+            model = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        self.model = model.eval()
+        self.name = "torch-int8" if quantize else "torch"
+
+    def __call__(self, encoded) -> Tuple[np.ndarray, np.ndarray]:
+        with torch.inference_mode():
+            intent_logits, tag_logits = self.model(**{key: torch.from_numpy(encoded[key]) for key in INPUT_NAMES})
+        return intent_logits.numpy(), tag_logits.numpy()
+
+
+class OnnxRunner:
+    def __init__(self, path: str = NLU_ONNX_PATH, threads: int = NLU_THREADS):
+        if ort is None:
+            raise ImportError("onnxruntime not installed (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.name = "onnx-int8"
+
+    def __call__(self, encoded) -> Tuple[np.ndarray, np.ndarray]:
+        intent_logits, tag_logits = self.session.run(None, {key: encoded[key] for key in INPUT_NAMES})
+        return intent_logits, tag_logits
+
+
+class NLU:
+    """一次 tokenize + 一次推論同時得到意圖與實體"""
+
+    def __init__(self, tokenizer: BertTokenizerFast, runner):
+        self.tokenizer = tokenizer
+        self.runner = runner
+
+    def analyze(self, text: str) -> Analysis:
+        encoded = self.tokenizer(text, return_tensors="np")
+        encoded = {key: encoded[key].astype(np.int64) for key in INPUT_NAMES}
+        intent_logits, tag_logits = self.runner(encoded)
+        tokens = self.tokenizer.convert_ids_to_tokens(encoded["input_ids"][0].tolist())
+        return Analysis(
+            intent=INTENTS[int(intent_logits[0].argmax())],
+            entities=decode_entities(tokens, tag_logits[0].argmax(-1).tolist()),
+        )
+
+
+def load_nlu(backend: str = NLU_BACKEND, name: str = BASE_MODEL) -> NLU:
+    """onnx 需要先匯出模型；模型或 onnxruntime 不存在時退回 torch"""
+    tokenizer = BertTokenizerFast.from_pretrained(name)
+    if backend == "onnx":
+        if ort is not None and os.path.exists(NLU_ONNX_PATH):
+            return NLU(tokenizer, OnnxRunner())
+        print(f"找不到 {NLU_ONNX_PATH} 或 onnxruntime，改用 torch int8（可用 python nlu_model.py export 匯出）")
+        backend = "torch-int8"
+    return NLU(tokenizer, TorchRunner(IntentEntityModel.from_pretrained(name), quantize=backend == "torch-int8"))
+
+
+def export_onnx(out_dir: str = "./models", name: str = BASE_MODEL, quantize: bool = True) -> str:
+    """匯出 fp32 ONNX，再以 int8 動態量化（權重 int8，啟動值推論時量化）"""
+    if quantize and ort is None:
+        raise ImportError("onnxruntime not installed (pip install onnxruntime)")
+    os.makedirs(out_dir, exist_ok=True)
+    model = IntentEntityModel.from_pretrained(name)
+    tokenizer = BertTokenizerFast.from_pretrained(name)
+    sample = tokenizer("我要兩份牛肉漢堡和一杯可樂", return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "nlu-fp32.onnx")
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            tuple(sample[key] for key in INPUT_NAMES),
+            fp32_path,
+            input_names=INPUT_NAMES,
+            output_names=["intent_logits", "tag_logits"],
+            dynamic_axes={**{key: {0: "batch", 1: "sequence"} for key in INPUT_NAMES},
+                          "intent_logits": {0: "batch"}, "tag_logits": {0: "batch", 1: "sequence"}},
+            opset_version=14,
+        )
+    if not quantize:
+        return fp32_path
+    int8_path = os.path.join(out_dir, "nlu-int8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"ONNX 匯出完成：{fp32_path}（{os.path.getsize(fp32_path) / 2**20:.0f} MB）→ "
+          f"{int8_path}（{os.path.getsize(int8_path) / 2**20:.0f} MB）")
+    return int8_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共用編碼器的意圖／實體模型")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="匯出 int8 量化的 ONNX 模型")
+    export.add_argument("--out", default=os.path.dirname(NLU_ONNX_PATH) or ".")
+    export.add_argument("--model", default=BASE_MODEL)
+    export.add_argument("--no-quantize", action="store_true")
+    analyze = sub.add_parser("analyze", help="分析一句話")
+    analyze.add_argument("text")
+    analyze.add_argument("--backend", default=NLU_BACKEND)
+    args = parser.parse_args()
+    if args.command == "export":
+        export_onnx(args.out, args.model, quantize=not args.no_quantize)
+    else:
+        print(load_nlu(args.backend).analyze(args.text))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,36 @@
 # Flask API 部署點餐系統
+import subprocess
+
 from flask import Flask, request, send_file
-from voice_ordering import process_voice_order
-import os
+from voice_ordering import decode_audio, get_service
 
 app = Flask(__name__)
+# 啟動時就載入 Whisper、向量資料庫並預熱 LLM，第一個請求不用等
+service = get_service()
 
 @app.route('/order', methods=['POST'])
 def order():
     if 'audio' not in request.files:
         return {"error": "請上傳語音檔案"}, 400
-    
-    audio_file = request.files['audio']
-    audio_path = "temp_input.wav"
-    audio_file.save(audio_path)
 
-    # 處理語音訂單
+    # 上傳的音訊直接在記憶體解碼，回應也從記憶體送出，沒有共用的暫存檔，請求可以並行處理
     try:
-        output_audio = process_voice_order(audio_path)
-        return send_file(output_audio, mimetype='audio/mpeg')
-    finally:
-        # 清理臨時檔案
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-        if os.path.exists(output_audio):
-            os.remove(output_audio)
+        audio = decode_audio(request.files['audio'].read())
+    except subprocess.CalledProcessError:
+        return {"error": "無法解碼語音檔案"}, 400
+
+    # 處理語音訂單（在服務的 worker pool 裡執行，各階段的並行數有上限）
+    result = service.process(audio)
+    response = send_file(result.audio, mimetype='audio/mpeg', download_name='response.mp3')
+    # 各階段耗時（毫秒），瀏覽器開發者工具的 Timing 分頁可直接看到
+    response.headers['Server-Timing'] = result.server_timing()
+    return response
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """各階段耗時統計"""
+    return service.stats.summary()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    # 關掉 reloader，模型才不會在重新載入用的子行程再載入一次
+    app.run(host="0.0.0.0", port=8000, debug=True, threaded=True, use_reloader=False)
@@ -15,6 +15,9 @@ except Exception as e:
     print(f"嵌入模型載入失敗：{e}")
     raise e
 
+# 生成回應的 Ollama 模型
+LLM_MODEL = "gemma3:1b"
+
 # 從 Chroma 載入向量資料庫
 def load_menu_to_vectorstore(persist_directory="./chroma_db"):
     try:
@@ -191,7 +194,7 @@ def rag_query(query, vectorstore, order_state):
 
     # 用 Ollama 生成回應
     try:
-        response = ollama.generate(model="gemma3:1b", prompt=prompt, options={
+        response = ollama.generate(model=LLM_MODEL, prompt=prompt, options={
             "temperature": 0.8,
             "top_k": 40,
             "top_p": 0.95,
@@ -1,60 +1,197 @@
-import pyaudio
-import wave
-import numpy as np
-import whisper
+# File: voice_test.py
+# 即時語音轉文字（本機 Whisper）：
+#   1. 錄音執行緒（producer）只負責讀麥克風，以 16 kHz int16 寫進記憶體中的環狀緩衝區，不寫暫存檔
+#   2. 主執行緒依 VAD 斷句：有聲音開始一句、靜音 ENDPOINT_MS 後結束，不再固定切 2 秒
+#   3. 直接把 NumPy 陣列交給 Whisper 解碼；預設使用 faster-whisper 的 int8 CPU 推論，沒裝時退回 openai-whisper
+#   4. 說話途中每 PARTIAL_INTERVAL 秒解碼一次目前這句，顯示暫時結果
+# 每句結束後印出音訊長度、解碼時間、real-time factor 與延遲（最後一個有聲音的 frame 到結果出來）。
+#   pip install faster-whisper pyaudio
 import os
+import threading
 import time
 from threading import Event
+from typing import Optional, Tuple
+
+import numpy as np
+import pyaudio
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+try:
+    import whisper
+except ImportError:
+    whisper = None
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
 
 # 錄音參數
-CHUNK = 1024
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
-RATE = 44100
-SEGMENT_DURATION = 2  # 每段錄音秒數
-SILENCE_THRESHOLD = 500  # 無聲閾值
+RATE = 16000  # Whisper 的取樣率，麥克風不支援時以裝置預設取樣率錄音再重新取樣
+FRAME_MS = 30  # VAD 判斷的單位
+FRAME = RATE * FRAME_MS // 1000
+RING_SECONDS = 30  # 環狀緩衝區長度，解碼落後時錄音仍不會中斷
+# 斷句參數
+SILENCE_THRESHOLD = 500  # 無聲閾值（RMS，webrtcvad 沒裝時使用）
+PREROLL_MS = 300  # 句子開頭往前多取的音訊
+ENDPOINT_MS = 500  # 靜音多久算一句結束
+MIN_SPEECH_MS = 200  # 短於此的聲音視為雜音
+MAX_SEGMENT_SECONDS = 15  # 一句最長秒數，超過就先解碼
+PARTIAL_INTERVAL = 1.0  # 暫時結果的間隔秒數（0 關閉）
 SILENCE_LIMIT = 6  # 連續無聲秒數，結束錄音
-WAVE_OUTPUT_FILENAME = "temp_speech.wav"
+# 模型參數
+MODEL_SIZE = os.getenv("WHISPER_MODEL", "base")
+COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", 0))
+
+
+class RingBuffer:
+    """固定大小的 int16 環狀緩衝區，以「開始錄音後的第幾個樣本」定位"""
+
+    def __init__(self, seconds: int = RING_SECONDS, rate: int = RATE):
+        self.rate = rate
+        self.buffer = np.zeros(seconds * rate, dtype=np.int16)
+        self.total = 0  # 已寫入的樣本數
+        self.last_write = time.perf_counter()
+        self.overruns = 0
+        self._cond = threading.Condition()
+
+    def write(self, samples: np.ndarray):
+        size = len(self.buffer)
+        with self._cond:
+            start = self.total % size
+            first = min(len(samples), size - start)
+            self.buffer[start:start + first] = samples[:first]
+            self.buffer[:len(samples) - first] = samples[first:]
+            self.total += len(samples)
+            self.last_write = time.perf_counter()
+            self._cond.notify_all()
+
+    def wait(self, position: int, timeout: float) -> int:
+        """等到 position 之後有新資料，回傳目前寫到哪裡"""
+        with self._cond:
+            if self.total <= position:
+                self._cond.wait(timeout)
+            return self.total
+
+    def oldest(self) -> int:
+        return max(self.total - len(self.buffer), 0)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """取出 [start, end) 的樣本（複製一份）；已被覆寫的部分會跳過"""
+        size = len(self.buffer)
+        with self._cond:
+            if start < self.total - size:
+                self.overruns += 1
+                start = self.total - size
+            end = min(end, self.total)
+            if end <= start:
+                return np.zeros(0, dtype=np.int16)
+            indices = np.arange(start, end) % size
+            return self.buffer[indices]
+
+    def time_of(self, position: int) -> float:
+        """估計第 position 個樣本被錄到的時間（perf_counter）"""
+        with self._cond:
+            return self.last_write - (self.total - position) / self.rate
+
+
+class Recorder(threading.Thread):
+    """錄音執行緒：讀麥克風寫進環狀緩衝區"""
+
+    def __init__(self, p: pyaudio.PyAudio, ring: RingBuffer, stop_event: Event):
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.stop_event = stop_event
+        self.p = p
+        self.device_rate = RATE
+        try:
+            self.stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=FRAME)
+        except (OSError, ValueError):
+            # 麥克風不支援 16 kHz，用裝置預設取樣率錄，再線性內插成 16 kHz
+            self.device_rate = int(p.get_default_input_device_info()["defaultSampleRate"])
+            self.stream = p.open(format=FORMAT, channels=CHANNELS, rate=self.device_rate, input=True,
+                                 frames_per_buffer=self.device_rate * FRAME_MS // 1000)
+
+    def _resample(self, samples: np.ndarray) -> np.ndarray:
+        if self.device_rate == RATE:
+            return samples
+        count = int(round(len(samples) * RATE / self.device_rate))
+        positions = np.linspace(0, len(samples) - 1, count)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+
+    def run(self):
+        chunk = self.device_rate * FRAME_MS // 1000
+        try:
+            while not self.stop_event.is_set():
+                data = self.stream.read(chunk, exception_on_overflow=False)
+                self.ring.write(self._resample(np.frombuffer(data, dtype=np.int16)))
+        finally:
+            self.stream.stop_stream()
+            self.stream.close()
+
+
+class SpeechDetector:
+    """判斷一個 frame 是否有人聲；有 webrtcvad 就用，沒有就用 RMS 閾值"""
+
+    def __init__(self, aggressiveness: int = 2):
+        self.vad = webrtcvad.Vad(aggressiveness) if webrtcvad is not None else None
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        if self.vad is not None:
+            return self.vad.is_speech(frame.tobytes(), RATE)
+        return np.sqrt(np.mean(frame.astype(np.float32) ** 2)) >= SILENCE_THRESHOLD
+
+
+class WhisperDecoder:
+    """直接解碼 float32 NumPy 陣列，回傳 (文字, 解碼秒數)"""
+
+    def __init__(self, model_size: str = MODEL_SIZE):
+        start = time.perf_counter()
+        if WhisperModel is not None:
+            self.model = WhisperModel(model_size, device="cpu", compute_type=COMPUTE_TYPE, cpu_threads=CPU_THREADS)
+            self.runtime = f"faster-whisper ({COMPUTE_TYPE})"
+        elif whisper is not None:
+            print("faster-whisper 未安裝，改用 openai-whisper（較慢）")
+            self.model = whisper.load_model(model_size)
+            self.runtime = "openai-whisper"
+        else:
+            raise ImportError("請安裝 faster-whisper 或 openai-whisper")
+        print(f"模型 {model_size} 載入完成（{self.runtime}，{time.perf_counter() - start:.1f} 秒）")
+
+    def transcribe(self, samples: np.ndarray) -> Tuple[str, float]:
+        audio = samples.astype(np.float32) / 32768.0
+        start = time.perf_counter()
+        try:
+            if WhisperModel is not None:
+                segments, _ = self.model.transcribe(audio, language="zh", beam_size=1,
+                                                    condition_on_previous_text=False, without_timestamps=True)
+                text = "".join(segment.text for segment in segments)
+            else:
+                text = self.model.transcribe(audio, language="zh", fp16=False)["text"]
+        except Exception as e:
+            print(f"轉錄失敗：{e}")
+            text = ""
+        return text.strip(), time.perf_counter() - start
+
 
 class RealtimeSpeechToText:
     def __init__(self):
         self.p = pyaudio.PyAudio()
-        self.model = whisper.load_model("base")
+        self.decoder = WhisperDecoder()
+        self.detector = SpeechDetector()
+        self.ring = RingBuffer()
         self.stop_event = Event()
         self.transcribed_text = ""
+        self.stats = []  # 每句的 (音訊秒數, 解碼秒數, 延遲秒數)
 
-    def record_segment(self, stream, duration):
-        frames = []
-        for _ in range(0, int(RATE / CHUNK * duration)):
-            if self.stop_event.is_set():
-                break
-            data = stream.read(CHUNK, exception_on_overflow=False)
-            frames.append(data)
-        return frames
-
-    def save_segment(self, frames):
-        wf = wave.open(WAVE_OUTPUT_FILENAME, 'wb')
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(self.p.get_sample_size(FORMAT))
-        wf.setframerate(RATE)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-
-    def is_silent(self, frames):
-        audio_data = np.frombuffer(b''.join(frames), dtype=np.int16)
-        rms = np.sqrt(np.mean(audio_data**2))
-        return rms < SILENCE_THRESHOLD
-
-    def transcribe_segment(self):
-        if not os.path.exists(WAVE_OUTPUT_FILENAME):
-            print("錯誤：音訊檔案未生成")
-            return ""
-        try:
-            result = self.model.transcribe(WAVE_OUTPUT_FILENAME, language="zh")
-            return result["text"]
-        except Exception as e:
-            print(f"轉錄失敗：{e}")
-            return ""
+    def display_partial(self, text):
+        print("\r" + " " * 100, end="", flush=True)
+        print(f"\r（辨識中）{text}", end="", flush=True)
 
     def display_text(self, text):
         if text:
@@ -63,47 +200,96 @@ class RealtimeSpeechToText:
             print("\r" + " " * 100, end="", flush=True)
             print(f"\r即時文字：{self.transcribed_text}", end="", flush=True)
 
+    def finish_segment(self, start: int, end: int, last_speech: int) -> str:
+        audio = self.ring.read(start, end)
+        text, decode_seconds = self.decoder.transcribe(audio)
+        audio_seconds = len(audio) / RATE
+        latency = time.perf_counter() - self.ring.time_of(last_speech)
+        self.stats.append((audio_seconds, decode_seconds, latency))
+        print()
+        self.display_text(text)
+        print(f"\n  [音訊 {audio_seconds:.2f}s｜解碼 {decode_seconds:.2f}s｜RTF {decode_seconds / audio_seconds:.2f}"
+              f"｜延遲 {latency * 1000:.0f}ms]")
+        return text
+
     def run(self):
-        stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
+        recorder = Recorder(self.p, self.ring, self.stop_event)
+        recorder.start()
         print("開始即時語音轉文字，請說話（說「結束」或保持沉默 6 秒以停止）...")
-        
-        silence_counter = 0
-        
+
+        preroll = PREROLL_MS * RATE // 1000
+        endpoint = ENDPOINT_MS * RATE // 1000
+        min_speech = MIN_SPEECH_MS * RATE // 1000
+        max_segment = MAX_SEGMENT_SECONDS * RATE
+        silence_limit = SILENCE_LIMIT * RATE
+
+        position = 0  # 下一個要判斷的 frame
+        segment_start: Optional[int] = None
+        speech_samples = 0
+        last_speech = 0
+        segment_end = 0  # 上一句的結尾，下一句的 pre-roll 不往前超過這裡（強制切段時才不會重複解碼）
+        last_partial = time.perf_counter()
+
         while not self.stop_event.is_set():
-            frames = self.record_segment(stream, SEGMENT_DURATION)
-            
-            if self.is_silent(frames):
-                silence_counter += SEGMENT_DURATION
-                if silence_counter >= SILENCE_LIMIT:
-                    print("\n偵測到長時間無聲，結束轉錄")
-                    self.stop_event.set()
-                    break
-            else:
-                silence_counter = 0
-            
-            self.save_segment(frames)
-            text = self.transcribe_segment()
-            if text:
-                print()  # 換行以顯示新文字
-                self.display_text(text)
-                if "結束" in text:
-                    print("\n偵測到「結束」指令，停止轉錄")
-                    self.stop_event.set()
-                    break
-            
-            if os.path.exists(WAVE_OUTPUT_FILENAME):
-                os.remove(WAVE_OUTPUT_FILENAME)
-        
-        stream.stop_stream()
-        stream.close()
+            available = self.ring.wait(position, timeout=0.5)
+            # 解碼太慢被覆寫時，從還保留的最舊資料繼續
+            position = max(position, self.ring.oldest())
+            while position + FRAME <= available and not self.stop_event.is_set():
+                frame = self.ring.read(position, position + FRAME)
+                position += FRAME
+                if self.detector.is_speech(frame):
+                    if segment_start is None:
+                        segment_start = max(position - FRAME - preroll, self.ring.oldest(), segment_end)
+                        speech_samples = 0
+                        last_partial = time.perf_counter()
+                    speech_samples += FRAME
+                    last_speech = position
+                    # 一直沒停頓時，句子到達長度上限也要先切一段，否則緩衝區會被覆寫、暫時結果越解越長
+                    if position - segment_start < max_segment:
+                        continue
+                elif segment_start is None:
+                    if position - last_speech >= silence_limit:
+                        print("\n偵測到長時間無聲，結束轉錄")
+                        self.stop_event.set()
+                    continue
+                elif position - last_speech < endpoint and position - segment_start < max_segment:
+                    continue
+                # 一句結束（靜音夠久，或到達長度上限）
+                if speech_samples >= min_speech:
+                    text = self.finish_segment(segment_start, position, last_speech)
+                    if "結束" in text:
+                        print("\n偵測到「結束」指令，停止轉錄")
+                        self.stop_event.set()
+                segment_start, segment_end = None, position
+                # 解碼期間的音訊還在緩衝區裡，下一輪接著判斷
+                break
+
+            # 說話中：定時對目前這句解碼一次，顯示暫時結果
+            if (segment_start is not None and PARTIAL_INTERVAL
+                    and time.perf_counter() - last_partial >= PARTIAL_INTERVAL):
+                last_partial = time.perf_counter()
+                partial, _ = self.decoder.transcribe(self.ring.read(segment_start, position))
+                if partial:
+                    self.display_partial(partial)
+
+        recorder.join(timeout=1)
         self.p.terminate()
-        
+
         print("\n最終轉錄結果：")
         print(self.transcribed_text if self.transcribed_text else "無轉錄內容")
+        if self.stats:
+            audio_total = sum(s[0] for s in self.stats)
+            decode_total = sum(s[1] for s in self.stats)
+            latencies = sorted(s[2] for s in self.stats)
+            print(f"共 {len(self.stats)} 句，音訊 {audio_total:.1f}s，RTF {decode_total / audio_total:.2f}，"
+                  f"延遲中位數 {latencies[len(latencies) // 2] * 1000:.0f}ms（{self.decoder.runtime}）")
+        if self.ring.overruns:
+            print(f"解碼落後，緩衝區被覆寫 {self.ring.overruns} 次")
+
 
 def main():
     speech_to_text = RealtimeSpeechToText()
     speech_to_text.run()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
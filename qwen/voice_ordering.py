@@ -1,40 +1,264 @@
 # 語音點餐系統（整合 Whisper 和 gTTS）
+# VoiceOrderingService 常駐在行程裡：Whisper、向量資料庫與 LLM 只在啟動時載入一次，
+# 請求交給有上限的 worker pool，每個請求依序經過 ASR → RAG/LLM → TTS，不同請求的階段可以重疊
+# （A 在合成語音時 B 已經在辨識）。每個階段各自限制並行數，並記錄耗時。
+#   python voice_ordering.py [run] user_input.wav                # 單一檔案，輸出 response.mp3（不寫子命令預設為 run）
+#   python voice_ordering.py batch a.wav b.wav --asr-workers 2   # 批次並行辨識
+import argparse
+import io
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import ollama
 import whisper
 from gtts import gTTS
-import os
-from qwen.rag_mcdonalds import load_menu_to_vectorstore, rag_query
+from mcdonalds.rag_mcdonalds import LLM_MODEL, load_menu_to_vectorstore, rag_query
+
+SAMPLE_RATE = 16000
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+# 同時處理的請求數（含排隊中的 TTS 等階段）
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", 4))
+# Whisper 模型份數：每份一次只能解碼一段（解碼時會在模型上掛 kv-cache hook），多份才能並行辨識
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", 1))
+# 同時送進 LLM 的請求數（Ollama 預設一次只處理一個）
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", 1))
+STAGES = ("decode", "asr", "rag", "tts")
+
+AudioInput = Union[str, bytes, np.ndarray]
+
+
+# 上傳的音訊經由 pipe 交給 ffmpeg 解碼並重新取樣成 16 kHz 單聲道，不寫暫存檔（Whisper 本身也依賴 ffmpeg）
+def decode_audio(data: bytes) -> np.ndarray:
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+           "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+    result = subprocess.run(cmd, input=data, capture_output=True, check=True)
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def load_audio(audio: AudioInput) -> np.ndarray:
+    """檔案路徑、原始檔案內容或已解碼的陣列都轉成 16 kHz float32 陣列"""
+    if isinstance(audio, np.ndarray):
+        return audio
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            audio = f.read()
+    return decode_audio(audio)
+
+
+# 文字轉語音（寫進記憶體）
+def text_to_speech(text):
+    buffer = io.BytesIO()
+    gTTS(text=text, lang="zh-TW").write_to_fp(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def new_order_state():
+    return {"items": [], "total_price": 0, "status": "ongoing"}
+
+
+@dataclass
+class OrderResult:
+    user_query: str
+    response: str
+    audio: Optional[io.BytesIO]
+    order_state: Dict
+    timings: Dict[str, float] = field(default_factory=dict)  # 各階段秒數（含 queue 排隊時間與 total）
+
+    def server_timing(self) -> str:
+        """HTTP Server-Timing header（毫秒）"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items())
+
+
+class StageStats:
+    """各階段耗時統計（本行程）"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples: Dict[str, List[float]] = {}
+
+    def record(self, timings: Dict[str, float]):
+        with self._lock:
+            for name, seconds in timings.items():
+                samples = self._samples.setdefault(name, [])
+                samples.append(seconds)
+                del samples[:-self._window]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            result = {}
+            for name, samples in self._samples.items():
+                ordered = sorted(samples)
+                result[name] = {
+                    "count": len(ordered),
+                    "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[int(len(ordered) * 0.95)] * 1000, 1),
+                }
+            return result
+
+
+class VoiceOrderingService:
+    def __init__(self, workers: int = VOICE_WORKERS, asr_workers: int = ASR_WORKERS,
+                 llm_workers: int = LLM_WORKERS, warm_llm: bool = True):
+        start = time.perf_counter()
+        # 每份 Whisper 模型放進 queue，辨識時借出、用完歸還
+        self._whisper_models: "queue.Queue" = queue.Queue()
+        for _ in range(asr_workers):
+            self._whisper_models.put(whisper.load_model(WHISPER_MODEL))
+        self.asr_workers = asr_workers
+        self.vectorstore = load_menu_to_vectorstore()
+        # 先查一次，讓嵌入模型與 Chroma 的索引都載入
+        self.vectorstore.similarity_search("大麥克", k=1)
+        if warm_llm:
+            self._warm_llm()
+        self._llm_slots = threading.BoundedSemaphore(llm_workers)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="voice-order")
+        self.stats = StageStats()
+        print(f"語音點餐服務啟動完成（{time.perf_counter() - start:.1f} 秒，"
+              f"{workers} workers／{asr_workers} Whisper／{llm_workers} LLM）")
+
+    @staticmethod
+    def _warm_llm():
+        """讓 Ollama 先把模型載入記憶體（空的 prompt 只載入、不生成）"""
+        try:
+            ollama.generate(model=LLM_MODEL, prompt="")
+        except Exception as e:
+            print(f"LLM 預熱失敗：{e}")
+
+    def speech_to_text(self, audio: np.ndarray) -> str:
+        model = self._whisper_models.get()
+        try:
+            return model.transcribe(audio, fp16=False)["text"]
+        finally:
+            self._whisper_models.put(model)
+
+    def _process(self, audio: AudioInput, order_state: Optional[Dict], tts: bool, submitted: float) -> OrderResult:
+        timings = {"queue": time.perf_counter() - submitted}
+
+        def timed(name, func, *args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                timings[name] = time.perf_counter() - start
+
+        samples = timed("decode", load_audio, audio)
+        # 轉語音為文字
+        user_query = timed("asr", self.speech_to_text, samples)
+        print(f"用戶說: {user_query}")
+
+        # 用 RAG 檢索並生成回應
+        with self._llm_slots:
+            response, order_state = timed("rag", rag_query, user_query, self.vectorstore,
+                                          order_state or new_order_state())
+        print(f"助手回: {response}")
+
+        # 轉回應為語音
+        output_audio = timed("tts", text_to_speech, response) if tts else None
+        timings["total"] = time.perf_counter() - submitted
+        self.stats.record(timings)
+        return OrderResult(user_query, response, output_audio, order_state, timings)
+
+    def submit(self, audio: AudioInput, order_state: Optional[Dict] = None, tts: bool = True) -> Future:
+        """非同步處理一筆語音訂單，回傳 Future[OrderResult]"""
+        return self._pool.submit(self._process, audio, order_state, tts, time.perf_counter())
+
+    def process(self, audio: AudioInput, order_state: Optional[Dict] = None, tts: bool = True) -> OrderResult:
+        return self.submit(audio, order_state, tts).result()
+
+    def transcribe_batch(self, files: List[str]) -> List[Dict]:
+        """批次模式：多個音訊檔並行解碼與辨識（並行數為 Whisper 模型份數）"""
+        def transcribe(path):
+            start = time.perf_counter()
+            samples = load_audio(path)
+            decoded = time.perf_counter()
+            text = self.speech_to_text(samples)
+            timings = {"decode": decoded - start, "asr": time.perf_counter() - decoded}
+            self.stats.record(timings)
+            return {"file": path, "text": text, "audio_s": round(len(samples) / SAMPLE_RATE, 2),
+                    "timings_ms": {name: round(seconds * 1000, 1) for name, seconds in timings.items()}}
+
+        with ThreadPoolExecutor(max_workers=self.asr_workers, thread_name_prefix="voice-batch") as pool:
+            return list(pool.map(transcribe, files))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+_service: Optional[VoiceOrderingService] = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> VoiceOrderingService:
+    """行程內共用的服務（第一次呼叫時載入模型）"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = VoiceOrderingService()
+    return _service
+
 
-# 初始化 Whisper 模型
-whisper_model = whisper.load_model("base")
+# 語音點餐流程，回傳 mp3 的 BytesIO
+def process_voice_order(audio):
+    return get_service().process(audio).audio
 
-# 語音轉文字
-def speech_to_text(audio_file):
-    result = whisper_model.transcribe(audio_file)
-    return result["text"]
 
-# 文字轉語音
-def text_to_speech(text, output_file="response.mp3"):
-    tts = gTTS(text=text, lang="zh-TW")
-    tts.save(output_file)
-    return output_file
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="語音點餐")
+    sub = parser.add_subparsers(dest="command")
+    run = sub.add_parser("run", help="處理單一音訊檔，回應存成 response.mp3")
+    run.add_argument("audio_file", nargs="?", default="user_input.wav")  # 請錄製語音檔案
+    batch = sub.add_parser("batch", help="多個音訊檔並行辨識")
+    batch.add_argument("files", nargs="+")
+    batch.add_argument("--asr-workers", type=int, default=max(ASR_WORKERS, 2))
+    batch.add_argument("--full", action="store_true", help="每個檔案都跑完整流程（RAG/LLM、TTS），回應存到 --out")
+    batch.add_argument("--out", default="responses")
+    argv = sys.argv[1:] if argv is None else argv
+    # 沒有子命令時與舊版相同：處理單一檔案（預設 user_input.wav）
+    if not argv or argv[0] not in sub.choices and argv[0] not in ("-h", "--help"):
+        argv = ["run", *argv]
+    args = parser.parse_args(argv)
 
-# 語音點餐流程
-def process_voice_order(audio_file):
-    # 轉語音為文字
-    user_query = speech_to_text(audio_file)
-    print(f"用戶說: {user_query}")
+    if args.command == "batch":
+        service = VoiceOrderingService(asr_workers=args.asr_workers, warm_llm=args.full)
+        start = time.perf_counter()
+        if args.full:
+            os.makedirs(args.out, exist_ok=True)
+            futures = [(path, service.submit(path)) for path in args.files]
+            for path, future in futures:
+                result = future.result()
+                output = os.path.join(args.out, os.path.splitext(os.path.basename(path))[0] + ".mp3")
+                with open(output, "wb") as f:
+                    f.write(result.audio.getvalue())
+                print(json.dumps({"file": path, "text": result.user_query, "response": result.response,
+                                  "timings_ms": {k: round(v * 1000, 1) for k, v in result.timings.items()}},
+                                 ensure_ascii=False))
+        else:
+            for item in service.transcribe_batch(args.files):
+                print(json.dumps(item, ensure_ascii=False))
+        print(f"共 {len(args.files)} 個檔案，{time.perf_counter() - start:.1f} 秒")
+        print(json.dumps(service.stats.summary(), ensure_ascii=False, indent=2))
+        service.shutdown()
+        return
 
-    # 用 RAG 檢索並生成回應
-    vectorstore = load_menu_to_vectorstore()
-    response = rag_query(user_query, vectorstore)
-    print(f"助手回: {response}")
+    result = get_service().process(args.audio_file)
+    with open("response.mp3", "wb") as f:
+        f.write(result.audio.getvalue())
+    print("語音回應已儲存至: response.mp3")
+    print(f"各階段耗時: {result.server_timing()}")
 
-    # 轉回應為語音
-    audio_output = text_to_speech(response)
-    return audio_output
 
 if __name__ == "__main__":
-    # 假設有錄好的語音輸入
-    audio_file = "user_input.wav"  # 請錄製語音檔案
-    output_audio = process_voice_order(audio_file)
-    print(f"語音回應已儲存至: {output_audio}")
\ No newline at end of file
+    main()